@@ -4,7 +4,9 @@ This integrate Celery with Django and RabbitMQ for asynchronous task process
 """
 
 import os
+import time
 from celery import Celery
+from celery.signals import celeryd_init, task_prerun, task_postrun, task_failure
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_travel_app.settings')
 
@@ -19,3 +21,51 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+@celeryd_init.connect
+def apply_queue_worker_options(sender=None, conf=None, options=None, **kwargs):
+    '''
+    Tune prefetch and ack behaviour for a worker from the queues it consumes.
+    e.g. `celery -A alx_travel_app worker -Q payments` gets the payments profile.
+    '''
+    from django.conf import settings
+
+    queues = (options or {}).get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    profiles = [settings.CELERY_QUEUE_WORKER_OPTIONS[q] for q in queues
+                if q in settings.CELERY_QUEUE_WORKER_OPTIONS]
+    if not profiles:
+        return
+
+    # A worker shared by several queues uses the most conservative profile
+    conf.worker_prefetch_multiplier = min(p['prefetch_multiplier'] for p in profiles)
+    conf.task_acks_late = any(p['acks_late'] for p in profiles)
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    '''Remember when a task started executing'''
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_failure.connect
+def mark_task_failed(task_id=None, **kwargs):
+    '''Flag a failed task so the postrun handler records it as a failure'''
+    _task_started[task_id] = (_task_started.get(task_id), True)
+
+
+@task_postrun.connect
+def record_task_timing(task_id=None, task=None, **kwargs):
+    '''Record per-task latency and throughput metrics'''
+    from listings.metrics import record_timing
+
+    started = _task_started.pop(task_id, None)
+    failed = isinstance(started, tuple)
+    if failed:
+        started = started[0]
+    if started is None or task is None:
+        return
+    record_timing('tasks', task.name, time.perf_counter() - started, failed=failed)
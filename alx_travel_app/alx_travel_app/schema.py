@@ -0,0 +1,151 @@
+"""
+Precomputed OpenAPI schema serving.
+The schema is generated once per code version (at deploy with
+`python manage.py build_schema`, or on the first request), kept in memory
+and on disk next to schema.yaml, and served with an ETag and a pre-gzipped
+body. It is only regenerated when the code version changes. Requests for a
+translated (?lang=) or versioned (?version=) schema are still generated per
+request by drf-spectacular, as before.
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from drf_spectacular.generators import SchemaGenerator
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView
+
+SCHEMA_FORMATS = {
+    'yaml': ('application/vnd.oai.openapi', OpenApiYamlRenderer),
+    'json': ('application/vnd.oai.openapi+json', OpenApiJsonRenderer),
+}
+
+SKIP_DIRS = {'__pycache__', 'migrations', 'venv', '.venv', 'node_modules', 'celery-broker'}
+
+_lock = threading.Lock()
+_schemas = {}
+
+
+@lru_cache(maxsize=1)
+def code_version():
+    '''APP_VERSION when set, otherwise a hash of the project's Python sources'''
+    if settings.APP_VERSION:
+        return settings.APP_VERSION
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(settings.BASE_DIR):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.startswith('.'))
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, settings.BASE_DIR).encode())
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def schema_path(version, fmt):
+    '''On-disk location of a rendered schema'''
+    return settings.SCHEMA_CACHE_DIR / f'schema-{version}.{fmt}'
+
+
+def _entry(body):
+    '''Pre-compute the ETag and gzipped body served for a schema'''
+    return {
+        'body': body,
+        'gzip': gzip.compress(body, compresslevel=9),
+        'etag': '"%s"' % hashlib.sha256(body).hexdigest()[:32],
+    }
+
+
+def build_schema(version=None):
+    '''Generate the schema in every format and write it to disk'''
+    version = version or code_version()
+    schema = SchemaGenerator().get_schema(request=None, public=True)
+    for fmt, (_, renderer_class) in SCHEMA_FORMATS.items():
+        body = renderer_class().render(schema, renderer_context={})
+        path = schema_path(version, fmt)
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        tmp.write_bytes(body)
+        os.replace(tmp, path)
+        _schemas[(version, fmt)] = _entry(body)
+
+    # Drop schemas rendered for older code versions
+    for fmt in SCHEMA_FORMATS:
+        for stale in settings.SCHEMA_CACHE_DIR.glob(f'schema-*.{fmt}'):
+            if stale != schema_path(version, fmt):
+                stale.unlink(missing_ok=True)
+    return version
+
+
+def get_schema(fmt):
+    '''Return the cached schema entry for the current code version'''
+    version = code_version()
+    entry = _schemas.get((version, fmt))
+    if entry is not None:
+        return entry
+
+    with _lock:
+        entry = _schemas.get((version, fmt))
+        if entry is None:
+            path = schema_path(version, fmt)
+            if path.exists():
+                entry = _schemas[(version, fmt)] = _entry(path.read_bytes())
+            else:
+                build_schema(version)
+                entry = _schemas[(version, fmt)]
+    return entry
+
+
+def accepts_gzip(accept_encoding):
+    '''Whether an Accept-Encoding header allows gzip, honouring q-values (gzip;q=0 refuses it)'''
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0))) > 0
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    '''
+    Drop-in replacement for SpectacularAPIView that serves the precomputed
+    schema instead of re-introspecting every ViewSet on each request.
+    '''
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        # Only the default schema is precomputed; translated or versioned ones are generated as usual
+        wants_lang = settings.USE_I18N and request.GET.get('lang')
+        version = self.api_version or request.version or self._get_version_parameter(request)
+        if wants_lang or version:
+            return super().get(request, *args, **kwargs)
+
+        fmt = 'json' if request.accepted_renderer.format == 'json' else 'yaml'
+        entry = get_schema(fmt)
+
+        if request.headers.get('If-None-Match') == entry['etag']:
+            response = HttpResponseNotModified()
+        elif accepts_gzip(request.headers.get('Accept-Encoding', '')):
+            response = HttpResponse(entry['gzip'], content_type=SCHEMA_FORMATS[fmt][0])
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(entry['body'], content_type=SCHEMA_FORMATS[fmt][0])
+
+        response['ETag'] = entry['etag']
+        response['Cache-Control'] = 'public, no-cache'
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        return response
@@ -17,10 +17,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from drf_spectacular.views import (
-    SpectacularAPIView,
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
+from .schema import CachedSpectacularAPIView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -28,8 +28,8 @@ urlpatterns = [
     # API routes for listings and bookings
     path('api/', include('listings.urls')),
 
-    # DRF Spectacular schema and documentation routes
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
+    # DRF Spectacular schema (precomputed per code version) and documentation routes
+    path('api/schema/', CachedSpectacularAPIView.as_view(), name='schema'),
     path('swagger/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     path('redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
     
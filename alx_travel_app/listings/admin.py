@@ -1,3 +1,213 @@
-from django.contrib import admin
+"""
+Admin site for the listings app.
+Changelists are built to stay fast on very large tables: related rows are
+joined instead of fetched per row, foreign keys use autocomplete widgets
+instead of rendering every row in a <select>, filters and ordering follow
+indexed columns, row counts are capped, and bulk actions are single UPDATEs.
+"""
 
-# Register your models here.
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import (
+    User, Listing, Booking, Review, Payment, RateRule, ArchivedBooking, ArchivedPayment,
+    CalendarFeed, CalendarBlock, BOOKING_STATUS, STATUS_CHOICES,
+)
+from .calendars import invalidate_feeds
+from .transitions import TRANSITIONS
+
+# Changelists never count more rows than this
+COUNT_CAP = 10000
+
+
+class CappedCountPaginator(Paginator):
+    '''
+    Paginator whose count stops at COUNT_CAP rows. An unfiltered PostgreSQL
+    table past the cap is counted from the planner's estimate instead.
+    '''
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        capped = queryset.values('pk')[:COUNT_CAP + 1].count()
+        if capped <= COUNT_CAP:
+            return capped
+        query = queryset.query
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > COUNT_CAP:
+                return row[0]
+        return COUNT_CAP
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    '''Defaults shared by the changelists of large tables'''
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(User)
+class UserAdmin(BaseUserAdmin):
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    list_display = ('email', 'username', 'first_name', 'last_name', 'role', 'is_staff')
+    list_filter = ('role', 'is_staff', 'is_active')
+    search_fields = ('=email', 'username')
+    ordering = ('email',)
+    fieldsets = BaseUserAdmin.fieldsets + (('Travel app', {'fields': ('phone_number', 'role')}),)
+    add_fieldsets = (
+        (None, {
+            'classes': ('wide',),
+            'fields': ('email', 'username', 'first_name', 'last_name', 'role', 'password1', 'password2'),
+        }),
+    )
+
+
+@admin.register(Listing)
+class ListingAdmin(LargeTableAdmin):
+    list_display = ('title', 'city', 'country', 'property_type', 'price_per_night', 'host_email', 'created_at')
+    list_select_related = ('host',)
+    search_fields = ('title', '=host__email')
+    autocomplete_fields = ('host',)
+    readonly_fields = ('relevance_score', 'created_at', 'updated_at')
+
+    @admin.display(description='Host', ordering='host__email')
+    def host_email(self, obj):
+        return obj.host.email
+
+
+@admin.register(Booking)
+class BookingAdmin(LargeTableAdmin):
+    list_display = ('booking_id', 'listing_title', 'guest_email', 'status', 'check_in', 'check_out',
+                    'total_price', 'created_at')
+    list_select_related = ('listing', 'guest')
+    list_filter = ('status',)
+    search_fields = ('=booking_id', '=guest__email')
+    autocomplete_fields = ('listing', 'guest')
+    ordering = ('-created_at',)
+    readonly_fields = ('created_at',)
+    actions = ('confirm_bookings', 'cancel_bookings', 'complete_bookings')
+
+    @admin.display(description='Listing', ordering='listing__title')
+    def listing_title(self, obj):
+        return obj.listing.title
+
+    @admin.display(description='Guest', ordering='guest__email')
+    def guest_email(self, obj):
+        return obj.guest.email
+
+    def _transition(self, request, queryset, target):
+        '''One UPDATE over the selection, limited to bookings that can reach ``target``'''
+        sources, _ = TRANSITIONS[target]
+        queryset = queryset.filter(status__in=sources)
+        invalidate_feeds(queryset.values_list('listing_id', flat=True).distinct())
+        updated = queryset.update(status=target)
+        self.message_user(request, f'{updated} booking(s) marked {target.label.lower()}.', messages.SUCCESS)
+
+    @admin.action(description='Confirm selected pending bookings')
+    def confirm_bookings(self, request, queryset):
+        self._transition(request, queryset, BOOKING_STATUS.CONFIRMED)
+
+    @admin.action(description='Cancel selected bookings')
+    def cancel_bookings(self, request, queryset):
+        self._transition(request, queryset, BOOKING_STATUS.CANCELLED)
+
+    @admin.action(description='Complete selected confirmed bookings')
+    def complete_bookings(self, request, queryset):
+        self._transition(request, queryset, BOOKING_STATUS.COMPLETED)
+
+
+@admin.register(Review)
+class ReviewAdmin(LargeTableAdmin):
+    list_display = ('review_id', 'listing_title', 'guest_email', 'rating', 'created_at')
+    list_select_related = ('listing', 'guest')
+    list_filter = ('rating',)
+    search_fields = ('=review_id', '=guest__email')
+    autocomplete_fields = ('listing', 'guest')
+    ordering = ('-created_at',)
+
+    @admin.display(description='Listing', ordering='listing__title')
+    def listing_title(self, obj):
+        return obj.listing.title
+
+    @admin.display(description='Guest', ordering='guest__email')
+    def guest_email(self, obj):
+        return obj.guest.email
+
+
+@admin.register(Payment)
+class PaymentAdmin(LargeTableAdmin):
+    list_display = ('transaction_id', 'booking_reference_id', 'amount', 'payment_status', 'payment_date')
+    list_filter = ('payment_status',)
+    search_fields = ('=transaction_id', '=booking_reference__booking_id')
+    autocomplete_fields = ('booking_reference',)
+    ordering = ('-payment_date',)
+    actions = ('mark_failed',)
+
+    @admin.action(description='Mark selected pending payments as failed')
+    def mark_failed(self, request, queryset):
+        updated = queryset.filter(payment_status=STATUS_CHOICES.PENDING).update(
+            payment_status=STATUS_CHOICES.FAILED,
+        )
+        self.message_user(request, f'{updated} payment(s) marked failed.', messages.SUCCESS)
+
+
+@admin.register(RateRule)
+class RateRuleAdmin(LargeTableAdmin):
+    list_display = ('rule_id', 'listing_id', 'kind', 'adjustment_percent', 'created_at')
+    list_filter = ('kind',)
+    search_fields = ('=listing__listing_id', 'name')
+    autocomplete_fields = ('listing',)
+
+
+@admin.register(CalendarFeed)
+class CalendarFeedAdmin(LargeTableAdmin):
+    list_display = ('name', 'url', 'listing_id', 'last_synced_at', 'last_error')
+    search_fields = ('=listing__listing_id', 'url')
+    autocomplete_fields = ('listing',)
+    readonly_fields = ('etag', 'last_modified', 'last_synced_at', 'last_error')
+
+
+@admin.register(CalendarBlock)
+class CalendarBlockAdmin(LargeTableAdmin):
+    list_display = ('uid', 'listing_id', 'feed_id', 'start_date', 'end_date', 'summary')
+    search_fields = ('=listing__listing_id', '=uid')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedBooking)
+class ArchivedBookingAdmin(LargeTableAdmin):
+    list_display = ('booking_id', 'listing_id', 'guest_id', 'status', 'check_in', 'check_out', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('=booking_id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedPayment)
+class ArchivedPaymentAdmin(LargeTableAdmin):
+    list_display = ('transaction_id', 'booking_reference_id', 'amount', 'payment_status', 'payment_date')
+    list_filter = ('payment_status',)
+    search_fields = ('=transaction_id',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ListingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'listings'
+
+    def ready(self):
+        '''Connect signal handlers and, when enabled, tracing instrumentation'''
+        from . import signals  # noqa: F401
+        from .tracing import install
+        install()
@@ -0,0 +1,78 @@
+"""
+Hot/cold archival of finished bookings.
+Completed and cancelled bookings that ended more than
+BOOKING_ARCHIVE_AFTER_DAYS ago are moved, together with their payments,
+into ArchivedBooking / ArchivedPayment in small transactional chunks. The
+hot tables then only hold the bookings that availability checks, booking
+lists and payment joins actually need.
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import (
+    Booking, Payment, ArchivedBooking, ArchivedPayment, BOOKING_STATUS,
+)
+
+ARCHIVABLE_STATUSES = [BOOKING_STATUS.COMPLETED, BOOKING_STATUS.CANCELLED]
+
+BOOKING_FIELDS = [
+    'booking_id', 'listing_id', 'guest_id', 'status', 'check_in', 'check_out',
+    'start_date', 'end_date', 'total_price', 'created_at',
+]
+PAYMENT_FIELDS = [
+    'id', 'booking_reference_id', 'transaction_id', 'amount', 'payment_status', 'payment_date',
+]
+
+
+def archivable_bookings(older_than_days=None):
+    '''Finished bookings whose check-out is older than the archive horizon'''
+    days = settings.BOOKING_ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = timezone.now().date() - timedelta(days=days)
+    return Booking.objects.filter(check_out__lt=cutoff, status__in=ARCHIVABLE_STATUSES)
+
+
+def archive_chunk(booking_ids):
+    '''
+    Copy one chunk of bookings and their payments to the archive and delete
+    them from the hot tables, atomically. Safe to re-run: rows already in the
+    archive are skipped.
+    '''
+    with transaction.atomic():
+        bookings = list(
+            Booking.objects.select_for_update()
+            .filter(pk__in=booking_ids, status__in=ARCHIVABLE_STATUSES)
+            .values(*BOOKING_FIELDS)
+        )
+        if not bookings:
+            return 0
+        moved = [b['booking_id'] for b in bookings]
+        payments = list(Payment.objects.filter(booking_reference_id__in=moved).values(*PAYMENT_FIELDS))
+
+        ArchivedBooking.objects.bulk_create(
+            [ArchivedBooking(**b) for b in bookings], ignore_conflicts=True,
+        )
+        ArchivedPayment.objects.bulk_create(
+            [ArchivedPayment(**p) for p in payments], ignore_conflicts=True,
+        )
+        Payment.objects.filter(booking_reference_id__in=moved).delete()
+        Booking.objects.filter(pk__in=moved).delete()
+    return len(moved)
+
+
+def archive_bookings(older_than_days=None, chunk_size=None, max_chunks=None):
+    '''
+    Move archivable bookings in chunks of ``chunk_size`` and return how many
+    were moved. ``max_chunks`` bounds the work done by one run.
+    '''
+    chunk_size = chunk_size or settings.BOOKING_ARCHIVE_CHUNK_SIZE
+    moved = 0
+    chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        ids = list(archivable_bookings(older_than_days).values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+        moved += archive_chunk(ids)
+        chunks += 1
+    return moved
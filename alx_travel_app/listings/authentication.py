@@ -0,0 +1,73 @@
+"""
+Token authentication whose credential lookup is served from the cache.
+Basic authentication runs the full password hash on every request; a token
+lookup here costs a single cache get on the hot path and only falls back to
+the database on a miss.
+"""
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+# Marker cached for unknown keys so repeated bad tokens do not hit the database
+INVALID = 'invalid'
+
+
+def token_cache_key(key):
+    '''Cache key for a token; the raw token never appears in the cache'''
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def revoke_cached_token(key):
+    '''Drop a token from the cache so the next request re-checks the database'''
+    cache.delete(token_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    '''
+    Accepts "Authorization: Token <key>" (or "Bearer <key>") headers.
+    Tokens and their users are cached for AUTH_TOKEN_CACHE_TTL seconds and
+    evicted as soon as the token is deleted or its user is changed; in every
+    process only when the default cache is shared (REDIS_URL).
+    '''
+
+    keywords = (b'token', b'bearer')
+
+    def authenticate(self, request):
+        '''Accept both the Token and the Bearer keyword'''
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() not in self.keywords:
+            return None
+
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+        return self.authenticate_credentials(key)
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        token = cache.get(cache_key)
+
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                cache.set(cache_key, INVALID, settings.AUTH_TOKEN_NEGATIVE_CACHE_TTL)
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            cache.set(cache_key, token, settings.AUTH_TOKEN_CACHE_TTL)
+
+        if token == INVALID:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
@@ -0,0 +1,85 @@
+"""
+Flexible-date availability ("any 3 nights in this 2-week window").
+The booked intervals of every candidate listing that overlap the window
+(bookings, and dates blocked by imported calendar feeds) are loaded with one
+query each and turned into a (listings x days) occupancy bitmap with a sweep
+line (+1 at check-in, -1 at check-out, cumulative sum). Sliding sums over
+that bitmap then give every feasible check-in date per listing.
+"""
+
+from datetime import timedelta
+import numpy as np
+from django.utils.dateparse import parse_date
+from .models import Booking, CalendarBlock, BOOKING_STATUS
+
+# Longest window that can be searched
+MAX_WINDOW_DAYS = 90
+
+
+def parse_window(window_start, window_end, nights):
+    '''Parse and check a flexible-date search; raises ValueError with a message'''
+    start = parse_date(window_start or '') if window_start else None
+    end = parse_date(window_end or '') if window_end else None
+    if start is None or end is None:
+        raise ValueError('window_start and window_end must be dates in YYYY-MM-DD format.')
+    try:
+        nights = int(nights)
+    except (TypeError, ValueError):
+        raise ValueError('nights must be an integer.')
+    span = (end - start).days
+    if not 0 < span <= MAX_WINDOW_DAYS:
+        raise ValueError(f'The window must be between 1 and {MAX_WINDOW_DAYS} days long.')
+    if not 0 < nights <= span:
+        raise ValueError('nights must be between 1 and the length of the window.')
+    return start, end, nights
+
+
+def every_check_in(window_start, window_end, nights):
+    '''Check-in dates of a listing with no bookings in the window'''
+    return [window_start + timedelta(days=d) for d in range((window_end - window_start).days - nights + 1)]
+
+
+def feasible_check_ins(listings, window_start, window_end, nights):
+    '''
+    Return {listing_id: [check-in dates]} for the listings in ``listings`` (a
+    queryset) that have bookings or blocked dates in the window; a listing
+    that is missing from the result is free for the whole window. An empty list means the
+    listing cannot fit the stay anywhere in the window.
+    '''
+    rows = list(
+        Booking.objects.filter(
+            listing__in=listings.values('pk'), check_in__lt=window_end, check_out__gt=window_start,
+        ).exclude(status=BOOKING_STATUS.CANCELLED)
+        .values_list('listing_id', 'check_in', 'check_out')
+    ) + list(
+        CalendarBlock.objects.filter(
+            listing__in=listings.values('pk'), start_date__lt=window_end, end_date__gt=window_start,
+        ).values_list('listing_id', 'start_date', 'end_date')
+    )
+    if not rows:
+        return {}
+
+    days = (window_end - window_start).days
+    owners, check_ins, check_outs = zip(*rows)
+    ids = list(dict.fromkeys(owners))
+    row_of = {listing_id: row for row, listing_id in enumerate(ids)}
+    owner_rows = np.array([row_of[o] for o in owners], dtype=np.int64)
+    origin = np.datetime64(window_start, 'D')
+    starts = np.clip((np.array(check_ins, dtype='datetime64[D]') - origin).astype(np.int64), 0, days)
+    ends = np.clip((np.array(check_outs, dtype='datetime64[D]') - origin).astype(np.int64), 0, days)
+
+    # Sweep line: nights with a positive running count are booked
+    delta = np.zeros((len(ids), days + 1), dtype=np.int32)
+    np.add.at(delta, (owner_rows, starts), 1)
+    np.add.at(delta, (owner_rows, ends), -1)
+    booked = np.cumsum(delta, axis=1)[:, :days] > 0
+
+    # Booked nights in [d, d + nights) for every check-in d, from prefix sums
+    prefix = np.zeros((len(ids), days + 1), dtype=np.int32)
+    np.cumsum(booked, axis=1, out=prefix[:, 1:])
+    free = (prefix[:, nights:] - prefix[:, :-nights]) == 0
+
+    return {
+        listing_id: [window_start + timedelta(days=int(d)) for d in np.flatnonzero(free[row])]
+        for row, listing_id in enumerate(ids)
+    }
@@ -0,0 +1,447 @@
+"""
+iCal calendar sync with other platforms.
+
+Export: each listing has an iCal feed of its bookings, polled by other
+platforms. The rendered feed is cached together with its per-booking VEVENT
+chunks and a version token; booking changes only drop the version, so a
+poll costs two cache reads and, when the client sends the ETag it already
+has, a 304. A stale feed is rebuilt from one narrow query, re-rendering only
+the bookings whose dates or status changed. Only a shared cache lets a change
+in one process (or a Celery task) mark every process's copy stale, so
+CALENDAR_FEED_TTL is short without REDIS_URL.
+
+Import: external feeds are fetched with conditional requests and parsed as
+a line stream. Their events are diffed against the stored CalendarBlocks by
+UID and only the created, changed and removed blocks are written, in bulk.
+Feed URLs (and every redirect) must be http(s) on a public address, so a
+feed cannot be pointed at services on the server's own network. The fetch
+connects to the address that was checked rather than resolving the host
+again, so DNS cannot be rebound to an internal address in between.
+"""
+
+import codecs
+import hashlib
+import ipaddress
+import re
+import socket
+import uuid
+from datetime import date, timedelta, timezone as dt_timezone
+from urllib.parse import urljoin, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from . import metrics
+from .models import Listing, Booking, CalendarBlock, CalendarFeed, BOOKING_STATUS
+
+PRODID = '-//ALX Travel App//Listing calendar//EN'
+
+# Rows written per bulk statement when applying an import
+IMPORT_BATCH_SIZE = 500
+
+# Redirects followed (each one re-checked) when fetching an external feed
+IMPORT_MAX_REDIRECTS = 5
+
+# Booking status -> VEVENT STATUS
+EVENT_STATUS = {
+    BOOKING_STATUS.PENDING: 'TENTATIVE',
+    BOOKING_STATUS.CONFIRMED: 'CONFIRMED',
+    BOOKING_STATUS.COMPLETED: 'CONFIRMED',
+}
+
+
+class CalendarImportError(ValueError):
+    '''Raised when an external feed cannot be read'''
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def feed_token(listing_id):
+    '''Secret token that authorises polling a listing's feed'''
+    return signing.Signer(salt='listings.calendar').signature(str(listing_id))
+
+
+def check_feed_token(listing_id, token):
+    return bool(token) and constant_time_compare(token, feed_token(listing_id))
+
+
+def feed_version_key(listing_id):
+    return f'calendar:feed-version:{listing_id}'
+
+
+def feed_key(listing_id):
+    return f'calendar:feed:{listing_id}'
+
+
+def export_horizon():
+    '''Bookings that ended before this day are left out of the feeds'''
+    return timezone.localdate() - timedelta(days=settings.CALENDAR_EXPORT_PAST_DAYS)
+
+
+def invalidate_feeds(listing_ids):
+    '''Mark the listings' feeds stale once the current transaction commits'''
+    keys = [feed_version_key(listing_id) for listing_id in set(listing_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _fold(line):
+    '''Split a content line into 75-octet lines (RFC 5545 3.1)'''
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, limit = [], 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Never split a multi-byte character
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded, limit = encoded[cut:], 74
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def render_event(booking_id, status, check_in, check_out, created_at):
+    '''One VEVENT for a booking; guests' details are never exported'''
+    lines = (
+        'BEGIN:VEVENT',
+        f'UID:{booking_id}@alx-travel-app',
+        f'DTSTAMP:{created_at.astimezone(dt_timezone.utc):%Y%m%dT%H%M%SZ}',
+        f'DTSTART;VALUE=DATE:{check_in:%Y%m%d}',
+        f'DTEND;VALUE=DATE:{check_out:%Y%m%d}',
+        'SUMMARY:Reserved',
+        f'STATUS:{EVENT_STATUS.get(status, "CONFIRMED")}',
+        'END:VEVENT',
+    )
+    return ''.join(_fold(line) for line in lines)
+
+
+def build_feed(listing_id, version, previous=None):
+    '''
+    Render a listing's feed, reusing the VEVENTs of ``previous`` for bookings
+    that did not change. Returns None when the listing does not exist.
+    '''
+    rows = (
+        Booking.objects.filter(listing_id=listing_id, check_out__gte=export_horizon())
+        .exclude(status=BOOKING_STATUS.CANCELLED)
+        .order_by('check_in', 'booking_id')
+        .values_list('booking_id', 'status', 'check_in', 'check_out', 'created_at')
+    )
+    chunks = previous['events'] if previous else {}
+    events, rendered = {}, 0
+    for booking_id, status, check_in, check_out, created_at in rows.iterator(chunk_size=2000):
+        uid = str(booking_id)
+        fingerprint = f'{status}|{check_in}|{check_out}'
+        cached = chunks.get(uid)
+        if cached is None or cached[0] != fingerprint:
+            cached = (fingerprint, render_event(booking_id, status, check_in, check_out, created_at))
+            rendered += 1
+        events[uid] = cached
+    if not events and not Listing.objects.filter(pk=listing_id).exists():
+        return None
+
+    body = ''.join((
+        _fold('BEGIN:VCALENDAR'), _fold('VERSION:2.0'), _fold(f'PRODID:{PRODID}'),
+        _fold('CALSCALE:GREGORIAN'), _fold('METHOD:PUBLISH'),
+        *(text for _, text in events.values()),
+        _fold('END:VCALENDAR'),
+    ))
+    metrics.incr('calendar', 'feed.rebuilt')
+    metrics.incr('calendar', 'feed.events_rendered', rendered)
+    return {
+        'version': version,
+        'etag': hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        'body': body,
+        'events': events,
+    }
+
+
+def get_feed(listing_id):
+    '''
+    The cached feed of a listing ({"etag", "body", ...}), rebuilt when a
+    booking changed since it was cached; None for an unknown listing.
+    '''
+    version_key, key = feed_version_key(listing_id), feed_key(listing_id)
+    cached = cache.get_many([version_key, key])
+    version = cached.get(version_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(version_key, version, settings.CALENDAR_FEED_TTL):
+            version = cache.get(version_key) or version
+    feed = cached.get(key)
+    if feed is not None and feed['version'] == version:
+        metrics.incr('calendar', 'feed.hit')
+        return feed
+
+    feed = build_feed(listing_id, version, feed)
+    if feed is not None:
+        cache.set(key, feed, settings.CALENDAR_FEED_TTL)
+    return feed
+
+
+# ---------------------------------------------------------------------------
+# Import
+# ---------------------------------------------------------------------------
+
+def check_feed_url(url):
+    '''
+    Refuse feed URLs that are not http(s) or whose host resolves to a
+    loopback, private, link-local or otherwise non-public address. Returns
+    the checked address to connect to.
+    '''
+    try:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        raise CalendarImportError('Feed URL is not valid.')
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise CalendarImportError('Feed URL must be an http or https URL.')
+    try:
+        addresses = socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise CalendarImportError('Feed host could not be resolved.')
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split('%', 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise CalendarImportError('Feed URL must point to a public address.')
+    return str(ipaddress.ip_address(addresses[0][4][0].split('%', 1)[0]))
+
+
+def read_lines(chunks, max_bytes):
+    '''Decode a stream of byte chunks into lines, refusing feeds over ``max_bytes``'''
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    received, pending = 0, ''
+    for chunk in chunks:
+        received += len(chunk)
+        if received > max_bytes:
+            raise CalendarImportError(f'Feed is larger than {max_bytes} bytes.')
+        pending += decoder.decode(chunk)
+        lines = pending.split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending.rstrip('\r')
+
+
+def unfold(lines):
+    '''Join folded content lines (continuations start with a space or tab)'''
+    current = None
+    for line in lines:
+        if line[:1] in (' ', '\t'):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line or None
+    if current is not None:
+        yield current
+
+
+def _parse_date(value):
+    '''Date of a DATE or DATE-TIME value (20250101 or 20250101T140000Z)'''
+    value = value.strip()
+    if len(value) < 8 or not value[:8].isdigit():
+        return None
+    try:
+        return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+    except ValueError:
+        return None
+
+
+def _parse_days(duration):
+    '''Whole days of a DURATION such as P3D, P1W or P1DT12H (at least one)'''
+    match = re.match(r'\+?P(?:(\d+)W)?(?:(\d+)D)?', duration.strip().upper())
+    weeks, days = match.groups() if match else (None, None)
+    return max(1, int(weeks or 0) * 7 + int(days or 0))
+
+
+def _unescape(text):
+    return (text.replace('\\n', '\n').replace('\\N', '\n').replace('\\,', ',')
+            .replace('\\;', ';').replace('\\\\', '\\'))
+
+
+def iter_events(lines):
+    '''
+    Yield (uid, start_date, end_date, summary) for every VEVENT in a stream
+    of iCal lines; end_date is exclusive. Cancelled and undated events are
+    skipped, and nested components (alarms) are ignored.
+    '''
+    event, nested = None, 0
+    for line in unfold(lines):
+        head, _, value = line.partition(':')
+        name = head.split(';', 1)[0].upper()
+        if name == 'BEGIN':
+            if event is not None:
+                nested += 1
+            elif value.strip().upper() == 'VEVENT':
+                event, nested = {}, 0
+        elif name == 'END':
+            if nested:
+                nested -= 1
+            elif event is not None:
+                parsed = _event(event)
+                event = None
+                if parsed is not None:
+                    yield parsed
+        elif event is not None and not nested:
+            event[name] = value
+
+
+def _event(props):
+    if props.get('STATUS', '').strip().upper() == 'CANCELLED':
+        return None
+    start = _parse_date(props.get('DTSTART', ''))
+    if start is None:
+        return None
+    end = _parse_date(props.get('DTEND', ''))
+    if end is None:
+        end = start + timedelta(days=_parse_days(props.get('DURATION', 'P1D')))
+    elif end <= start:
+        end = start + timedelta(days=1)
+    uid = props.get('UID', '').strip() or f'{start:%Y%m%d}-{end:%Y%m%d}'
+    return uid[:255], start, end, _unescape(props.get('SUMMARY', '').strip())[:255]
+
+
+def apply_events(feed, events):
+    '''
+    Diff ``events`` against the feed's stored blocks and write only the
+    differences. Past events are dropped. The whole stream is read before
+    anything is written, so a feed that fails half way changes nothing.
+    The feed row is locked while diffing and writing, so a manual sync and
+    the periodic one never insert the same block twice.
+    '''
+    today = timezone.localdate()
+    incoming = {}
+    for uid, start, end, summary in events:
+        if end > today:
+            incoming.setdefault(uid, (start, end, summary))
+
+    with transaction.atomic():
+        list(CalendarFeed.objects.select_for_update().filter(pk=feed.pk).values_list('pk'))
+        stored = {
+            uid: (pk, start, end, summary)
+            for pk, uid, start, end, summary in CalendarBlock.objects.filter(feed=feed)
+            .values_list('pk', 'uid', 'start_date', 'end_date', 'summary').iterator(chunk_size=2000)
+        }
+        created, updated = [], []
+        for uid, (start, end, summary) in incoming.items():
+            current = stored.get(uid)
+            if current is None:
+                created.append(CalendarBlock(
+                    feed=feed, listing_id=feed.listing_id, uid=uid, start_date=start, end_date=end, summary=summary,
+                ))
+            elif current[1:] != (start, end, summary):
+                updated.append(CalendarBlock(pk=current[0], start_date=start, end_date=end, summary=summary))
+        removed = [value[0] for uid, value in stored.items() if uid not in incoming]
+
+        CalendarBlock.objects.bulk_create(created, batch_size=IMPORT_BATCH_SIZE)
+        CalendarBlock.objects.bulk_update(updated, ['start_date', 'end_date', 'summary'],
+                                          batch_size=IMPORT_BATCH_SIZE)
+        for i in range(0, len(removed), IMPORT_BATCH_SIZE):
+            CalendarBlock.objects.filter(pk__in=removed[i:i + IMPORT_BATCH_SIZE]).delete()
+    return {'events': len(incoming), 'created': len(created), 'updated': len(updated), 'removed': len(removed)}
+
+
+class PinnedAddressAdapter(HTTPAdapter):
+    '''
+    Sends every request to ``address`` instead of resolving the URL's host.
+    The Host header, TLS SNI and certificate check still use the host name.
+    '''
+
+    def __init__(self, address, **kwargs):
+        self.address = address
+        super().__init__(**kwargs)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        host_params, pool_kwargs = self.build_connection_pool_key_attributes(request, verify, cert)
+        hostname = host_params['host']
+        # Only used for https; urllib3 drops them for plain http pools
+        pool_kwargs.update(server_hostname=hostname, assert_hostname=hostname)
+        return self.poolmanager.connection_from_host(
+            host=self.address, port=host_params['port'], scheme=host_params['scheme'], pool_kwargs=pool_kwargs,
+        )
+
+    def add_headers(self, request, **kwargs):
+        request.headers['Host'] = urlsplit(request.url).netloc.rpartition('@')[2]
+
+
+def _session(address):
+    session = requests.Session()
+    # An environment proxy would resolve the host itself
+    session.trust_env = False
+    adapter = PinnedAddressAdapter(address)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _fetch(url, headers):
+    '''
+    GET a feed as a stream, following redirects by hand so every hop goes
+    through check_feed_url and connects to the address it checked. The
+    caller closes the returned response.
+    '''
+    for _ in range(IMPORT_MAX_REDIRECTS + 1):
+        address = check_feed_url(url)
+        response = _session(address).get(url, headers=headers, stream=True, allow_redirects=False,
+                                          timeout=settings.CALENDAR_IMPORT_TIMEOUT)
+        if not response.is_redirect:
+            return response
+        response.close()
+        url = urljoin(url, response.headers['Location'])
+    raise CalendarImportError('Feed redirected too many times.')
+
+
+def _fetch_error(error):
+    '''What is stored on the feed for a failed fetch; no low-level network details'''
+    if isinstance(error, CalendarImportError):
+        return str(error)
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return f'Feed returned HTTP {error.response.status_code}.'
+    if isinstance(error, requests.Timeout):
+        return 'Feed did not respond in time.'
+    return 'Feed could not be fetched.'
+
+
+def sync_feed(feed):
+    '''
+    Fetch an external feed (conditionally, when it was fetched before) and
+    apply its changes. Returns the import stats; errors are stored on the feed.
+    '''
+    headers = {}
+    if feed.etag:
+        headers['If-None-Match'] = feed.etag
+    if feed.last_modified:
+        headers['If-Modified-Since'] = feed.last_modified
+
+    stats = {'events': 0, 'created': 0, 'updated': 0, 'removed': 0, 'not_modified': False}
+    try:
+        with _fetch(feed.url, headers) as response:
+            if response.status_code == 304:
+                stats['not_modified'] = True
+            else:
+                response.raise_for_status()
+                chunks = response.iter_content(chunk_size=16384)
+                stats.update(apply_events(feed, iter_events(read_lines(chunks, settings.CALENDAR_IMPORT_MAX_BYTES))))
+                feed.etag = response.headers.get('ETag', '')[:255]
+                feed.last_modified = response.headers.get('Last-Modified', '')[:64]
+    except (requests.RequestException, CalendarImportError) as e:
+        feed.last_error = _fetch_error(e)
+        feed.save(update_fields=['last_error'])
+        metrics.incr('calendar', 'import.failed')
+        return {**stats, 'error': feed.last_error}
+
+    feed.last_synced_at = timezone.now()
+    feed.last_error = ''
+    feed.save(update_fields=['etag', 'last_modified', 'last_synced_at', 'last_error'])
+    metrics.incr('calendar', 'import.not_modified' if stats['not_modified'] else 'import.applied')
+    return stats
@@ -0,0 +1,144 @@
+"""
+Local Chapa-compatible stub for development and load testing.
+Implements the two calls the app makes (POST /v1/transaction/initialize and
+GET /v1/transaction/verify/<tx_ref>) with configurable latency, error rate
+and a token-bucket rate limit, so the payment views can be exercised
+without api.chapa.co. Run it with `python manage.py chapa_simulator`.
+"""
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RateLimiter:
+    '''Token bucket: ``rate`` requests per second with bursts of ``burst``'''
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+
+class ChapaSimulator(ThreadingHTTPServer):
+    '''Threaded HTTP server holding the simulated transactions and failure settings'''
+
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None,
+                 decline_rate=0.0):
+        super().__init__(address, ChapaHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.transactions = {}
+        self.lock = threading.Lock()
+        self.counts = {'initialize': 0, 'verify': 0, 'rate_limited': 0, 'errors': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+
+class ChapaHandler(BaseHTTPRequestHandler):
+    '''Chapa v1 responses for initialize and verify'''
+
+    server_version = 'ChapaSimulator/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _simulate(self):
+        '''Apply rate limit, latency and random failures; True when a response was already sent'''
+        server = self.server
+        if server.limiter and not server.limiter.allow():
+            server.count('rate_limited')
+            self._send(429, {'message': 'Too many requests', 'status': 'failed', 'data': None})
+            return True
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < server.error_rate:
+            server.count('errors')
+            self._send(500, {'message': 'Internal server error', 'status': 'failed', 'data': None})
+            return True
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            self._send(401, {'message': 'Invalid API Key', 'status': 'failed', 'data': None})
+            return True
+        return False
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/transaction/initialize':
+            return self._send(404, {'message': 'Not found', 'status': 'failed', 'data': None})
+        if self._simulate():
+            return
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        except ValueError:
+            return self._send(400, {'message': 'Invalid JSON', 'status': 'failed', 'data': None})
+        tx_ref = data.get('tx_ref')
+        if not tx_ref or not data.get('amount'):
+            return self._send(400, {'message': {'tx_ref': ['required'], 'amount': ['required']},
+                                    'status': 'failed', 'data': None})
+
+        server = self.server
+        server.count('initialize')
+        with server.lock:
+            if tx_ref in server.transactions:
+                return self._send(400, {'message': 'Transaction reference has been used before',
+                                        'status': 'failed', 'data': None})
+            declined = random.random() < server.decline_rate
+            server.transactions[tx_ref] = {
+                'tx_ref': tx_ref,
+                'amount': data['amount'],
+                'currency': data.get('currency', 'ETB'),
+                'email': data.get('email'),
+                'status': 'failed' if declined else 'success',
+            }
+        host = self.headers.get('Host', 'localhost')
+        self._send(200, {
+            'message': 'Hosted Link',
+            'status': 'success',
+            'data': {'checkout_url': f'http://{host}/checkout/{tx_ref}'},
+        })
+
+    def do_GET(self):
+        prefix = '/v1/transaction/verify/'
+        if not self.path.startswith(prefix):
+            return self._send(404, {'message': 'Not found', 'status': 'failed', 'data': None})
+        if self._simulate():
+            return
+        server = self.server
+        server.count('verify')
+        with server.lock:
+            transaction = server.transactions.get(self.path[len(prefix):].rstrip('/'))
+        if transaction is None:
+            return self._send(404, {'message': 'Invalid transaction or Transaction not found',
+                                    'status': 'failed', 'data': None})
+        if transaction['status'] != 'success':
+            return self._send(400, {'message': 'Payment failed', 'status': 'failed', 'data': transaction})
+        self._send(200, {'message': 'Payment details', 'status': 'success', 'data': transaction})
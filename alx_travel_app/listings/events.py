@@ -0,0 +1,216 @@
+"""
+Booking and payment change events for the SSE / long-poll stream.
+Views and Celery tasks publish events once their transaction commits. With
+REDIS_URL set they go out on a Redis pub/sub channel that every web process
+listens to, so a stream sees events published by other workers and tasks;
+without it they reach only the broker of the publishing process. The broker
+keeps a short history per user (guest and host of the booking) and wakes
+that user's open streams, which read the history after the last id they
+sent. A client that reconnects with Last-Event-ID resumes from the same
+history; when it has fallen too far behind, or reconnected to another
+process, it is told to reload over the REST endpoints instead.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['seq', 'kind', 'data'])
+
+RELAY_CHANNEL = 'listings:events'
+
+# Event ids are "<boot>-<seq>", so ids from an earlier process are recognised as stale
+BOOT_ID = format(int(time.time() * 1000), 'x')
+
+
+def event_id(seq):
+    '''Client-facing id of the event with sequence number ``seq``'''
+    return f'{BOOT_ID}-{seq}'
+
+
+def parse_event_id(value):
+    '''Sequence number of an id issued by this process, or None when unknown or stale'''
+    boot, _, seq = (value or '').partition('-')
+    if boot != BOOT_ID or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+class EventBroker:
+    '''Per-user event history and fan-out to the streams that user has open'''
+
+    def __init__(self, history=None, max_users=None):
+        self.history_size = history or settings.EVENT_STREAM_HISTORY
+        self.max_users = max_users or settings.EVENT_STREAM_MAX_USERS
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self.last_seq = 0
+        self._history = OrderedDict()  # user id -> deque of events, least recently used first
+        self._dropped = {}  # user id -> newest seq evicted from that user's history
+        self._subscribers = {}  # user id -> {(loop, asyncio.Event)}
+
+    def publish(self, user_ids, kind, data):
+        '''Record an event for every user in ``user_ids`` and wake their streams'''
+        with self._lock:
+            event = Event(next(self._seq), kind, data)
+            self.last_seq = event.seq
+            wake = []
+            for user_id in {str(u) for u in user_ids}:
+                history = self._history.pop(user_id, None)
+                if history is None:
+                    history = deque(maxlen=self.history_size)
+                elif len(history) == history.maxlen:
+                    self._dropped[user_id] = history[0].seq
+                history.append(event)
+                self._history[user_id] = history
+                wake.extend(self._subscribers.get(user_id, ()))
+            while len(self._history) > self.max_users:
+                user_id, _ = self._history.popitem(last=False)
+                self._dropped.pop(user_id, None)
+        for loop, ready in wake:
+            # A stream whose loop already shut down must not fail the publisher,
+            # which runs in on_commit after the write was committed
+            if loop.is_closed():
+                continue
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass
+        return event
+
+    def since(self, user_id, after):
+        '''
+        Return (events, complete): the user's events newer than seq ``after``,
+        and False when some of them were already evicted from the history.
+        '''
+        with self._lock:
+            history = list(self._history.get(str(user_id), ()))
+            dropped = self._dropped.get(str(user_id), 0)
+        return [e for e in history if e.seq > after], after >= dropped
+
+    def subscribe(self, user_id):
+        '''Return an asyncio.Event set whenever the user gets a new event'''
+        ready = asyncio.Event()
+        with self._lock:
+            self._subscribers.setdefault(str(user_id), set()).add((asyncio.get_running_loop(), ready))
+        return ready
+
+    def unsubscribe(self, user_id, ready):
+        with self._lock:
+            subscribers = self._subscribers.get(str(user_id), set())
+            subscribers.discard((asyncio.get_running_loop(), ready))
+            if not subscribers:
+                self._subscribers.pop(str(user_id), None)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    '''
+    The process-wide broker, created on first use so settings are loaded.
+    With a relay configured it also starts listening for relayed events.
+    '''
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker = EventBroker()
+                if settings.EVENT_STREAM_REDIS_URL:
+                    threading.Thread(
+                        target=_listen, args=(broker, settings.EVENT_STREAM_REDIS_URL),
+                        name='event-relay', daemon=True,
+                    ).start()
+                _broker = broker
+    return _broker
+
+
+def _redis(url):
+    import redis  # installed alongside Django's RedisCache, only needed with REDIS_URL
+    return redis.Redis.from_url(url)
+
+
+def _listen(broker, url):
+    '''Feed events relayed by other processes into ``broker``, reconnecting on errors'''
+    while True:
+        try:
+            pubsub = _redis(url).pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(RELAY_CHANNEL)
+            for message in pubsub.listen():
+                receive(broker, message['data'])
+        except Exception:
+            logger.exception('Event relay connection lost')
+            time.sleep(1)
+
+
+def receive(broker, message):
+    '''Publish a relayed event message to ``broker``'''
+    payload = json.loads(message)
+    broker.publish(payload['users'], payload['kind'], payload['data'])
+
+
+def publish(user_ids, kind, data):
+    '''Publish an event to the relay when one is configured, else to this process's broker'''
+    url = settings.EVENT_STREAM_REDIS_URL
+    if not url:
+        get_broker().publish(user_ids, kind, data)
+        return
+    message = json.dumps({'users': [str(u) for u in user_ids], 'kind': kind, 'data': data})
+    try:
+        _redis(url).publish(RELAY_CHANNEL, message)
+    except Exception:
+        # Runs after the commit: losing the notification must not fail the request
+        logger.exception('Could not relay %s event', kind)
+
+
+def _publish_on_commit(user_ids, kind, data):
+    transaction.on_commit(lambda: publish(user_ids, kind, data))
+
+
+def _booking_data(booking_id, listing_id, status, check_in, check_out):
+    return {
+        'booking_id': str(booking_id),
+        'listing': str(listing_id),
+        'status': status,
+        'check_in': str(check_in),
+        'check_out': str(check_out),
+    }
+
+
+def publish_booking_event(kind, booking):
+    '''Tell the guest and the host about a booking change, e.g. "booking.created"'''
+    _publish_on_commit(
+        [booking.guest_id, booking.listing.host_id], kind,
+        _booking_data(booking.booking_id, booking.listing_id, booking.status, booking.check_in, booking.check_out),
+    )
+
+
+def publish_booking_rows(kind, rows):
+    '''publish_booking_event for value rows (with listing__host_id) of a set-based update'''
+    for row in rows:
+        _publish_on_commit(
+            [row['guest_id'], row['listing__host_id']], kind,
+            _booking_data(row['booking_id'], row['listing_id'], row['status'], row['check_in'], row['check_out']),
+        )
+
+
+def publish_payment_event(payment):
+    '''Tell the guest and the host that a payment changed status'''
+    booking = payment.booking_reference
+    _publish_on_commit(
+        [booking.guest_id, booking.listing.host_id], 'payment.status',
+        {
+            'transaction_id': payment.transaction_id,
+            'booking_id': str(booking.booking_id),
+            'payment_status': payment.payment_status,
+        },
+    )
@@ -0,0 +1,118 @@
+"""
+Streaming CSV / NDJSON exports.
+Rows are read with a server-side cursor (`.iterator(chunk_size=...)`) as plain
+tuples and written out in small batches, so memory use stays flat no matter
+how many rows are exported.
+"""
+
+import csv
+import io
+import itertools
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Rows buffered before a chunk is handed to the client
+EXPORT_FLUSH_ROWS = 500
+
+BOOKING_EXPORT_FIELDS = {
+    'booking_id': 'booking_id',
+    'listing_id': 'listing_id',
+    'listing_title': 'listing__title',
+    'guest_email': 'guest__email',
+    'status': 'status',
+    'check_in': 'check_in',
+    'check_out': 'check_out',
+    'start_date': 'start_date',
+    'end_date': 'end_date',
+    'total_price': 'total_price',
+    'created_at': 'created_at',
+}
+
+PAYMENT_EXPORT_FIELDS = {
+    'id': 'id',
+    'transaction_id': 'transaction_id',
+    'booking_id': 'booking_reference_id',
+    'guest_email': 'booking_reference__guest__email',
+    'amount': 'amount',
+    'payment_status': 'payment_status',
+    'payment_date': 'payment_date',
+}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class ExportError(ValueError):
+    '''Raised for invalid export parameters'''
+
+
+def filter_export_queryset(queryset, params, date_field, status_field):
+    '''
+    Apply the export filters shared by every export endpoint:
+    ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD&status=<status>
+    '''
+    for param, lookup in (('date_from', 'gte'), ('date_to', 'lte')):
+        value = params.get(param)
+        if not value:
+            continue
+        day = parse_date(value)
+        if day is None:
+            raise ExportError(f'{param} must be a date in YYYY-MM-DD format.')
+        queryset = queryset.filter(**{f'{date_field}__date__{lookup}': day})
+
+    status_value = params.get('status')
+    if status_value:
+        queryset = queryset.filter(**{status_field: status_value})
+    return queryset
+
+
+def _csv_chunks(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_chunks(rows, columns):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    lines = []
+    for row in rows:
+        lines.append(encoder.encode(dict(zip(columns, row))))
+        if len(lines) == EXPORT_FLUSH_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def stream_export(querysets, fields, fmt, filename):
+    '''
+    Stream ``fields`` of every row in ``querysets`` (one queryset, or several
+    read one after the other, e.g. hot and archived rows) as CSV or NDJSON.
+    ``fields`` maps output column names to ORM lookups.
+    '''
+    if fmt not in CONTENT_TYPES:
+        raise ExportError(f"export_format must be one of: {', '.join(CONTENT_TYPES)}.")
+
+    if not isinstance(querysets, (list, tuple)):
+        querysets = [querysets]
+    columns = list(fields)
+    rows = itertools.chain.from_iterable(
+        qs.values_list(*fields.values()).iterator(chunk_size=EXPORT_CHUNK_SIZE) for qs in querysets
+    )
+    chunks = _csv_chunks(rows, columns) if fmt == 'csv' else _ndjson_chunks(rows, columns)
+
+    response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
@@ -0,0 +1,22 @@
+"""
+Custom DRF filter backends.
+"""
+
+from rest_framework.filters import OrderingFilter
+
+
+class RelevanceOrderingFilter(OrderingFilter):
+    '''OrderingFilter that also accepts ?ordering=relevance (most relevant first)'''
+    aliases = {
+        'relevance': '-relevance_score',
+        '-relevance': 'relevance_score',
+    }
+
+    def get_ordering(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param)
+        if params:
+            fields = [self.aliases.get(param.strip(), param.strip()) for param in params.split(',')]
+            ordering = self.remove_invalid_fields(queryset, fields, view, request)
+            if ordering:
+                return ordering
+        return self.get_default_ordering(view)
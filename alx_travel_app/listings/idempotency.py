@@ -0,0 +1,102 @@
+"""
+Idempotency-Key support for unsafe API actions.
+The first request with a given key claims it with a single constrained
+INSERT; its response is stored and replayed verbatim for every retry with
+the same key, so retries never repeat side effects such as Chapa calls.
+A claim that is still unanswered after IDEMPOTENCY_CLAIM_LEASE seconds
+belonged to a process that died mid-request and is taken over by the next
+retry; the stale owner can then no longer record its response.
+"""
+
+import functools
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def _request_hash(request):
+    '''Fingerprint of the request body, used to detect a key reused for another payload'''
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _replay(record):
+    '''Answer a retry from the stored record'''
+    if record.response_status is None:
+        return Response(
+            {'error': 'A request with this Idempotency-Key is still being processed.'},
+            status=status.HTTP_409_CONFLICT,
+        )
+    response = Response(record.response_body, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(endpoint):
+    '''
+    Decorate a ViewSet action so requests carrying an Idempotency-Key header
+    are processed at most once per user. Server errors (5xx) are not stored,
+    which lets the client retry them with the same key.
+    '''
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            if not request.user.is_authenticated:
+                return Response({'error': 'Authentication required'}, status=401)
+            if len(key) > 255:
+                return Response({'error': 'Idempotency-Key is too long.'}, status=status.HTTP_400_BAD_REQUEST)
+
+            request_hash = _request_hash(request)
+            claimed_at = timezone.now()
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user, endpoint=endpoint, key=key, request_hash=request_hash,
+                        claimed_at=claimed_at,
+                    )
+            except IntegrityError:
+                record = IdempotencyKey.objects.get(user=request.user, endpoint=endpoint, key=key)
+                if record.request_hash != request_hash:
+                    return Response(
+                        {'error': 'Idempotency-Key was already used with a different request.'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                lease = timedelta(seconds=settings.IDEMPOTENCY_CLAIM_LEASE)
+                if record.response_status is not None or record.claimed_at > claimed_at - lease:
+                    return _replay(record)
+                # Abandoned claim: take it over, unless another retry just did
+                taken = IdempotencyKey.objects.filter(
+                    pk=record.pk, response_status__isnull=True, claimed_at=record.claimed_at,
+                ).update(claimed_at=claimed_at)
+                if not taken:
+                    return _replay(IdempotencyKey.objects.get(pk=record.pk))
+
+            # Only the current owner of the claim may record or release it
+            claim = IdempotencyKey.objects.filter(pk=record.pk, claimed_at=claimed_at)
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                claim.delete()
+                raise
+
+            if response.status_code >= 500 or not hasattr(response, 'data'):
+                claim.delete()
+            else:
+                claim.update(
+                    response_status=response.status_code,
+                    response_body=json.loads(json.dumps(response.data, default=str)),
+                )
+            return response
+        return wrapper
+    return decorator
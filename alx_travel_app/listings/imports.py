@@ -0,0 +1,188 @@
+"""
+Streaming bulk import of listings from CSV or NDJSON.
+The input is read one row at a time and processed in fixed-size batches:
+rows are validated with the ListingSerializer rules, hosts are resolved by
+email through an in-memory map (one query per batch for unseen emails), and
+each batch is written with a single bulk_create/upsert. Memory use depends
+on the batch size, not on the size of the input file.
+"""
+
+import csv
+import io
+import json
+import uuid
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.functions import Lower
+from rest_framework.exceptions import ValidationError
+from .models import Listing, User
+from .pricing import rate_table_key
+from .serializers import ListingImportSerializer
+
+IMPORT_BATCH_SIZE = 1000
+
+# Fields refreshed when an imported row matches an existing listing_id
+UPSERT_FIELDS = [
+    'title', 'description', 'address', 'city', 'state', 'country',
+    'price_per_night', 'property_type', 'number_of_bedrooms', 'host', 'amenities',
+    'updated_at',
+]
+
+
+def iter_records(stream, fmt):
+    '''
+    Yield (line_number, row) pairs from a text stream.
+    CSV amenities may be a JSON list or values separated by "|".
+    '''
+    if fmt == 'ndjson':
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, {'__error__': f'Invalid JSON: {e}'}
+    elif fmt == 'csv':
+        # Line 1 is the header row
+        for number, row in enumerate(csv.DictReader(stream), 2):
+            amenities = (row.get('amenities') or '').strip()
+            if amenities.startswith('['):
+                try:
+                    row['amenities'] = json.loads(amenities)
+                except ValueError:
+                    pass
+            else:
+                row['amenities'] = [a.strip() for a in amenities.split('|') if a.strip()]
+            yield number, row
+    else:
+        raise ValueError(f'Unsupported import format: {fmt}')
+
+
+def open_text(fileobj):
+    '''Wrap a binary upload or file in a text stream without reading it all'''
+    if isinstance(fileobj, io.TextIOBase):
+        return fileobj
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+
+class RejectSample:
+    '''Reject sink that keeps only the first ``limit`` rejected rows in memory'''
+
+    def __init__(self, limit=100):
+        self.limit = limit
+        self.rows = []
+
+    def write(self, line):
+        if len(self.rows) < self.limit:
+            self.rows.append(json.loads(line))
+
+
+class ListingImporter:
+    '''
+    Import listings in batches.
+
+    reject_file: optional text stream; every rejected row is written to it as
+        one NDJSON line {"line": ..., "errors": ..., "row": ...}.
+    progress: optional callable receiving the running stats after each batch.
+    '''
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, reject_file=None, progress=None):
+        self.batch_size = batch_size
+        self.reject_file = reject_file
+        self.progress = progress
+        self.serializer = ListingImportSerializer()
+        self.hosts = {}
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'rejected': 0}
+
+    def run(self, records):
+        '''Consume (line_number, row) pairs and return the final stats'''
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self._process(batch)
+                batch = []
+        if batch:
+            self._process(batch)
+        return self.stats
+
+    def _reject(self, line, errors, row):
+        self.stats['rejected'] += 1
+        if self.reject_file is not None:
+            self.reject_file.write(DjangoJSONEncoder().encode(
+                {'line': line, 'errors': errors, 'row': row}
+            ) + '\n')
+
+    def _resolve_hosts(self, emails):
+        '''Add unseen host emails to the in-memory email -> user id map'''
+        missing = {e for e in emails if e not in self.hosts}
+        if not missing:
+            return
+        found = dict(
+            User.objects.annotate(email_lower=Lower('email'))
+            .filter(email_lower__in=missing)
+            .values_list('email_lower', 'pk')
+        )
+        for email in missing:
+            self.hosts[email] = found.get(email)
+
+    def _process(self, batch):
+        self.stats['rows'] += len(batch)
+
+        valid = []
+        for line, row in batch:
+            if '__error__' in row:
+                self._reject(line, {'non_field_errors': [row['__error__']]}, None)
+                continue
+            try:
+                data = self.serializer.run_validation(row)
+            except ValidationError as e:
+                self._reject(line, e.detail, row)
+                continue
+
+            listing_id = row.get('listing_id') or None
+            if listing_id:
+                try:
+                    listing_id = uuid.UUID(str(listing_id))
+                except ValueError:
+                    self._reject(line, {'listing_id': ['Must be a valid UUID.']}, row)
+                    continue
+            valid.append((line, row, listing_id, data))
+
+        self._resolve_hosts({data['host_email'].lower() for _, _, _, data in valid})
+
+        new, existing = [], {}
+        for line, row, listing_id, data in valid:
+            host_id = self.hosts.get(data.pop('host_email').lower())
+            if host_id is None:
+                self._reject(line, {'host_email': ['No user with this email.']}, row)
+                continue
+            listing = Listing(host_id=host_id, **data)
+            if listing_id:
+                listing.listing_id = listing_id
+                # The last row wins when a batch repeats a listing_id
+                existing[listing_id] = listing
+            else:
+                new.append(listing)
+
+        with transaction.atomic():
+            if new:
+                Listing.objects.bulk_create(new, batch_size=self.batch_size)
+                self.stats['created'] += len(new)
+            if existing:
+                known = set(Listing.objects.filter(
+                    listing_id__in=list(existing)
+                ).values_list('listing_id', flat=True))
+                Listing.objects.bulk_create(
+                    list(existing.values()), batch_size=self.batch_size,
+                    update_conflicts=True, unique_fields=['listing_id'], update_fields=UPSERT_FIELDS,
+                )
+                # Upserts bypass save() signals, so evict the cached rate tables here
+                cache.delete_many([rate_table_key(listing_id) for listing_id in known])
+                self.stats['updated'] += len(known)
+                self.stats['created'] += len(existing) - len(known)
+
+        if self.progress is not None:
+            self.progress(dict(self.stats))
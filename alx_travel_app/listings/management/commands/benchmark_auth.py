@@ -0,0 +1,64 @@
+import base64
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+from listings.models import User
+from listings.views import ListingViewSet
+
+
+class _Rollback(Exception):
+    '''Raised to discard the benchmark user and token'''
+
+
+class Command(BaseCommand):
+    '''Compare requests per second of ListingViewSet.list under Basic and token auth'''
+    help = 'Benchmark Basic vs token authentication on the listings endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scheme')
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        try:
+            with transaction.atomic():
+                self.run(count)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def run(self, count):
+        password = 'bench-password-123'
+        user = User.objects.create_user(
+            username='bench-auth', email='bench-auth@example.com', password=password,
+            first_name='Bench', last_name='Auth',
+        )
+        token = Token.objects.create(user=user)
+        basic = base64.b64encode(f'{user.email}:{password}'.encode()).decode()
+
+        # Without throttling, otherwise the search bucket's burst is spent on the warm-up
+        # and the rest of the run only times 429 responses
+        view = ListingViewSet.as_view({'get': 'list'}, throttle_classes=[])
+        factory = APIRequestFactory()
+        schemes = {
+            'basic': f'Basic {basic}',
+            'token': f'Token {token.key}',
+        }
+
+        for name, header in schemes.items():
+            # Warm up caches and lazy imports before timing
+            view(factory.get('/api/listings/', HTTP_AUTHORIZATION=header))
+
+            started = time.perf_counter()
+            for _ in range(count):
+                response = view(factory.get('/api/listings/', HTTP_AUTHORIZATION=header))
+                response.render()
+                if response.status_code != 200:
+                    raise CommandError(f'{name} request failed with status {response.status_code}')
+            elapsed = time.perf_counter() - started
+
+            self.stdout.write(
+                f'{name:<6} {count / elapsed:>10.1f} req/s  '
+                f'{elapsed / count * 1000:>8.2f} ms/request'
+            )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from alx_travel_app.schema import build_schema
+
+
+class Command(BaseCommand):
+    '''Pre-generate the OpenAPI schema served at api/schema/ (run at deploy)'''
+    help = 'Generate and cache the OpenAPI schema for the current code version'
+
+    def handle(self, *args, **kwargs):
+        version = build_schema()
+        self.stdout.write(self.style.SUCCESS(f'OpenAPI schema built for version {version}'))
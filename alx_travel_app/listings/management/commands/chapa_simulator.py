@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from listings.chapa_simulator import ChapaSimulator
+
+
+class Command(BaseCommand):
+    '''Serve a local Chapa-compatible API for development and load tests'''
+    help = 'Run a local Chapa stub; set CHAPA_BASE_URL=http://<host>:<port>/v1 to use it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        parser.add_argument('--latency-ms', type=float, default=50.0, help='Fixed delay per request')
+        parser.add_argument('--jitter-ms', type=float, default=50.0, help='Extra random delay, up to this much')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500')
+        parser.add_argument('--decline-rate', type=float, default=0.0, help='Fraction of payments that fail verification')
+        parser.add_argument('--rate-limit', type=float, default=None, help='Requests per second before 429s')
+
+    def handle(self, *args, **options):
+        server = ChapaSimulator(
+            (options['host'], options['port']),
+            latency=options['latency_ms'] / 1000.0,
+            jitter=options['jitter_ms'] / 1000.0,
+            error_rate=options['error_rate'],
+            decline_rate=options['decline_rate'],
+            rate_limit=options['rate_limit'],
+        )
+        self.stdout.write(
+            f"Chapa simulator on http://{options['host']}:{options['port']}/v1 "
+            f"(latency {options['latency_ms']}+{options['jitter_ms']} ms, "
+            f"errors {options['error_rate']:.0%}, rate limit {options['rate_limit'] or 'none'})"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'Requests served: {server.counts}')
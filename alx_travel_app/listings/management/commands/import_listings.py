@@ -0,0 +1,47 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from listings.imports import IMPORT_BATCH_SIZE, ListingImporter, iter_records, open_text
+
+
+class Command(BaseCommand):
+    '''Stream listings from a CSV or NDJSON file into the database in batches'''
+    help = 'Bulk import listings from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--reject-file', help='Write rejected rows here as NDJSON')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+        def progress(stats):
+            self.stdout.write(
+                f"rows={stats['rows']} created={stats['created']} "
+                f"updated={stats['updated']} rejected={stats['rejected']}"
+            )
+
+        reject_file = open(options['reject_file'], 'w') if options['reject_file'] else None
+        try:
+            if path == '-':
+                stream = open_text(sys.stdin.buffer)
+            else:
+                try:
+                    stream = open_text(open(path, 'rb'))
+                except OSError as e:
+                    raise CommandError(str(e))
+            with stream:
+                importer = ListingImporter(
+                    batch_size=options['batch_size'], reject_file=reject_file, progress=progress,
+                )
+                stats = importer.run(iter_records(stream, fmt))
+        finally:
+            if reject_file is not None:
+                reject_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['created']} new and {stats['updated']} updated listings "
+            f"({stats['rejected']} rejected of {stats['rows']} rows)"
+        ))
@@ -0,0 +1,194 @@
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import numpy as np
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.authtoken.models import Token
+from listings.models import User, Listing, Booking, BOOKING_STATUS, PROPERTY_TYPE, USER_ROLE
+
+STEPS = ('initialize', 'callback', 'verify')
+
+
+class LockSampler(threading.Thread):
+    '''Samples waiting row/table locks on PostgreSQL while the test runs'''
+
+    def __init__(self, interval=0.5):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def deadlocks(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()')
+            return cursor.fetchone()[0]
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity "
+                        "WHERE wait_event_type = 'Lock' AND datname = current_database()"
+                    )
+                    self.samples.append(cursor.fetchone()[0])
+        finally:
+            connection.close()
+
+
+class Command(BaseCommand):
+    '''
+    Drive initialize -> Chapa callback -> client verify payment flows against
+    a running server (pointed at `manage.py chapa_simulator`) at a target rate
+    and report throughput, latency percentiles and lock contention.
+    '''
+    help = 'Load test the payment endpoints end to end at a target rate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Server under test')
+        parser.add_argument('--rate', type=float, default=20.0, help='Payment flows started per second')
+        parser.add_argument('--duration', type=float, default=30.0, help='Seconds to generate load')
+        parser.add_argument('--concurrency', type=int, default=32, help='Client threads')
+        parser.add_argument('--bookings', type=int, default=200,
+                            help='Bookings to pay for; fewer bookings means more conflicting payments')
+        parser.add_argument('--keep-data', action='store_true', help='Keep the generated users and bookings')
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0 or options['bookings'] <= 0:
+            raise CommandError('--rate and --bookings must be positive.')
+        guest, host, token, bookings = self.create_fixtures(options['bookings'])
+        try:
+            self.run(options, token, bookings)
+        finally:
+            if not options['keep_data']:
+                guest.delete()
+                host.delete()
+
+    def create_fixtures(self, count):
+        '''A guest with a token and ``count`` bookings on one listing'''
+        suffix = uuid.uuid4().hex[:8]
+        host = User.objects.create_user(
+            username=f'loadtest-host-{suffix}', email=f'loadtest-host-{suffix}@example.com',
+            password=uuid.uuid4().hex, first_name='Load', last_name='Host', role=USER_ROLE.HOST,
+        )
+        guest = User.objects.create_user(
+            username=f'loadtest-guest-{suffix}', email=f'loadtest-guest-{suffix}@example.com',
+            password=uuid.uuid4().hex, first_name='Load', last_name='Guest',
+        )
+        token = Token.objects.create(user=guest)
+        listing = Listing.objects.create(
+            host=host, title='Load test listing', description='Load test', address='1 Test Street',
+            city='Addis Ababa', country='Ethiopia', price_per_night=100, number_of_bedrooms=1,
+            property_type=PROPERTY_TYPE.choices[0][0],
+        )
+        check_in = date.today() + timedelta(days=30)
+        bookings = Booking.objects.bulk_create([
+            Booking(listing=listing, guest=guest, status=BOOKING_STATUS.CONFIRMED,
+                    check_in=check_in, check_out=check_in + timedelta(days=2), total_price=200)
+            for _ in range(count)
+        ])
+        return guest, host, token.key, [str(b.pk) for b in bookings]
+
+    def run(self, options, token, bookings):
+        base = options['base_url'].rstrip('/')
+        local = threading.local()
+        lock = threading.Lock()
+        timings = {step: [] for step in STEPS}
+        statuses = {step: {} for step in STEPS}
+        results = {'completed': 0, 'conflicts': 0, 'late_starts': 0}
+
+        def call(step, method, url, **kwargs):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout=30, **kwargs)
+                code = response.status_code
+            except requests.RequestException:
+                response, code = None, 'error'
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings[step].append(elapsed)
+                statuses[step][code] = statuses[step].get(code, 0) + 1
+            return response
+
+        def flow(scheduled):
+            if time.perf_counter() - scheduled > 0.1:
+                with lock:
+                    results['late_starts'] += 1
+            auth = {'Authorization': f'Token {token}'}
+            response = call(
+                'initialize', 'POST', f'{base}/api/payments/initialize_payment/',
+                json={'booking_reference': random.choice(bookings), 'amount': '200.00'},
+                headers={**auth, 'Idempotency-Key': uuid.uuid4().hex},
+            )
+            if response is None or response.status_code != 201:
+                if response is not None and response.status_code == 400 and 'pending' in response.text:
+                    with lock:
+                        results['conflicts'] += 1
+                return
+            tx_ref = response.json().get('tx_ref')
+            # Chapa calls the callback URL, then the client checks the payment itself
+            call('callback', 'GET', f'{base}/api/payments/verify_payment/', params={'tx_ref': tx_ref})
+            call('verify', 'GET', f'{base}/api/payments/verify_payment/', params={'tx_ref': tx_ref}, headers=auth)
+            with lock:
+                results['completed'] += 1
+
+        sampler = LockSampler() if connection.vendor == 'postgresql' else None
+        deadlocks = sampler.deadlocks() if sampler else None
+        if sampler:
+            sampler.start()
+
+        interval = 1.0 / options['rate']
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            scheduled = started
+            while scheduled - started < options['duration']:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(flow, scheduled)
+                scheduled += interval
+        elapsed = time.perf_counter() - started
+
+        if sampler:
+            sampler.stopped.set()
+            sampler.join()
+            deadlocks = sampler.deadlocks() - deadlocks
+        self.report(options, elapsed, timings, statuses, results, sampler, deadlocks)
+
+    def report(self, options, elapsed, timings, statuses, results, sampler, deadlocks):
+        self.stdout.write(
+            f"Target {options['rate']:.1f} flows/s for {options['duration']:.0f}s "
+            f"with {options['concurrency']} threads over {options['bookings']} bookings"
+        )
+        self.stdout.write(
+            f"Completed flows: {results['completed']} ({results['completed'] / elapsed:.1f}/s), "
+            f"pending-payment conflicts: {results['conflicts']}, late starts: {results['late_starts']}"
+        )
+        self.stdout.write(f"{'step':<11} {'count':>7} {'req/s':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+        for step in STEPS:
+            values = np.array(timings[step]) * 1000.0
+            if not values.size:
+                self.stdout.write(f'{step:<11} {0:>7}')
+                continue
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            codes = ', '.join(f'{code}: {n}' for code, n in sorted(statuses[step].items(), key=str))
+            self.stdout.write(
+                f'{step:<11} {values.size:>7} {values.size / elapsed:>7.1f} {p50:>8.1f} {p90:>8.1f} '
+                f'{p99:>8.1f} {values.max():>8.1f}  {codes}'
+            )
+        if sampler is None:
+            self.stdout.write('Lock contention: only sampled on PostgreSQL.')
+        else:
+            samples = sampler.samples or [0]
+            self.stdout.write(
+                f'Lock waits: avg {sum(samples) / len(samples):.2f}, max {max(samples)} sessions '
+                f'({len(sampler.samples)} samples); deadlocks: {deadlocks}'
+            )
@@ -0,0 +1,60 @@
+import json
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    '''Print the slowest traces recorded in TRACING_FILE as span trees'''
+    help = 'Show the slowest recorded request traces with their SQL, task, email and HTTP spans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', default=None, help='Trace file (defaults to TRACING_FILE)')
+        parser.add_argument('--limit', type=int, default=5, help='Number of traces to show')
+        parser.add_argument('--trace', default=None, help='Show only this trace id')
+
+    def handle(self, *args, **options):
+        path = options['file'] or settings.TRACING_FILE
+        traces = defaultdict(list)
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        span = json.loads(line)
+                    except ValueError:
+                        continue
+                    traces[span['trace_id']].append(span)
+        except FileNotFoundError:
+            raise CommandError(f'No trace file at {path}; set TRACING_SAMPLE_RATE to record traces.')
+
+        if options['trace']:
+            selected = [options['trace']] if options['trace'] in traces else []
+        else:
+            def total(trace_id):
+                roots = [s for s in traces[trace_id] if not s['parent_id']]
+                return max((s['duration_ms'] for s in roots), default=0)
+            selected = sorted(traces, key=total, reverse=True)[:options['limit']]
+
+        for trace_id in selected:
+            self.stdout.write(f'trace {trace_id}')
+            spans = traces[trace_id]
+            ids = {s['span_id'] for s in spans}
+            children = defaultdict(list)
+            for span in spans:
+                # Spans whose parent is missing (e.g. not yet flushed) are shown at the top
+                children[span['parent_id'] if span['parent_id'] in ids else None].append(span)
+            self.show(children, None, 1)
+
+    def show(self, children, parent_id, depth):
+        for span in sorted(children[parent_id], key=lambda s: s['start']):
+            if span['name'] == 'sql':
+                continue
+            error = f"  ERROR {span['error']}" if span['error'] else ''
+            self.stdout.write(f"{'  ' * depth}{span['name']}  {span['duration_ms']:.1f} ms  [pid {span['pid']}]{error}")
+            self.show(children, span['span_id'], depth + 1)
+        # SQL is summarised as a count and total time per parent span
+        queries = [s for s in children[parent_id] if s['name'] == 'sql']
+        if queries:
+            self.stdout.write(
+                f"{'  ' * depth}sql x{len(queries)}  {sum(s['duration_ms'] for s in queries):.1f} ms"
+            )
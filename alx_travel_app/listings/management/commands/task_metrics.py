@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from listings.metrics import is_shared, snapshot
+
+
+class Command(BaseCommand):
+    '''Print per-task latency and throughput recorded by the Celery workers'''
+    help = 'Show Celery task latency and throughput metrics'
+
+    def handle(self, *args, **kwargs):
+        if not is_shared():
+            raise CommandError(
+                'Metrics are kept in a per-process cache, so this command cannot see the '
+                'web and worker processes. Set REDIS_URL to share them.'
+            )
+        metrics = snapshot('tasks')
+        if not metrics:
+            self.stdout.write('No task metrics recorded yet.')
+            return
+
+        header = f"{'task':<55} {'count':>8} {'fail':>6} {'/min':>8} {'avg ms':>8} {'p50':>7} {'p95':>7} {'p99':>7}"
+        self.stdout.write(header)
+        for name, m in metrics.items():
+            self.stdout.write(
+                f"{name:<55} {m['count']:>8} {m.get('failures', 0):>6} {m['per_minute']:>8} "
+                f"{m.get('avg_ms', '-'):>8} {str(m.get('p50_ms', '-')):>7} "
+                f"{str(m.get('p95_ms', '-')):>7} {str(m.get('p99_ms', '-')):>7}"
+            )
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from listings.metrics import is_shared, snapshot
+
+
+class Command(BaseCommand):
+    '''Print requests rejected by the token-bucket throttle, per scope'''
+    help = 'Show rate-limited (429) request counts per throttle scope'
+
+    def handle(self, *args, **kwargs):
+        if not is_shared():
+            raise CommandError(
+                'Metrics are kept in a per-process cache, so this command cannot see the '
+                'web and worker processes. Set REDIS_URL to share them.'
+            )
+        metrics = snapshot('throttle')
+        self.stdout.write(f"{'scope':<15} {'per minute':>10} {'burst':>6} {'rejected':>9} {'/min':>8}")
+        for scope, (per_minute, burst) in settings.THROTTLE_BUCKETS.items():
+            m = metrics.get(f'{scope}.rejected', {})
+            self.stdout.write(
+                f"{scope:<15} {per_minute:>10} {burst:>6} {m.get('count', 0):>9} {m.get('per_minute', 0):>8}"
+            )
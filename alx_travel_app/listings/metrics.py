@@ -0,0 +1,123 @@
+"""
+Lightweight counters and latency histograms kept in the "metrics" cache.
+When that cache is shared (Redis) the numbers aggregate across web and
+worker processes; with LocMemCache they are per process, so the
+*_metrics management commands refuse to report them.
+"""
+
+import time
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.connection import ConnectionProxy
+
+cache = ConnectionProxy(caches, 'metrics')
+
+PREFIX = 'metrics'
+
+# Upper bounds (in milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Throughput is reported over this many one-minute buckets
+THROUGHPUT_WINDOW_MINUTES = 5
+
+KEY_TIMEOUT = 7 * 24 * 3600
+
+
+def _incr(key, delta=1, timeout=KEY_TIMEOUT):
+    '''Atomically increment a cache counter, creating it when missing'''
+    if cache.add(key, delta, timeout):
+        return delta
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # The key expired between add() and incr()
+        cache.set(key, delta, timeout)
+        return delta
+
+
+def is_shared():
+    '''False when metrics only live in this process'''
+    return not isinstance(caches['metrics'], LocMemCache)
+
+
+def _register(group, name):
+    '''
+    Remember a metric name so snapshot() can enumerate it. The first writer
+    of a name wins an atomic add() and appends it to the group's numbered
+    name slots, so concurrent first writes never lose a name.
+    '''
+    if cache.add(f'{PREFIX}:{group}:known:{name}', 1, None):
+        slot = _incr(f'{PREFIX}:{group}:names', timeout=None)
+        cache.set(f'{PREFIX}:{group}:names:{slot}', name, None)
+
+
+def _names(group):
+    count = cache.get(f'{PREFIX}:{group}:names') or 0
+    slots = cache.get_many([f'{PREFIX}:{group}:names:{i}' for i in range(1, count + 1)])
+    return sorted(set(slots.values()))
+
+
+def incr(group, name, delta=1):
+    '''Increment a plain counter, e.g. incr('throttle', 'search.rejected')'''
+    _register(group, name)
+    _incr(f'{PREFIX}:{group}:{name}:count', delta)
+    _incr(f'{PREFIX}:{group}:{name}:minute:{int(time.time() // 60)}', delta,
+          timeout=(THROUGHPUT_WINDOW_MINUTES + 1) * 60)
+
+
+def record_timing(group, name, seconds, failed=False):
+    '''Record one timed event (count, total time, histogram bucket, failures)'''
+    incr(group, name)
+    millis = seconds * 1000.0
+    _incr(f'{PREFIX}:{group}:{name}:total_us', int(seconds * 1_000_000))
+    bucket = next((b for b in LATENCY_BUCKETS_MS if millis <= b), 'inf')
+    _incr(f'{PREFIX}:{group}:{name}:le:{bucket}')
+    if failed:
+        _incr(f'{PREFIX}:{group}:{name}:failures')
+
+
+def _percentile(histogram, total, fraction):
+    '''Estimate a percentile from the cumulative histogram bucket bounds'''
+    if not total:
+        return None
+    threshold = total * fraction
+    seen = 0
+    for bound in LATENCY_BUCKETS_MS:
+        seen += histogram.get(bound, 0)
+        if seen >= threshold:
+            return bound
+    return float('inf')
+
+
+def snapshot(group):
+    '''Return a dict of metrics for every name recorded under ``group``'''
+    now_minute = int(time.time() // 60)
+    result = {}
+    for name in _names(group):
+        base = f'{PREFIX}:{group}:{name}'
+        keys = [f'{base}:count', f'{base}:total_us', f'{base}:failures']
+        keys += [f'{base}:le:{b}' for b in LATENCY_BUCKETS_MS + ('inf',)]
+        keys += [f'{base}:minute:{now_minute - i}' for i in range(1, THROUGHPUT_WINDOW_MINUTES + 1)]
+        values = cache.get_many(keys)
+
+        count = values.get(f'{base}:count', 0)
+        histogram = {b: values.get(f'{base}:le:{b}', 0) for b in LATENCY_BUCKETS_MS}
+        recent = sum(values.get(f'{base}:minute:{now_minute - i}', 0)
+                     for i in range(1, THROUGHPUT_WINDOW_MINUTES + 1))
+        total_us = values.get(f'{base}:total_us', 0)
+        timed = sum(histogram.values()) + values.get(f'{base}:le:inf', 0)
+
+        entry = {
+            'count': count,
+            'per_minute': round(recent / THROUGHPUT_WINDOW_MINUTES, 2),
+        }
+        if timed:
+            entry.update({
+                'failures': values.get(f'{base}:failures', 0),
+                'avg_ms': round(total_us / timed / 1000.0, 2),
+                'p50_ms': _percentile(histogram, timed, 0.50),
+                'p95_ms': _percentile(histogram, timed, 0.95),
+                'p99_ms': _percentile(histogram, timed, 0.99),
+            })
+        result[name] = entry
+    return result
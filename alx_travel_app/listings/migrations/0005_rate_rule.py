@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:00
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0004_payment_idempotency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateRule',
+            fields=[
+                ('rule_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('kind', models.CharField(choices=[('seasonal', 'Seasonal'), ('weekday', 'Weekday / Weekend'), ('length_of_stay', 'Length of Stay'), ('occupancy', 'Occupancy')], max_length=20)),
+                ('adjustment_percent', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('start_date', models.DateField(blank=True, null=True)),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('weekdays', models.JSONField(blank=True, default=list)),
+                ('min_nights', models.PositiveIntegerField(blank=True, null=True)),
+                ('min_occupancy', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rate_rules', to='listings.listing')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0005_rate_rule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='relevance_score',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['-relevance_score', 'listing_id'], name='listing_relevance_idx'),
+        ),
+    ]
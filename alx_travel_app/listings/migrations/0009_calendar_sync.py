@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:19
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('listings', '0008_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeed',
+            fields=[
+                ('feed_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('url', models.URLField(max_length=500)),
+                ('etag', models.CharField(blank=True, max_length=255)),
+                ('last_modified', models.CharField(blank=True, max_length=64)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feeds', to='listings.listing')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CalendarBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.CharField(max_length=255)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('summary', models.CharField(blank=True, max_length=255)),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_blocks', to='listings.listing')),
+                ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='listings.calendarfeed')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='calendarfeed',
+            constraint=models.UniqueConstraint(fields=('listing', 'url'), name='unique_calendar_feed_url'),
+        ),
+        migrations.AddIndex(
+            model_name='calendarblock',
+            index=models.Index(fields=['listing', 'start_date'], name='calendar_block_listing_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='calendarblock',
+            constraint=models.UniqueConstraint(fields=('feed', 'uid'), name='unique_calendar_block_uid'),
+        ),
+    ]
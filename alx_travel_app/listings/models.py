@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 import uuid
 from django.contrib.auth.models import AbstractUser
 #from django.contrib.postgres.fields import ArrayField
@@ -51,6 +52,13 @@ class BOOKING_STATUS(models.TextChoices):
     CANCELLED = 'cancelled', 'Cancelled'
     COMPLETED = 'completed', 'Completed'
 
+class RATE_RULE_KIND(models.TextChoices):
+    '''Kinds of dynamic pricing rules'''
+    SEASONAL = 'seasonal', 'Seasonal'
+    WEEKDAY = 'weekday', 'Weekday / Weekend'
+    LENGTH_OF_STAY = 'length_of_stay', 'Length of Stay'
+    OCCUPANCY = 'occupancy', 'Occupancy'
+
 
 class User(AbstractUser):
     '''Custom User model with additional fields'''
@@ -84,9 +92,16 @@ class Listing(models.Model):
     number_of_bedrooms = models.PositiveIntegerField()
     host = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listings')
     amenities = models.JSONField(choices=LISTING_AMENITIES.choices, default=list, blank=True)
+    # Precomputed "recommended" score, maintained by the refresh_relevance_scores task
+    relevance_score = models.FloatField(default=0.0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-relevance_score', 'listing_id'], name='listing_relevance_idx'),
+        ]
+
     def __str__(self):
         '''String that represents the listing object'''
         return f'{self.title} in {self.city}, {self.country} - ${self.price_per_night}/night'
@@ -104,6 +119,15 @@ class Booking(models.Model):
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Lets the archival task find ended bookings without a full scan
+            models.Index(fields=['check_out'], name='booking_check_out_idx'),
+            # Admin changelist ordering and its status filter
+            models.Index(fields=['-created_at'], name='booking_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='booking_status_created_idx'),
+        ]
+
     def __str__(self):
         '''String that represents the booking object'''
         return f'Booking {self.booking_id} for {self.listing.title} by {self.guest.email}'
@@ -117,6 +141,13 @@ class Review(models.Model):
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Admin changelist ordering and its rating filter
+            models.Index(fields=['-created_at'], name='review_created_idx'),
+            models.Index(fields=['rating', '-created_at'], name='review_rating_created_idx'),
+        ]
+
     def __str__(self):
         '''String that represents the review object'''
         return f'Review {self.review_id} for {self.listing.title} by {self.guest.email} - Rating: {self.rating}'
@@ -129,11 +160,153 @@ class Payment(models.Model):
     payment_status = models.CharField(max_length=10, choices=STATUS_CHOICES.choices, default=STATUS_CHOICES.PENDING)
     payment_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # A booking can only have one pending payment; enforced by the insert itself
+            models.UniqueConstraint(
+                fields=['booking_reference'],
+                condition=models.Q(payment_status=STATUS_CHOICES.PENDING),
+                name='unique_pending_payment_per_booking',
+            ),
+        ]
+        indexes = [
+            # Admin changelist ordering and its status filter
+            models.Index(fields=['-payment_date'], name='payment_date_idx'),
+            models.Index(fields=['payment_status', '-payment_date'], name='payment_status_date_idx'),
+        ]
+
     def __str__(self):
         '''String that represents the payment object'''
-        return f'Payment {self.transaction_id} for Booking {self.booking_reference.booking_id} - Amount: {self.amount} - Status: {self.status}'
+        return f'Payment {self.transaction_id} for Booking {self.booking_reference_id} - Amount: {self.amount} - Status: {self.payment_status}'
+
+class ArchivedBooking(models.Model):
+    '''
+    Cold copy of a booking that ended long ago, moved out of the hot Booking
+    table by the archival task. Field names mirror Booking so the same
+    lookups and serializers work on both.
+    '''
+    booking_id = models.UUIDField(primary_key=True, editable=False)
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='archived_bookings')
+    guest = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_bookings')
+    status = models.CharField(max_length=10, choices=BOOKING_STATUS.choices)
+    check_in = models.DateField()
+    check_out = models.DateField()
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        '''String that represents the archived booking object'''
+        return f'Archived booking {self.booking_id}'
+
+class ArchivedPayment(models.Model):
+    '''Cold copy of a payment whose booking was archived'''
+    id = models.BigIntegerField(primary_key=True)
+    booking_reference = models.ForeignKey(ArchivedBooking, on_delete=models.CASCADE, related_name='payments')
+    transaction_id = models.CharField(max_length=100, unique=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    payment_status = models.CharField(max_length=10, choices=STATUS_CHOICES.choices)
+    payment_date = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        '''String that represents the archived payment object'''
+        return f'Archived payment {self.transaction_id}'
+
+class RateRule(models.Model):
+    '''
+    Dynamic pricing rule for a listing. Every rule scales the nightly price by
+    ``adjustment_percent`` (e.g. 20 for +20%, -10 for a 10% discount) when:
+    - seasonal: the night falls between start_date and end_date (inclusive)
+    - weekday: the night's weekday (Monday=0) is in ``weekdays``
+    - length_of_stay: the stay is at least ``min_nights`` long (the longest matching rule applies)
+    - occupancy: the listing is at least ``min_occupancy`` percent booked around the stay
+    '''
+    rule_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='rate_rules')
+    name = models.CharField(max_length=100, blank=True)
+    kind = models.CharField(max_length=20, choices=RATE_RULE_KIND.choices)
+    adjustment_percent = models.DecimalField(max_digits=6, decimal_places=2)
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    weekdays = models.JSONField(default=list, blank=True)
+    min_nights = models.PositiveIntegerField(null=True, blank=True)
+    min_occupancy = models.PositiveIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        '''String that represents the rate rule object'''
+        return f'{self.get_kind_display()} rule {self.adjustment_percent:+}% for {self.listing_id}'
+
+class IdempotencyKey(models.Model):
+    '''First response returned for an Idempotency-Key, replayed on client retries'''
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    endpoint = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # When the request now processing the key took it; stale claims can be taken over
+    claimed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        '''String that represents the idempotency key object'''
+        return f'{self.endpoint} {self.key} ({self.response_status or "in progress"})'
+
+class CalendarFeed(models.Model):
+    '''External iCal feed (e.g. another platform's calendar) whose events block a listing'''
+    feed_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='calendar_feeds')
+    name = models.CharField(max_length=100, blank=True)
+    url = models.URLField(max_length=500)
+    # Validators of the last fetched copy, sent back as If-None-Match / If-Modified-Since
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['listing', 'url'], name='unique_calendar_feed_url'),
+        ]
+
+    def __str__(self):
+        '''String that represents the calendar feed object'''
+        return f'{self.name or self.url} for {self.listing_id}'
+
+class CalendarBlock(models.Model):
+    '''Dates blocked by one event of an imported calendar feed; end_date is exclusive'''
+    feed = models.ForeignKey(CalendarFeed, on_delete=models.CASCADE, related_name='blocks')
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='calendar_blocks')
+    uid = models.CharField(max_length=255)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    summary = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['feed', 'uid'], name='unique_calendar_block_uid'),
+        ]
+        indexes = [
+            # Availability searches look up a listing's blocks overlapping a window
+            models.Index(fields=['listing', 'start_date'], name='calendar_block_listing_idx'),
+        ]
+
+    def __str__(self):
+        '''String that represents the calendar block object'''
+        return f'{self.start_date} to {self.end_date} blocked by {self.feed_id}'
+
 
-    
 # End of models.py
 
 
@@ -0,0 +1,219 @@
+"""
+Vectorized dynamic pricing.
+Each listing's RateRules are compiled into small NumPy tables (cached per
+listing and evicted when its rules or base price change). Quotes for one or
+many listings over a date range are then computed in a single pass over a
+(listings x nights) price matrix instead of looping night by night.
+"""
+
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from .models import Booking, RateRule, RATE_RULE_KIND, BOOKING_STATUS
+
+RATE_TABLE_TTL = 24 * 3600
+
+# Occupancy rules look at how booked a listing is over this many days from check-in
+OCCUPANCY_WINDOW_DAYS = 30
+
+# Longest stay that can be quoted
+MAX_QUOTE_NIGHTS = 365
+
+CENT = Decimal('0.01')
+
+
+def parse_stay(check_in, check_out):
+    '''Parse and check a YYYY-MM-DD date pair; raises ValueError with a message'''
+    start = parse_date(check_in or '') if check_in else None
+    end = parse_date(check_out or '') if check_out else None
+    if start is None or end is None:
+        raise ValueError('check_in and check_out must be dates in YYYY-MM-DD format.')
+    if not 0 < (end - start).days <= MAX_QUOTE_NIGHTS:
+        raise ValueError(f'A stay must be between 1 and {MAX_QUOTE_NIGHTS} nights.')
+    return start, end
+
+
+def rate_table_key(listing_id):
+    '''Cache key of a listing's compiled rate table'''
+    return f'pricing:rate-table:{listing_id}'
+
+
+def invalidate_rate_table(listing_id):
+    '''Evict a compiled rate table after its rules or base price changed'''
+    cache.delete(rate_table_key(listing_id))
+
+
+def _factor(percent):
+    return max(0.0, 1.0 + float(percent) / 100.0)
+
+
+def compile_rate_table(base_price, rules):
+    '''Compile a listing's rules into NumPy arrays used by the quoting pass'''
+    seasonal = [r for r in rules if r.kind == RATE_RULE_KIND.SEASONAL and r.start_date and r.end_date]
+    stay = sorted(
+        (r for r in rules if r.kind == RATE_RULE_KIND.LENGTH_OF_STAY and r.min_nights),
+        key=lambda r: r.min_nights,
+    )
+    occupancy = sorted(
+        (r for r in rules if r.kind == RATE_RULE_KIND.OCCUPANCY and r.min_occupancy is not None),
+        key=lambda r: r.min_occupancy,
+    )
+
+    weekday = np.ones(7)
+    for rule in rules:
+        if rule.kind == RATE_RULE_KIND.WEEKDAY:
+            for day in rule.weekdays or ():
+                if 0 <= int(day) <= 6:
+                    weekday[int(day)] *= _factor(rule.adjustment_percent)
+
+    return {
+        'base': float(base_price),
+        'season_start': np.array([r.start_date for r in seasonal], dtype='datetime64[D]'),
+        'season_end': np.array([r.end_date for r in seasonal], dtype='datetime64[D]'),
+        'season_factor': np.array([_factor(r.adjustment_percent) for r in seasonal]),
+        'weekday_factor': weekday,
+        'stay_min_nights': np.array([r.min_nights for r in stay], dtype=np.int64),
+        'stay_factor': np.array([_factor(r.adjustment_percent) for r in stay]),
+        'occupancy_min': np.array([r.min_occupancy for r in occupancy], dtype=np.float64),
+        'occupancy_factor': np.array([_factor(r.adjustment_percent) for r in occupancy]),
+    }
+
+
+def get_rate_tables(listings):
+    '''Return {listing_id: table}, compiling cache misses with one rules query'''
+    keys = {rate_table_key(l.pk): l for l in listings}
+    cached = cache.get_many(list(keys))
+    tables = {keys[k].pk: table for k, table in cached.items()}
+
+    missing = [l for k, l in keys.items() if k not in cached]
+    if missing:
+        rules = {}
+        for rule in RateRule.objects.filter(listing_id__in=[l.pk for l in missing]):
+            rules.setdefault(rule.listing_id, []).append(rule)
+        compiled = {}
+        for listing in missing:
+            tables[listing.pk] = compile_rate_table(listing.price_per_night, rules.get(listing.pk, []))
+            compiled[rate_table_key(listing.pk)] = tables[listing.pk]
+        cache.set_many(compiled, RATE_TABLE_TTL)
+    return tables
+
+
+def _occupancy(listing_ids, check_in, exclude_booking=None):
+    '''
+    Percent of nights booked per listing in the occupancy window, from one
+    query. ``exclude_booking`` (a booking being repriced) does not count.
+    '''
+    window_start = np.datetime64(check_in, 'D')
+    window_end = window_start + OCCUPANCY_WINDOW_DAYS
+    end_date = check_in + timedelta(days=OCCUPANCY_WINDOW_DAYS)
+    bookings = Booking.objects.filter(
+        listing_id__in=listing_ids, check_in__lt=end_date, check_out__gt=check_in,
+    ).filter(~Q(status=BOOKING_STATUS.CANCELLED))
+    if exclude_booking is not None:
+        bookings = bookings.exclude(pk=exclude_booking)
+    rows = list(bookings.values_list('listing_id', 'check_in', 'check_out'))
+    booked = dict.fromkeys(listing_ids, 0.0)
+    if not rows:
+        return booked
+
+    owners, starts, ends = zip(*rows)
+    starts = np.maximum(np.array(starts, dtype='datetime64[D]'), window_start)
+    ends = np.minimum(np.array(ends, dtype='datetime64[D]'), window_end)
+    nights = np.clip((ends - starts).astype(np.int64), 0, None)
+    for owner, count in zip(owners, nights):
+        booked[owner] += count
+    return {k: min(v, OCCUPANCY_WINDOW_DAYS) * 100.0 / OCCUPANCY_WINDOW_DAYS for k, v in booked.items()}
+
+
+def _best_threshold_factor(owner, thresholds, factors, values, size):
+    '''
+    Per listing, the factor of its rule with the highest threshold <= the
+    listing's value (1.0 when no rule matches). All listings at once.
+    '''
+    result = np.ones(size)
+    if not owner.size:
+        return result
+    eligible = thresholds <= values[owner]
+    best = np.full(size, -np.inf)
+    np.maximum.at(best, owner[eligible], thresholds[eligible])
+    chosen = eligible & (thresholds == best[owner])
+    result[owner[chosen]] = factors[chosen]
+    return result
+
+
+def _stack(tables, ids, *names):
+    '''Concatenate per-listing rule arrays with the row index of their listing'''
+    parts = [tables[i][names[0]] for i in ids]
+    owner = np.repeat(np.arange(len(ids)), [p.size for p in parts])
+    return (owner,) + tuple(np.concatenate([tables[i][n] for i in ids]) for n in names)
+
+
+def nightly_prices(listings, check_in, check_out, exclude_booking=None):
+    '''
+    Return (listing_ids, nights, matrix) where matrix[i, j] is the price of
+    night j for listing i, with every rule applied in one vectorized pass.
+    ``exclude_booking`` is left out of the occupancy of a stay being repriced.
+    '''
+    nights = np.arange(np.datetime64(check_in, 'D'), np.datetime64(check_out, 'D'))
+    stay_length = len(nights)
+    tables = get_rate_tables(listings)
+    ids = [l.pk for l in listings]
+    size = len(ids)
+
+    # Base price x weekday factor; Monday=0 and 1970-01-01 was a Thursday
+    weekdays = (nights.astype(np.int64) + 3) % 7
+    base = np.array([tables[i]['base'] for i in ids])
+    weekday_factor = np.stack([tables[i]['weekday_factor'] for i in ids]) if ids else np.ones((0, 7))
+    prices = base[:, None] * weekday_factor[:, weekdays]
+
+    # Seasonal rules: one (rules x nights) mask, multiplied into each owner's row
+    owner, starts, ends, factors = _stack(tables, ids, 'season_start', 'season_end', 'season_factor')
+    if owner.size and stay_length:
+        in_season = (nights >= starts[:, None]) & (nights <= ends[:, None])
+        season = np.ones((size, stay_length))
+        np.multiply.at(season, owner, np.where(in_season, factors[:, None], 1.0))
+        prices *= season
+
+    # Stay-level rules: length of stay and occupancy
+    owner, thresholds, factors = _stack(tables, ids, 'stay_min_nights', 'stay_factor')
+    prices *= _best_threshold_factor(
+        owner, thresholds.astype(np.float64), factors, np.full(size, float(stay_length)), size,
+    )[:, None]
+
+    owner, thresholds, factors = _stack(tables, ids, 'occupancy_min', 'occupancy_factor')
+    if owner.size and stay_length:
+        occupancy = _occupancy(ids, check_in, exclude_booking)
+        values = np.array([occupancy[i] for i in ids])
+        prices *= _best_threshold_factor(owner, thresholds, factors, values, size)[:, None]
+
+    return ids, nights, np.round(np.maximum(prices, 0.0), 2)
+
+
+def _money(value):
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def quote(listing, check_in, check_out, exclude_booking=None):
+    '''Nightly breakdown and total for one listing; pass a booking's pk to reprice that booking'''
+    _, nights, matrix = nightly_prices([listing], check_in, check_out, exclude_booking)
+    return {
+        'listing': listing.pk,
+        'check_in': check_in,
+        'check_out': check_out,
+        'nights': [
+            {'date': str(night), 'price': _money(price)}
+            for night, price in zip(nights, matrix[0])
+        ],
+        'total': _money(matrix[0].sum()),
+    }
+
+
+def quote_many(listings, check_in, check_out):
+    '''Totals for many listings (e.g. a search results page) in one pass'''
+    if not listings:
+        return {}
+    ids, _, matrix = nightly_prices(listings, check_in, check_out)
+    return {listing_id: _money(total) for listing_id, total in zip(ids, matrix.sum(axis=1))}
@@ -1,13 +1,48 @@
 from rest_framework import serializers
-from .models import Listing, Booking, Payment
+from .models import (
+    Listing, Booking, Payment, RateRule, ArchivedBooking, ArchivedPayment, CalendarFeed,
+    LISTING_AMENITIES, RATE_RULE_KIND,
+)
+from .calendars import CalendarImportError, check_feed_url
+from .pricing import quote
+from .transitions import MAX_BATCH_SIZE, TRANSITIONS
 
 
 class ListingSerializer(serializers.ModelSerializer):
     '''Serializer for the Listing model'''
+    amenities = serializers.ListField(
+        child=serializers.ChoiceField(choices=LISTING_AMENITIES.choices),
+        required=False,
+    )
+
     class Meta:
         model = Listing
         fields = '__all__'
-        read_only_fields = ['listing_id', 'created_at', 'updated_at']
+        read_only_fields = ['listing_id', 'relevance_score', 'created_at', 'updated_at']
+
+    def to_representation(self, instance):
+        '''Add the quoted stay total and flexible-date check-ins when the view computed them'''
+        data = super().to_representation(instance)
+        quotes = self.context.get('quotes')
+        if quotes is not None:
+            total = quotes.get(instance.pk)
+            data['quote_total'] = str(total) if total is not None else None
+        check_ins = self.context.get('check_ins')
+        if check_ins is not None:
+            data['available_check_ins'] = [str(d) for d in check_ins.get(instance.pk, [])]
+        return data
+
+
+class ListingImportSerializer(ListingSerializer):
+    '''
+    Validates rows of a bulk listing import with the ListingSerializer rules.
+    The host is given by email and resolved in bulk by the importer, so the
+    host field is not looked up row by row here.
+    '''
+    host_email = serializers.EmailField(write_only=True)
+
+    class Meta(ListingSerializer.Meta):
+        read_only_fields = ListingSerializer.Meta.read_only_fields + ['host']
 
 
 class BookingSerializer(serializers.ModelSerializer):
@@ -17,20 +52,114 @@ class BookingSerializer(serializers.ModelSerializer):
         fields = ['booking_id', 'listing', 'guest', 'status', 'check_in', 'check_out', 'total_price', 'created_at']
         read_only_fields = ['booking_id', 'created_at', 'total_price']
 
+    def validate(self, attrs):
+        '''Check-out must be after check-in'''
+        check_in = attrs.get('check_in', getattr(self.instance, 'check_in', None))
+        check_out = attrs.get('check_out', getattr(self.instance, 'check_out', None))
+        if check_in and check_out and check_out <= check_in:
+            raise serializers.ValidationError({'check_out': 'Check-out must be after check-in.'})
+        return attrs
+
     def create(self, validated_data):
-        '''Calculate total_price based on check-in and check-out dates'''
-        check_in = validated_data['check_in']
-        check_out = validated_data['check_out']
-        nights = (check_out - check_in).days
-        listing = validated_data['listing']
-        validated_data['total_price'] = listing.price_per_night * nights
+        '''Calculate total_price from the listing's dynamic nightly rates'''
+        validated_data['total_price'] = quote(
+            validated_data['listing'], validated_data['check_in'], validated_data['check_out'],
+        )['total']
         return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        '''Reprice the stay when its listing or dates change'''
+        if any(
+            name in validated_data and validated_data[name] != getattr(instance, name)
+            for name in ('listing', 'check_in', 'check_out')
+        ):
+            validated_data['total_price'] = quote(
+                validated_data.get('listing', instance.listing),
+                validated_data.get('check_in', instance.check_in),
+                validated_data.get('check_out', instance.check_out),
+                exclude_booking=instance.pk,
+            )['total']
+        return super().update(instance, validated_data)
     
+class BookingStatusBatchSerializer(serializers.Serializer):
+    '''Input of a batch status change: booking ids and the status to move them to'''
+    ids = serializers.ListField(child=serializers.UUIDField(), min_length=1, max_length=MAX_BATCH_SIZE)
+    status = serializers.ChoiceField(choices=[(s.value, s.label) for s in TRANSITIONS])
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     '''Serializer for the Payment model'''
     class Meta:
         model = Payment
         fields = '__all__'
         read_only_fields = ['payment_date', 'transaction_id', 'payment_status']
+        # The one-pending-payment-per-booking constraint is enforced by the insert
+        # in initialize_payment, not by an extra SELECT during validation
+        validators = []
+
+
+class RateRuleSerializer(serializers.ModelSerializer):
+    '''Serializer for the RateRule model'''
+    class Meta:
+        model = RateRule
+        fields = '__all__'
+        read_only_fields = ['rule_id', 'created_at', 'updated_at']
+
+    def validate(self, attrs):
+        '''Each kind of rule needs its own condition fields'''
+        def get(name):
+            return attrs.get(name, getattr(self.instance, name, None))
+
+        kind = get('kind')
+        if kind == RATE_RULE_KIND.SEASONAL:
+            if not get('start_date') or not get('end_date') or get('end_date') < get('start_date'):
+                raise serializers.ValidationError('Seasonal rules need start_date <= end_date.')
+        elif kind == RATE_RULE_KIND.WEEKDAY:
+            weekdays = get('weekdays') or []
+            if not weekdays or any(not isinstance(d, int) or not 0 <= d <= 6 for d in weekdays):
+                raise serializers.ValidationError('Weekday rules need weekdays between 0 (Monday) and 6.')
+        elif kind == RATE_RULE_KIND.LENGTH_OF_STAY and not get('min_nights'):
+            raise serializers.ValidationError('Length of stay rules need min_nights.')
+        elif kind == RATE_RULE_KIND.OCCUPANCY:
+            if get('min_occupancy') is None or get('min_occupancy') > 100:
+                raise serializers.ValidationError('Occupancy rules need min_occupancy between 0 and 100.')
+        return attrs
+
+
+class ArchivedBookingSerializer(serializers.ModelSerializer):
+    '''Read-only serializer for archived bookings, shaped like BookingSerializer'''
+    class Meta:
+        model = ArchivedBooking
+        fields = BookingSerializer.Meta.fields + ['archived_at']
+        read_only_fields = fields
+
+
+class ArchivedPaymentSerializer(serializers.ModelSerializer):
+    '''Read-only serializer for archived payments, shaped like PaymentSerializer'''
+    class Meta:
+        model = ArchivedPayment
+        fields = '__all__'
+        read_only_fields = ['id', 'booking_reference', 'transaction_id', 'amount',
+                            'payment_status', 'payment_date', 'archived_at']
+
+
+class CalendarFeedSerializer(serializers.ModelSerializer):
+    '''Serializer for external iCal feeds imported into a listing'''
+    class Meta:
+        model = CalendarFeed
+        fields = ['feed_id', 'listing', 'name', 'url', 'last_synced_at', 'last_error', 'created_at']
+        read_only_fields = ['feed_id', 'last_synced_at', 'last_error', 'created_at']
 
+    def validate_listing(self, value):
+        '''A feed's imported blocks belong to its listing, so it cannot be moved to another one'''
+        if self.instance is not None and value.pk != self.instance.listing_id:
+            raise serializers.ValidationError('A feed cannot be moved to another listing; add a new feed instead.')
+        return value
 
+    def validate_url(self, value):
+        '''Only public http(s) feeds can be imported'''
+        try:
+            check_feed_url(value)
+        except CalendarImportError as e:
+            raise serializers.ValidationError(str(e))
+        return value
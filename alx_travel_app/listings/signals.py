@@ -0,0 +1,52 @@
+"""
+Signal handlers that keep cached data consistent with the database.
+"""
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .authentication import revoke_cached_token
+from .models import User, Listing, Booking, RateRule
+from .pricing import invalidate_rate_table
+from .calendars import export_horizon, invalidate_feeds
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def evict_token(sender, instance, **kwargs):
+    '''Revoke a token from the auth cache when it is created, changed or deleted'''
+    revoke_cached_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def evict_user_tokens(sender, instance, **kwargs):
+    '''A deactivated or changed user must not keep authenticating from the cache'''
+    for key in Token.objects.filter(user_id=instance.pk).values_list('key', flat=True):
+        revoke_cached_token(key)
+
+
+@receiver(post_save, sender=RateRule)
+@receiver(post_delete, sender=RateRule)
+def evict_rate_table(sender, instance, **kwargs):
+    '''Recompile a listing's rate table after one of its rules changed'''
+    invalidate_rate_table(instance.listing_id)
+
+
+@receiver(post_save, sender=Listing)
+def evict_listing_rate_table(sender, instance, created, **kwargs):
+    '''The compiled rate table embeds the base price'''
+    if not created:
+        invalidate_rate_table(instance.pk)
+
+
+@receiver(post_save, sender=Booking)
+def evict_calendar_feed(sender, instance, **kwargs):
+    '''Rebuild the listing's iCal feed on its next poll'''
+    invalidate_feeds([instance.listing_id])
+
+
+@receiver(post_delete, sender=Booking)
+def evict_calendar_feed_on_delete(sender, instance, **kwargs):
+    '''Archived bookings ended long ago and were no longer in the feed'''
+    if instance.check_out >= export_horizon():
+        invalidate_feeds([instance.listing_id])
@@ -0,0 +1,234 @@
+"""
+"Stays like this one" recommendations.
+Every listing is embedded as a small float32 feature vector (amenities,
+property type, bedrooms, price, location and rating). The vectors live in
+one in-memory NumPy matrix persisted to SIMILARITY_INDEX_PATH; a Celery task
+refreshes it incrementally and web processes reload the file when it
+changes; until the first build exists, queries are refused rather than
+building the index inside a request. A query is a single matrix-vector product followed by an
+argpartition top-K, so it stays fast at a million listings.
+"""
+
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Avg
+from django.utils import timezone
+from .models import Listing, Review, LISTING_AMENITIES, PROPERTY_TYPE
+
+AMENITIES = [value for value, _ in LISTING_AMENITIES.choices]
+PROPERTY_TYPES = [value for value, _ in PROPERTY_TYPE.choices]
+COUNTRY_BUCKETS = 8
+CITY_BUCKETS = 8
+
+# Relative weight of each feature group in the distance
+WEIGHTS = {
+    'amenities': 1.0,
+    'property_type': 1.0,
+    'bedrooms': 1.5,
+    'price': 2.0,
+    'country': 1.5,
+    'city': 1.0,
+    'rating': 1.0,
+}
+
+DIMENSIONS = len(AMENITIES) + len(PROPERTY_TYPES) + 3 + COUNTRY_BUCKETS + CITY_BUCKETS + 1
+MAX_SIMILAR = 50
+
+# While no index file exists, a build is enqueued at most this often
+BUILD_RETRY_SECONDS = 300
+
+# Fields needed to build a vector
+VECTOR_FIELDS = ('pk', 'amenities', 'property_type', 'number_of_bedrooms', 'price_per_night', 'city', 'country')
+
+_AMENITY_INDEX = {a: i for i, a in enumerate(AMENITIES)}
+_TYPE_OFFSET = len(AMENITIES)
+_TYPE_INDEX = {t: _TYPE_OFFSET + i for i, t in enumerate(PROPERTY_TYPES)}
+_BEDROOMS = _TYPE_OFFSET + len(PROPERTY_TYPES)
+_PRICE = _BEDROOMS + 1
+_COUNTRY = _PRICE + 2
+_CITY = _COUNTRY + COUNTRY_BUCKETS
+_RATING = _CITY + CITY_BUCKETS
+
+
+def _bucket(text, buckets):
+    '''Stable hash bucket for a location string'''
+    return zlib.crc32((text or '').strip().lower().encode()) % buckets
+
+
+def build_vectors(rows, ratings):
+    '''
+    Build a (len(rows), DIMENSIONS) float32 matrix from value tuples in
+    VECTOR_FIELDS order; ``ratings`` maps listing id -> average rating.
+    '''
+    vectors = np.zeros((len(rows), DIMENSIONS), dtype=np.float32)
+    amenity_weight = WEIGHTS['amenities'] / np.sqrt(len(AMENITIES))
+    for i, (pk, amenities, property_type, bedrooms, price, city, country) in enumerate(rows):
+        for amenity in amenities or ():
+            column = _AMENITY_INDEX.get(amenity)
+            if column is not None:
+                vectors[i, column] = amenity_weight
+        column = _TYPE_INDEX.get(property_type)
+        if column is not None:
+            vectors[i, column] = WEIGHTS['property_type']
+        vectors[i, _BEDROOMS] = WEIGHTS['bedrooms'] * min(bedrooms or 0, 10) / 10.0
+        # Log scale so 50 vs 100 matters as much as 500 vs 1000
+        vectors[i, _PRICE] = WEIGHTS['price'] * np.log1p(float(price or 0)) / np.log1p(10000.0)
+        vectors[i, _COUNTRY + _bucket(country, COUNTRY_BUCKETS)] = WEIGHTS['country']
+        vectors[i, _CITY + _bucket(city, CITY_BUCKETS)] = WEIGHTS['city']
+        rating = ratings.get(pk)
+        # Unrated listings sit in the middle of the rating scale
+        vectors[i, _RATING] = WEIGHTS['rating'] * ((rating if rating is not None else 3.0) / 5.0)
+    return vectors
+
+
+def vectors_for(listing_ids, chunk_size=5000):
+    '''Query the database and build vectors for the given listings, a chunk at a time'''
+    ids, parts = [], [np.zeros((0, DIMENSIONS), dtype=np.float32)]
+    listing_ids = list(listing_ids)
+    for start in range(0, len(listing_ids), chunk_size):
+        chunk = listing_ids[start:start + chunk_size]
+        rows = list(Listing.objects.filter(pk__in=chunk).values_list(*VECTOR_FIELDS))
+        ratings = dict(
+            Review.objects.filter(listing_id__in=[r[0] for r in rows])
+            .values('listing_id').annotate(avg=Avg('rating')).values_list('listing_id', 'avg')
+        )
+        ids.extend(r[0] for r in rows)
+        parts.append(build_vectors(rows, ratings))
+    return ids, np.concatenate(parts)
+
+
+class SimilarityIndex:
+    '''Listing vectors plus the row lookup needed to query them'''
+
+    def __init__(self, ids, vectors, built_at):
+        self.ids = np.asarray(ids, dtype='U36')
+        self.vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, DIMENSIONS)
+        self.built_at = built_at
+        # ||x||^2 per row; ranking by 2 x.q - ||x||^2 equals ranking by -||x - q||^2
+        self.sq_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        self.rows = {listing_id: row for row, listing_id in enumerate(self.ids)}
+
+    @classmethod
+    def empty(cls):
+        return cls([], np.zeros((0, DIMENSIONS), dtype=np.float32), None)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            built_at = float(data['built_at'][0]) if data['built_at'].size else None
+            return cls(data['ids'], data['vectors'], built_at)
+
+    def save(self, path):
+        '''Write atomically so readers never see a partial file'''
+        tmp = f'{path}.tmp.npz'
+        np.savez(tmp, ids=self.ids, vectors=self.vectors,
+                 built_at=np.array([self.built_at] if self.built_at else [], dtype=np.float64))
+        os.replace(tmp, path)
+
+    def query(self, vector, k, exclude=None):
+        '''Return [(listing_id, distance)] of the k nearest listings'''
+        scores = 2.0 * (self.vectors @ vector) - self.sq_norms
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        k = min(k, len(scores) - (1 if exclude is not None else 0))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        q_norm = float(vector @ vector)
+        distances = np.sqrt(np.maximum(q_norm - scores[top], 0.0))
+        return [(self.ids[i], float(d)) for i, d in zip(top, distances)]
+
+
+def refresh_index(path=None, full=False):
+    '''
+    Bring the persisted index up to date and return it. Only listings that
+    changed (or got new reviews) since the last build are re-embedded;
+    deleted listings are dropped.
+    '''
+    path = path or settings.SIMILARITY_INDEX_PATH
+    started = timezone.now()
+    index = SimilarityIndex.empty() if full or not os.path.exists(path) else SimilarityIndex.load(path)
+
+    current = set(str(pk) for pk in Listing.objects.values_list('pk', flat=True))
+    if index.built_at is None:
+        changed = current
+    else:
+        since = datetime.fromtimestamp(index.built_at, tz=dt_timezone.utc)
+        changed = set(str(pk) for pk in Listing.objects.filter(updated_at__gte=since).values_list('pk', flat=True))
+        changed |= set(str(pk) for pk in Review.objects.filter(created_at__gte=since).values_list('listing_id', flat=True))
+        changed |= current - set(index.rows)
+        changed &= current
+
+    keep = np.array([lid in current and lid not in changed for lid in index.ids], dtype=bool)
+    new_ids, new_vectors = vectors_for(changed)
+
+    refreshed = SimilarityIndex(
+        list(index.ids[keep]) + [str(pk) for pk in new_ids],
+        np.concatenate([index.vectors[keep], new_vectors]),
+        started.timestamp(),
+    )
+    refreshed.save(path)
+    return refreshed
+
+
+_lock = threading.Lock()
+_loaded = {'index': None, 'mtime': None, 'checked': 0.0}
+
+
+def schedule_build():
+    '''Enqueue a full index build, once per BUILD_RETRY_SECONDS across processes'''
+    from .tasks import refresh_similarity_index
+
+    if cache.add('similarity:build-scheduled', 1, BUILD_RETRY_SECONDS):
+        refresh_similarity_index.delay(full=True)
+
+
+def get_index():
+    '''
+    The process-wide index, reloaded when the file on disk is replaced
+    (checked at most every SIMILARITY_RELOAD_SECONDS). None when no worker
+    has written it yet; a build is enqueued instead.
+    '''
+    now = time.monotonic()
+    if _loaded['index'] is not None and now - _loaded['checked'] < settings.SIMILARITY_RELOAD_SECONDS:
+        return _loaded['index']
+
+    with _lock:
+        path = settings.SIMILARITY_INDEX_PATH
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != _loaded['mtime']:
+            _loaded['index'] = SimilarityIndex.load(path)
+        _loaded['mtime'] = mtime
+        _loaded['checked'] = now
+        index = _loaded['index']
+    if index is None:
+        schedule_build()
+    return index
+
+
+def similar_listings(listing_id, k=10):
+    '''Ids and distances of the k listings most similar to ``listing_id``; None until the index is built'''
+    index = get_index()
+    if index is None:
+        return None
+    listing_id = str(listing_id)
+    row = index.rows.get(listing_id)
+    if row is not None:
+        vector = index.vectors[row]
+    else:
+        # Listing created after the last refresh: embed it on the fly
+        ids, vectors = vectors_for([listing_id])
+        if not ids:
+            return []
+        vector = vectors[0]
+    return index.query(vector, min(k, MAX_SIMILAR), exclude=row)
@@ -0,0 +1,124 @@
+"""
+Server-sent event / long-poll stream of booking and payment changes.
+The view is async, so under the ASGI ``application`` an open stream only
+costs a coroutine waiting on the broker instead of a worker thread, and
+clients no longer need to poll my_bookings, host_bookings or verify_payment.
+"""
+
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed
+from .authentication import CachedTokenAuthentication
+from .events import event_id, get_broker, parse_event_id
+
+
+async def _authenticate(request):
+    '''The user of a token (Authorization header) or session, or None'''
+    try:
+        result = await sync_to_async(CachedTokenAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    if result is not None:
+        return result[0]
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def _resume_point(request, broker):
+    '''(seq to resume after, False when the client's Last-Event-ID is unknown or stale)'''
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    if not last_id:
+        return broker.last_seq, True
+    seq = parse_event_id(last_id)
+    if seq is None:
+        return broker.last_seq, False
+    return seq, True
+
+
+def _frame(kind, data, seq):
+    return f'id: {event_id(seq)}\nevent: {kind}\ndata: {json.dumps(data)}\n\n'
+
+
+async def _sse(broker, user_id, after, complete):
+    '''Yield SSE frames for the user's events until the client disconnects'''
+    ready = broker.subscribe(user_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            ready.clear()
+            events, known = broker.since(user_id, after)
+            if not (complete and known):
+                # Resume point lost: the client should reload over the REST endpoints
+                after, complete = broker.last_seq, True
+                yield _frame('reset', {}, after)
+                continue
+            for event in events:
+                after = event.seq
+                yield _frame(event.kind, event.data, event.seq)
+            if not events:
+                try:
+                    await asyncio.wait_for(ready.wait(), settings.EVENT_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+    finally:
+        broker.unsubscribe(user_id, ready)
+
+
+async def _long_poll(broker, user_id, after, complete, wait):
+    '''Wait up to ``wait`` seconds for events after ``after`` and return them as JSON'''
+    ready = broker.subscribe(user_id)
+    try:
+        while True:
+            ready.clear()
+            events, known = broker.since(user_id, after)
+            if events or not (complete and known):
+                break
+            try:
+                await asyncio.wait_for(ready.wait(), wait)
+            except asyncio.TimeoutError:
+                events, known = broker.since(user_id, after)
+                break
+    finally:
+        broker.unsubscribe(user_id, ready)
+
+    if not (complete and known):
+        return JsonResponse({'reset': True, 'events': [], 'last_event_id': event_id(broker.last_seq)})
+    return JsonResponse({
+        'reset': False,
+        'events': [{'id': event_id(e.seq), 'event': e.kind, 'data': e.data} for e in events],
+        'last_event_id': event_id(events[-1].seq if events else after),
+    })
+
+
+@require_GET
+async def event_stream(request):
+    '''
+    Booking and payment events of the authenticated user (as guest or host).
+    Streams text/event-stream by default; ?wait=N long-polls for up to N
+    seconds and returns JSON instead. Resume with the Last-Event-ID header
+    (or ?last_event_id=); a "reset" event means events were missed and the
+    client should reload its bookings.
+    '''
+    user = await _authenticate(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    broker = get_broker()
+    after, complete = _resume_point(request, broker)
+
+    wait = request.GET.get('wait')
+    if wait is not None:
+        try:
+            wait = max(0.0, min(float(wait), settings.EVENT_STREAM_MAX_WAIT))
+        except ValueError:
+            return JsonResponse({'error': 'wait must be a number of seconds.'}, status=400)
+        return await _long_poll(broker, user.pk, after, complete, wait)
+
+    response = StreamingHttpResponse(_sse(broker, user.pk, after, complete), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,15 +1,22 @@
 """
-Celery task for sending booking confrimation email asynchronously.
+Celery tasks: booking confirmation emails and periodic maintenance.
 """
 
+from datetime import timedelta
 from celery import shared_task
-from django.core.mail import send_mail
+from django.core.mail import send_mail, send_mass_mail
 from django.conf import settings
+from django.utils import timezone
+from .models import IdempotencyKey, CalendarFeed
+from .similarity import refresh_index
+from .ranking import refresh_relevance_scores as refresh_scores
+from .archival import archive_bookings
+from .calendars import sync_feed
 
-@shared_task
+@shared_task(ignore_result=True)
 def send_booking_confirmation_email(to_email, listing_name, start_date, end_date):
     '''Background task to send booking confirmation email asynchronously'''
-    subject = "Booking Confirmation for {listing_name}"
+    subject = f"Booking Confirmation for {listing_name}"
     message = (
         f"Hi there, \n\n"
         f"Your booking for {listing_name} has been confirmed!\n"
@@ -23,7 +30,7 @@ def send_booking_confirmation_email(to_email, listing_name, start_date, end_date
     send_mail(
         subject,
         message,
-        settings.DEFUALT_FROM_EMAIL, # Here you can use a default email,
+        settings.DEFAULT_FROM_EMAIL, # Here you can use a default email,
         [to_email],
         fail_silently=False,
     )
@@ -31,3 +38,76 @@ def send_booking_confirmation_email(to_email, listing_name, start_date, end_date
     return f"Booking confirmation sent to {to_email}"
 
 
+@shared_task(ignore_result=True)
+def send_booking_status_notifications(status, notifications):
+    '''
+    One task per batch status change: every guest gets a single email listing
+    their affected bookings, all sent over one SMTP connection.
+    '''
+    by_guest = {}
+    for item in notifications:
+        if item.get('email'):
+            by_guest.setdefault(item['email'], []).append(item)
+
+    messages = []
+    for email, items in by_guest.items():
+        lines = "\n".join(
+            f"- {item['listing']}: {item['check_in']} to {item['check_out']}" for item in items
+        )
+        messages.append((
+            f"Your booking is now {status}" if len(items) == 1 else f"{len(items)} of your bookings are now {status}",
+            f"Hi there, \n\nThe following bookings are now {status}:\n{lines}\n\n"
+            f"Best regards, \nTravel App Team",
+            settings.DEFAULT_FROM_EMAIL,
+            [email],
+        ))
+    return send_mass_mail(messages, fail_silently=False)
+
+
+@shared_task(ignore_result=True)
+def purge_idempotency_keys():
+    '''Delete stored Idempotency-Key responses older than IDEMPOTENCY_KEY_TTL'''
+    cutoff = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+@shared_task(ignore_result=True)
+def refresh_similarity_index(full=False):
+    '''Re-embed listings changed since the last run and rewrite the similarity index'''
+    index = refresh_index(full=full)
+    return len(index.ids)
+
+
+@shared_task(ignore_result=True)
+def refresh_relevance_scores():
+    '''Recompute the precomputed relevance score used by ?ordering=relevance'''
+    return refresh_scores()
+
+
+@shared_task(ignore_result=True)
+def archive_old_bookings(max_chunks=None):
+    '''Move finished bookings (and their payments) older than the horizon to the archive'''
+    return archive_bookings(max_chunks=max_chunks)
+
+
+@shared_task(ignore_result=True)
+def sync_calendar_feed(feed_id):
+    '''Import one external iCal feed, applying only the blocks that changed'''
+    feed = CalendarFeed.objects.filter(pk=feed_id).first()
+    if feed is None:
+        return None
+    return sync_feed(feed)
+
+
+@shared_task(ignore_result=True)
+def sync_calendar_feeds():
+    '''
+    Queue an import of every external feed. Feeds are fetched conditionally,
+    so the ones that did not change cost a single 304 response.
+    '''
+    feed_ids = CalendarFeed.objects.values_list('feed_id', flat=True)
+    count = 0
+    for count, feed_id in enumerate(feed_ids.iterator(chunk_size=2000), 1):
+        sync_calendar_feed.delay(str(feed_id))
+    return count
@@ -1,3 +1,1543 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import json
+import socket
+import tempfile
+import threading
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from unittest import mock
+import numpy as np
+from asgiref.sync import iscoroutinefunction
+import requests
+from django.core.cache import cache, caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from alx_travel_app import schema
+from alx_travel_app.celery import app as celery_app, apply_queue_worker_options
+from . import admin as listings_admin, events, exports, metrics, pricing, ranking, similarity, throttling, tracing
+from .archival import archive_bookings
+from .availability import feasible_check_ins
+from .calendars import CalendarImportError, _fold, apply_events, check_feed_url, iter_events, render_event, sync_feed, unfold
+from .chapa_simulator import ChapaSimulator, RateLimiter
+from .events import EventBroker, event_id, publish_booking_event
+from .imports import ListingImporter, RejectSample, iter_records
+from .models import User, Listing, Booking, Payment, IdempotencyKey, RateRule, Review, ArchivedBooking, ArchivedPayment, CalendarFeed, CalendarBlock, BOOKING_STATUS, RATE_RULE_KIND, PROPERTY_TYPE, STATUS_CHOICES, USER_ROLE
 
-# Create your tests here.
+
+# A fast hasher keeps user creation cheap
+fast_hashing = override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+
+
+def setUpModule():
+    '''Run Celery tasks inline; no broker is needed for the tests'''
+    # Settings are loaded with the CELERY namespace, so keys keep their prefix
+    celery_app.conf.CELERY_TASK_ALWAYS_EAGER = True
+    fast_hashing.enable()
+
+
+def tearDownModule():
+    celery_app.conf.CELERY_TASK_ALWAYS_EAGER = False
+    fast_hashing.disable()
+
+
+def make_user(name, role=USER_ROLE.GUEST, **extra):
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com', password='pass1234',
+        first_name=name.title(), last_name='Test', role=role, **extra,
+    )
+
+
+def make_listing(host, price=100, **extra):
+    fields = {
+        'title': 'Sea view flat', 'description': 'Two rooms by the sea', 'address': '1 Beach Road',
+        'city': 'Mombasa', 'state': 'Coast', 'country': 'Kenya', 'price_per_night': price,
+        'property_type': PROPERTY_TYPE.choices[0][0], 'number_of_bedrooms': 2,
+    }
+    fields.update(extra)
+    return Listing.objects.create(host=host, **fields)
+
+
+def make_booking(listing, guest, check_in, nights, status=BOOKING_STATUS.PENDING, total_price=100):
+    return Booking.objects.create(
+        listing=listing, guest=guest, status=status, check_in=check_in,
+        check_out=check_in + timedelta(days=nights), total_price=total_price,
+    )
+
+
+class TaskRoutingTests(TestCase):
+    '''user-026: queue routing, per-queue worker options and task metrics'''
+
+    def setUp(self):
+        caches['metrics'].clear()
+
+    def test_tasks_are_routed_to_their_queues(self):
+        router = celery_app.amqp.router
+        for task, queue in (
+            ('listings.tasks.send_booking_confirmation_email', 'email'),
+            ('listings.tasks.archive_old_bookings', 'maintenance'),
+        ):
+            route = router.route({}, task)
+            self.assertEqual(route['queue'].name, queue)
+
+    def test_shared_worker_uses_most_conservative_profile(self):
+        class Conf:
+            worker_prefetch_multiplier = None
+            task_acks_late = None
+
+        conf = Conf()
+        apply_queue_worker_options(conf=conf, options={'queues': 'email,payments'})
+        self.assertEqual(conf.worker_prefetch_multiplier, 1)
+        self.assertTrue(conf.task_acks_late)
+
+        conf = Conf()
+        apply_queue_worker_options(conf=conf, options={'queues': ['email']})
+        self.assertEqual(conf.worker_prefetch_multiplier, 16)
+        self.assertFalse(conf.task_acks_late)
+
+    def test_timings_give_counts_failures_and_percentiles(self):
+        # 90 fast (<= 5 ms) and 10 slow (<= 250 ms) runs, one of them failed
+        for _ in range(90):
+            metrics.record_timing('tasks', 'demo', 0.004)
+        for i in range(10):
+            metrics.record_timing('tasks', 'demo', 0.2, failed=(i == 0))
+
+        entry = metrics.snapshot('tasks')['demo']
+        self.assertEqual(entry['count'], 100)
+        self.assertEqual(entry['failures'], 1)
+        self.assertEqual(entry['p50_ms'], 5)
+        self.assertEqual(entry['p95_ms'], 250)
+        self.assertAlmostEqual(entry['avg_ms'], (90 * 4 + 10 * 200) / 100, places=1)
+
+    def test_every_registered_name_is_listed_once(self):
+        for name in ('b', 'a', 'b', 'c'):
+            metrics.incr('demo', name)
+        self.assertEqual(list(metrics.snapshot('demo')), ['a', 'b', 'c'])
+        self.assertEqual(metrics.snapshot('demo')['b']['count'], 2)
+
+    def test_commands_refuse_per_process_metrics(self):
+        self.assertFalse(metrics.is_shared())
+        with self.assertRaises(CommandError):
+            call_command('task_metrics')
+        with self.assertRaises(CommandError):
+            call_command('throttle_metrics')
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    '''user-027: cached token lookups and revocation'''
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('guest')
+        self.token = Token.objects.create(user=self.user)
+
+    def test_obtain_token_with_email_and_password(self):
+        response = self.client.post('/api/auth/token/', {'username': 'guest@example.com', 'password': 'pass1234'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['token'], self.token.key)
+
+    def test_token_and_bearer_keywords(self):
+        for keyword in ('Token', 'Bearer'):
+            response = self.client.get('/api/bookings/my_bookings/', HTTP_AUTHORIZATION=f'{keyword} {self.token.key}')
+            self.assertEqual(response.status_code, 200, keyword)
+
+    def test_second_lookup_skips_the_token_query(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        self.client.get('/api/bookings/my_bookings/', **auth)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/bookings/my_bookings/', **auth)
+        self.assertFalse([q for q in queries.captured_queries if 'authtoken_token' in q['sql']])
+
+    def test_unknown_token_is_rejected_and_negatively_cached(self):
+        auth = {'HTTP_AUTHORIZATION': 'Token not-a-real-key'}
+        self.assertEqual(self.client.get('/api/bookings/my_bookings/', **auth).status_code, 401)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/bookings/my_bookings/', **auth).status_code, 401)
+        self.assertEqual(len(queries), 0)
+
+    def test_revoked_token_stops_working_immediately(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        self.assertEqual(self.client.get('/api/bookings/my_bookings/', **auth).status_code, 200)
+        self.assertEqual(self.client.delete('/api/auth/token/', **auth).status_code, 204)
+        self.assertEqual(self.client.get('/api/bookings/my_bookings/', **auth).status_code, 401)
+
+    def test_deactivated_user_is_rejected_despite_cached_token(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+        self.client.get('/api/bookings/my_bookings/', **auth)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/bookings/my_bookings/', **auth).status_code, 401)
+
+
+class ExportTests(APITestCase):
+    '''user-028: streaming CSV / NDJSON exports'''
+
+    def setUp(self):
+        cache.clear()
+        self.host = make_user('host', USER_ROLE.HOST)
+        self.guest = make_user('guest')
+        self.other = make_user('other')
+        listing = make_listing(self.host)
+        start = date(2030, 1, 1)
+        self.bookings = [make_booking(listing, self.guest, start + timedelta(days=3 * i), 2, total_price=200 + i)
+                         for i in range(5)]
+        self.bookings[0].status = BOOKING_STATUS.CANCELLED
+        self.bookings[0].save()
+        make_booking(listing, self.other, start, 1)
+        Payment.objects.create(booking_reference=self.bookings[1], transaction_id='tx-1', amount=201,
+                               payment_status=STATUS_CHOICES.SUCCESS)
+        self.client.force_authenticate(self.guest)
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_has_header_and_only_the_users_rows(self):
+        response, body = self.export('/api/bookings/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], list(exports.BOOKING_EXPORT_FIELDS))
+        self.assertEqual(sorted(r[0] for r in rows[1:]), sorted(str(b.pk) for b in self.bookings))
+        self.assertTrue(all(r[3] == 'guest@example.com' for r in rows[1:]))
+
+    def test_ndjson_with_status_filter(self):
+        _, body = self.export('/api/bookings/export/?export_format=ndjson&status=cancelled')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([r['booking_id'] for r in rows], [str(self.bookings[0].pk)])
+        self.assertEqual(rows[0]['total_price'], '200.00')
+
+    def test_rows_are_flushed_in_chunks(self):
+        with mock.patch.object(exports, 'EXPORT_FLUSH_ROWS', 2):
+            response = self.client.get('/api/bookings/export/?export_format=ndjson')
+            chunks = [c for c in response.streaming_content if c]
+        self.assertEqual([len(c.decode().splitlines()) for c in chunks], [2, 2, 1])
+
+    def test_payment_export(self):
+        _, body = self.export('/api/payments/export/?export_format=ndjson')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(r['transaction_id'], r['booking_id'], r['amount']) for r in rows],
+                         [('tx-1', str(self.bookings[1].pk), '201.00')])
+
+    def test_exports_stream_without_distinct(self):
+        for url in ('/api/bookings/export/', '/api/payments/export/'):
+            with CaptureQueriesContext(connection) as queries:
+                self.export(url)
+            selects = [q['sql'] for q in queries if q['sql'].lstrip().upper().startswith('SELECT')]
+            self.assertTrue(selects, url)
+            self.assertFalse(any('DISTINCT' in sql.upper() for sql in selects), url)
+
+    def test_invalid_parameters(self):
+        for query in ('export_format=xml', 'date_from=yesterday'):
+            response = self.client.get(f'/api/bookings/export/?{query}')
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_anonymous_export_is_refused(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/bookings/export/').status_code, 401)
+
+
+IMPORT_CSV = """title,description,address,city,state,country,price_per_night,property_type,number_of_bedrooms,host_email,amenities,listing_id
+Loft,Nice,1 Road,Nairobi,NRB,Kenya,80.00,apartment,1,HOST@example.com,wifi|parking,
+Cabin,Quiet,2 Road,Nakuru,NKR,Kenya,120.00,apartment,2,host@example.com,"[""wifi""]",
+Bad price,x,3 Road,Nairobi,NRB,Kenya,cheap,apartment,1,host@example.com,,
+Nobody,x,4 Road,Nairobi,NRB,Kenya,50.00,apartment,1,ghost@example.com,,
+"""
+
+
+class ListingImportTests(APITestCase):
+    '''user-029: streaming bulk listing import'''
+
+    def setUp(self):
+        cache.clear()
+        self.host = make_user('host', USER_ROLE.HOST)
+
+    def run_import(self, text, fmt='csv', **kwargs):
+        rejects = RejectSample()
+        stats = ListingImporter(reject_file=rejects, **kwargs).run(iter_records(io.StringIO(text), fmt))
+        return stats, rejects.rows
+
+    def test_csv_rows_are_created_and_bad_rows_rejected(self):
+        progress = []
+        stats, rejected = self.run_import(IMPORT_CSV, batch_size=2, progress=progress.append)
+        self.assertEqual(stats, {'rows': 4, 'created': 2, 'updated': 0, 'rejected': 2})
+        self.assertEqual([p['rows'] for p in progress], [2, 4])
+        self.assertEqual([r['line'] for r in rejected], [4, 5])
+        self.assertIn('price_per_night', rejected[0]['errors'])
+        self.assertIn('host_email', rejected[1]['errors'])
+
+        loft = Listing.objects.get(title='Loft')
+        self.assertEqual(loft.host, self.host)
+        self.assertEqual(loft.amenities, ['wifi', 'parking'])
+        self.assertEqual(Listing.objects.get(title='Cabin').amenities, ['wifi'])
+
+    def test_rows_with_listing_id_are_upserted(self):
+        listing = make_listing(self.host, price=10)
+        row = {
+            'listing_id': str(listing.pk), 'title': 'Renamed', 'description': 'd', 'address': 'a',
+            'city': 'c', 'state': 's', 'country': 'k', 'price_per_night': '99.00',
+            'property_type': 'apartment', 'number_of_bedrooms': 3, 'host_email': 'host@example.com',
+        }
+        stats, _ = self.run_import(json.dumps(row) + '\n{not json}\n', fmt='ndjson')
+        self.assertEqual(stats, {'rows': 2, 'created': 0, 'updated': 1, 'rejected': 1})
+        listing.refresh_from_db()
+        self.assertEqual((listing.title, listing.price_per_night, listing.number_of_bedrooms), ('Renamed', 99, 3))
+
+    def test_upload_endpoint_is_admin_only(self):
+        upload = SimpleUploadedFile('listings.csv', IMPORT_CSV.encode())
+        self.client.force_authenticate(self.host)
+        response = self.client.post('/api/listings/bulk_import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 403)
+
+        admin = make_user('admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        upload.seek(0)
+        response = self.client.post('/api/listings/bulk_import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['rejected']), (2, 2))
+        self.assertEqual(len(response.data['rejected_rows']), 2)
+
+
+def chapa_reply(status_code=200, body=None):
+    reply = mock.Mock(status_code=status_code)
+    reply.json.return_value = body or {'status': 'success', 'data': {'checkout_url': 'https://checkout.test/x'}}
+    return reply
+
+
+@override_settings(CHAPA_SECRET_KEY='test-key', IDEMPOTENCY_CLAIM_LEASE=60)
+class IdempotencyKeyTests(APITestCase):
+    '''user-030: Idempotency-Key replay, conflicts and abandoned claims'''
+
+    def setUp(self):
+        cache.clear()
+        self.guest = make_user('guest')
+        booking = make_booking(make_listing(make_user('host', USER_ROLE.HOST)), self.guest, date(2030, 1, 1), 2)
+        self.payload = {'booking_reference': str(booking.pk), 'amount': '200.00'}
+        self.client.force_authenticate(self.guest)
+        chapa = mock.patch('listings.views.requests.post', return_value=chapa_reply())
+        self.chapa = chapa.start()
+        self.addCleanup(chapa.stop)
+
+    def pay(self, key='key-1', payload=None):
+        return self.client.post('/api/payments/initialize_payment/', payload or self.payload,
+                                format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def claim(self, age):
+        body = json.dumps(self.payload, sort_keys=True, default=str)
+        return IdempotencyKey.objects.create(
+            user=self.guest, endpoint='initialize_payment', key='key-1',
+            request_hash=hashlib.sha256(body.encode()).hexdigest(),
+            claimed_at=timezone.now() - timedelta(seconds=age),
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first = self.pay()
+        second = self.pay()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.chapa.call_count, 1)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_key_reused_for_another_payload(self):
+        self.pay()
+        response = self.pay(payload={**self.payload, 'amount': '1.00'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_claim_in_progress_conflicts(self):
+        self.claim(age=5)
+        self.assertEqual(self.pay().status_code, 409)
+        self.assertEqual(self.chapa.call_count, 0)
+
+    def test_abandoned_claim_is_taken_over(self):
+        record = self.claim(age=120)
+        response = self.pay()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.chapa.call_count, 1)
+        record.refresh_from_db()
+        self.assertEqual(record.response_status, 201)
+        self.assertEqual(self.pay().data, response.data)
+
+    def test_stale_owner_cannot_record_after_takeover(self):
+        def slow_chapa(*args, **kwargs):
+            # Another retry takes the claim over while this request waits on Chapa
+            IdempotencyKey.objects.update(claimed_at=timezone.now() + timedelta(seconds=1))
+            return chapa_reply()
+
+        self.chapa.side_effect = slow_chapa
+        self.assertEqual(self.pay().status_code, 201)
+        self.assertIsNone(IdempotencyKey.objects.get().response_status)
+
+    def test_server_errors_are_not_stored(self):
+        self.chapa.side_effect = ConnectionError('down')
+        self.assertEqual(self.pay().status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.chapa.side_effect = None
+        self.assertEqual(self.pay().status_code, 201)
+
+
+class CachedSchemaTests(APITestCase):
+    '''user-031: precomputed OpenAPI schema with ETag and gzip'''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.schema_dir = tempfile.TemporaryDirectory()
+        cls.settings = override_settings(SCHEMA_CACHE_DIR=Path(cls.schema_dir.name), APP_VERSION='test')
+        cls.settings.enable()
+        schema.code_version.cache_clear()
+        schema._schemas.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        schema.code_version.cache_clear()
+        schema._schemas.clear()
+        cls.schema_dir.cleanup()
+        super().tearDownClass()
+
+    def test_schema_is_built_once_and_written_to_disk(self):
+        first = self.client.get('/api/schema/?format=json')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('/api/listings/', json.loads(first.content)['paths'])
+        self.assertTrue(schema.schema_path('test', 'json').exists())
+        with mock.patch.object(schema, 'build_schema') as build:
+            self.assertEqual(self.client.get('/api/schema/?format=json').content, first.content)
+        build.assert_not_called()
+
+    def test_etag_revalidation(self):
+        etag = self.client.get('/api/schema/')['ETag']
+        response = self.client.get('/api/schema/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_gzip_follows_accept_encoding_q_values(self):
+        plain = self.client.get('/api/schema/').content
+        zipped = self.client.get('/api/schema/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.content), plain)
+        refused = self.client.get('/api/schema/', HTTP_ACCEPT_ENCODING='gzip;q=0, br')
+        self.assertFalse(refused.has_header('Content-Encoding'))
+        self.assertEqual(refused.content, plain)
+
+    def test_accepts_gzip(self):
+        for header, expected in (
+            ('gzip', True), ('GZIP;q=0.5', True), ('gzip;q=0', False), ('gzip; q=0.0', False),
+            ('br, *;q=0.1', True), ('*;q=0', False), ('gzip;q=0, *', False), ('identity', False), ('', False),
+        ):
+            self.assertEqual(schema.accepts_gzip(header), expected, header)
+
+    def test_lang_and_version_are_generated_per_request(self):
+        for query in ('lang=en', 'version=v2'):
+            with mock.patch.object(schema, 'get_schema') as cached:
+                response = self.client.get(f'/api/schema/?format=json&{query}', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response.status_code, 200, query)
+            cached.assert_not_called()
+            self.assertIn('paths', json.loads(response.content))
+
+
+def reference_quote(listing, check_in, check_out, occupancy=0.0):
+    '''Night-by-night price with the documented rule semantics, to check the vectorized pass'''
+    rules = list(listing.rate_rules.all())
+    nights = (check_out - check_in).days
+
+    def factor(rule):
+        return max(0.0, 1 + float(rule.adjustment_percent) / 100)
+
+    def best(candidates, value, threshold):
+        matching = [r for r in candidates if threshold(r) <= value]
+        return factor(max(matching, key=threshold)) if matching else 1.0
+
+    stay_factor = best([r for r in rules if r.kind == RATE_RULE_KIND.LENGTH_OF_STAY], nights, lambda r: r.min_nights)
+    stay_factor *= best([r for r in rules if r.kind == RATE_RULE_KIND.OCCUPANCY], occupancy, lambda r: r.min_occupancy)
+    total = 0.0
+    for offset in range(nights):
+        night = check_in + timedelta(days=offset)
+        price = float(listing.price_per_night) * stay_factor
+        for rule in rules:
+            if rule.kind == RATE_RULE_KIND.SEASONAL and rule.start_date <= night <= rule.end_date:
+                price *= factor(rule)
+            elif rule.kind == RATE_RULE_KIND.WEEKDAY and night.weekday() in rule.weekdays:
+                price *= factor(rule)
+        total += round(price, 2)
+    return Decimal(str(total)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class PricingTests(APITestCase):
+    '''user-032: vectorized dynamic pricing and booking totals'''
+
+    def setUp(self):
+        cache.clear()
+        self.host = make_user('host', role=USER_ROLE.HOST)
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host, price=100)
+        self.start = date(2030, 7, 1)  # a Monday
+
+    def rule(self, kind, percent, **fields):
+        return RateRule.objects.create(listing=self.listing, kind=kind, adjustment_percent=percent, **fields)
+
+    def test_no_rules_is_base_price_per_night(self):
+        result = pricing.quote(self.listing, self.start, self.start + timedelta(days=3))
+        self.assertEqual([n['price'] for n in result['nights']], [Decimal('100.00')] * 3)
+        self.assertEqual(result['total'], Decimal('300.00'))
+
+    def test_stacked_rules_match_a_per_night_loop(self):
+        self.rule(RATE_RULE_KIND.SEASONAL, 20, start_date=date(2030, 7, 4), end_date=date(2030, 7, 10))
+        self.rule(RATE_RULE_KIND.SEASONAL, 5, start_date=date(2030, 7, 9), end_date=date(2030, 7, 20))
+        self.rule(RATE_RULE_KIND.WEEKDAY, 15, weekdays=[4, 5])
+        self.rule(RATE_RULE_KIND.WEEKDAY, -10, weekdays=[5, 6])
+        self.rule(RATE_RULE_KIND.LENGTH_OF_STAY, -5, min_nights=3)
+        self.rule(RATE_RULE_KIND.LENGTH_OF_STAY, -12.5, min_nights=7)
+        self.rule(RATE_RULE_KIND.LENGTH_OF_STAY, -20, min_nights=30)
+        for nights in (1, 3, 6, 7, 14):
+            check_out = self.start + timedelta(days=nights)
+            self.assertEqual(
+                pricing.quote(self.listing, self.start, check_out)['total'],
+                reference_quote(self.listing, self.start, check_out), nights,
+            )
+
+    def test_only_the_highest_matching_threshold_applies(self):
+        self.rule(RATE_RULE_KIND.LENGTH_OF_STAY, -10, min_nights=2)
+        self.rule(RATE_RULE_KIND.LENGTH_OF_STAY, -50, min_nights=5)
+        self.assertEqual(pricing.quote(self.listing, self.start, self.start + timedelta(days=1))['total'], Decimal('100.00'))
+        self.assertEqual(pricing.quote(self.listing, self.start, self.start + timedelta(days=4))['total'], Decimal('360.00'))
+        self.assertEqual(pricing.quote(self.listing, self.start, self.start + timedelta(days=5))['total'], Decimal('250.00'))
+
+    def test_occupancy_rule_uses_booked_nights_in_the_window(self):
+        self.rule(RATE_RULE_KIND.OCCUPANCY, 30, min_occupancy=40)
+        # 12 of the 30 nights after check-in are booked (40%); a cancelled stay does not count
+        make_booking(self.listing, self.guest, self.start + timedelta(days=5), 12, status=BOOKING_STATUS.CONFIRMED)
+        make_booking(self.listing, self.guest, self.start + timedelta(days=20), 5, status=BOOKING_STATUS.CANCELLED)
+        check_out = self.start + timedelta(days=2)
+        self.assertEqual(pricing.quote(self.listing, self.start, check_out)['total'], Decimal('260.00'))
+        self.assertEqual(pricing.quote(self.listing, self.start, check_out)['total'],
+                         reference_quote(self.listing, self.start, check_out, occupancy=40))
+
+    def test_rescheduled_booking_does_not_count_toward_its_own_occupancy(self):
+        self.rule(RATE_RULE_KIND.OCCUPANCY, 50, min_occupancy=20)
+        self.client.force_authenticate(self.guest)
+        # A 7-night stay fills 23% of the window from its own check-in
+        response = self.client.post('/api/bookings/', {
+            'listing': self.listing.pk, 'guest': self.guest.pk, 'check_in': '2030-07-01', 'check_out': '2030-07-08',
+        })
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('700.00'))
+        response = self.client.post(f'/api/bookings/{response.data["booking_id"]}/reschedule/',
+                                    {'check_in': '2030-07-02', 'check_out': '2030-07-09'})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('700.00'))
+
+    def test_quote_many_matches_single_quotes(self):
+        other = make_listing(self.host, price=80)
+        RateRule.objects.create(listing=other, kind=RATE_RULE_KIND.WEEKDAY, adjustment_percent=50, weekdays=[0])
+        self.rule(RATE_RULE_KIND.SEASONAL, -25, start_date=self.start, end_date=self.start)
+        check_out = self.start + timedelta(days=4)
+        totals = pricing.quote_many([self.listing, other], self.start, check_out)
+        self.assertEqual(totals[self.listing.pk], Decimal('375.00'))
+        self.assertEqual(totals[other.pk], Decimal('360.00'))
+
+    def test_rule_changes_evict_the_cached_rate_table(self):
+        check_out = self.start + timedelta(days=2)
+        self.assertEqual(pricing.quote(self.listing, self.start, check_out)['total'], Decimal('200.00'))
+        self.rule(RATE_RULE_KIND.WEEKDAY, 10, weekdays=[0, 1])
+        self.assertEqual(pricing.quote(self.listing, self.start, check_out)['total'], Decimal('220.00'))
+
+    def test_quote_endpoint_validates_dates(self):
+        url = f'/api/listings/{self.listing.pk}/quote/'
+        response = self.client.get(url, {'check_in': '2030-07-01', 'check_out': '2030-07-03'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.data['total']), Decimal('200.00'))
+        self.assertEqual(self.client.get(url, {'check_in': '2030-07-03', 'check_out': '2030-07-01'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'check_in': 'soon'}).status_code, 400)
+
+    def test_booking_is_priced_on_create_and_repriced_on_reschedule(self):
+        self.rule(RATE_RULE_KIND.LENGTH_OF_STAY, -10, min_nights=3)
+        self.client.force_authenticate(self.guest)
+        response = self.client.post('/api/bookings/', {
+            'listing': self.listing.pk, 'guest': self.guest.pk, 'check_in': '2030-07-01', 'check_out': '2030-07-03',
+        })
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('200.00'))
+        url = f'/api/bookings/{response.data["booking_id"]}/'
+
+        response = self.client.post(f'{url}reschedule/', {'check_out': '2030-07-05'})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('360.00'))
+
+        response = self.client.patch(url, {'check_in': '2030-07-04'})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('100.00'))
+
+        Booking.objects.filter(pk=response.data['booking_id']).update(total_price=42)
+        response = self.client.patch(url, {'status': BOOKING_STATUS.PENDING})
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('42.00'))
+
+
+class SimilarityTests(APITestCase):
+    '''user-033: "stays like this one" index and top-K queries'''
+
+    def setUp(self):
+        cache.clear()
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.index_dir.cleanup)
+        self.path = str(Path(self.index_dir.name) / 'index.npz')
+        settings = override_settings(SIMILARITY_INDEX_PATH=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        loaded = mock.patch.dict(similarity._loaded, {'index': None, 'mtime': None, 'checked': 0.0})
+        loaded.start()
+        self.addCleanup(loaded.stop)
+
+        host = make_user('host', role=USER_ROLE.HOST)
+        self.listing = make_listing(host, price=100)
+        self.close = make_listing(host, price=110)
+        self.far = make_listing(host, price=2500, city='Lagos', country='Nigeria', number_of_bedrooms=8)
+        self.others = [make_listing(host, price=65 + 50 * i, number_of_bedrooms=1 + i % 4) for i in range(6)]
+
+    def test_missing_index_is_built_by_a_task_not_the_request(self):
+        with mock.patch('listings.tasks.refresh_similarity_index.delay') as delay:
+            response = self.client.get(f'/api/listings/{self.listing.pk}/similar/')
+            self.client.get(f'/api/listings/{self.listing.pk}/similar/')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        delay.assert_called_once_with(full=True)
+        self.assertFalse(Path(self.path).exists())
+
+    def test_results_once_the_index_is_built(self):
+        self.assertEqual(self.client.get(f'/api/listings/{self.listing.pk}/similar/').status_code, 503)
+        # The eagerly run task has written the index
+        response = self.client.get(f'/api/listings/{self.listing.pk}/similar/', {'k': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['listing_id'], str(self.close.pk))
+        self.assertNotIn(str(self.listing.pk), [r['listing_id'] for r in response.data])
+        distances = [r['distance'] for r in response.data]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_query_matches_brute_force_distances(self):
+        index = similarity.refresh_index(self.path)
+        row = index.rows[str(self.listing.pk)]
+        distances = np.linalg.norm(index.vectors - index.vectors[row], axis=1)
+        distances[row] = np.inf
+        expected = [index.ids[i] for i in np.argsort(distances, kind='stable')[:5]]
+        matches = index.query(index.vectors[row], 5, exclude=row)
+        self.assertEqual([listing_id for listing_id, _ in matches], expected)
+        for listing_id, distance in matches:
+            # float32 scores lose about 1e-3 of absolute precision
+            self.assertAlmostEqual(distance, float(distances[index.rows[listing_id]]), delta=2e-3)
+
+    def test_refresh_reembeds_changed_listings_and_drops_deleted_ones(self):
+        index = similarity.refresh_index(self.path)
+        before = index.vectors[index.rows[str(self.close.pk)]].copy()
+        Listing.objects.filter(pk=self.close.pk).update(price_per_night=900, updated_at=timezone.now())
+        self.far.delete()
+        added = make_listing(self.listing.host, price=70)
+
+        refreshed = similarity.refresh_index(self.path)
+        self.assertEqual(set(refreshed.ids), {str(l.pk) for l in Listing.objects.all()})
+        self.assertIn(str(added.pk), refreshed.rows)
+        self.assertFalse(np.allclose(refreshed.vectors[refreshed.rows[str(self.close.pk)]], before))
+        self.assertEqual(similarity.SimilarityIndex.load(self.path).ids.tolist(), refreshed.ids.tolist())
+
+    def test_listing_newer_than_the_index_is_embedded_on_the_fly(self):
+        similarity.refresh_index(self.path)
+        added = make_listing(self.listing.host, price=100)
+        matches = similarity.similar_listings(added.pk, 2)
+        self.assertEqual(matches[0][0], str(self.listing.pk))
+        self.assertAlmostEqual(matches[0][1], 0.0, delta=2e-3)
+
+
+class RelevanceRankingTests(APITestCase):
+    '''user-034: precomputed relevance score and bounded top-K search'''
+
+    def setUp(self):
+        cache.clear()
+        self.host = make_user('host', role=USER_ROLE.HOST)
+        self.guest = make_user('guest')
+
+    def test_score_components(self):
+        # New, unreviewed, average priced, never booked: 0.35*3/5 + 0.10 + 0.20*0.5 + 0.20*0.5
+        score = ranking.relevance_scores(
+            ratings=np.array([0.0]), review_counts=np.array([0.0]), age_days=np.array([0.0]),
+            prices=np.array([100.0]), group_avg_prices=np.array([100.0]),
+            converted=np.array([0.0]), bookings=np.array([0.0]), global_rating=3.0,
+        )
+        self.assertAlmostEqual(float(score[0]), 0.51)
+
+        # Five 5-star reviews against a 3.0 prior give a rating of 4.0; half-price saturates the price term
+        score = ranking.relevance_scores(
+            ratings=np.array([5.0]), review_counts=np.array([5.0]), age_days=np.array([ranking.RECENCY_DAYS]),
+            prices=np.array([50.0]), group_avg_prices=np.array([100.0]),
+            converted=np.array([3.0]), bookings=np.array([4.0]), global_rating=3.0,
+        )
+        expected = (0.35 * 4.0 / 5 + 0.15 * np.log1p(5) / np.log1p(100) + 0.10 * np.exp(-1)
+                    + 0.20 * 1.0 + 0.20 * 4 / 6)
+        self.assertAlmostEqual(float(score[0]), expected)
+
+    def test_refresh_is_independent_of_the_chunk_size(self):
+        listings = [make_listing(self.host, price=80 + 20 * i) for i in range(5)]
+        for i, listing in enumerate(listings):
+            for rating in range(1, i + 2):
+                Review.objects.create(listing=listing, guest=self.guest, rating=rating)
+        make_booking(listings[0], self.guest, date(2030, 1, 1), 2, status=BOOKING_STATUS.CONFIRMED)
+        make_booking(listings[0], self.guest, date(2030, 2, 1), 2, status=BOOKING_STATUS.CANCELLED)
+
+        self.assertEqual(ranking.refresh_relevance_scores(chunk_size=2), 5)
+        chunked = dict(Listing.objects.values_list('pk', 'relevance_score'))
+        ranking.refresh_relevance_scores()
+        for pk, score in Listing.objects.values_list('pk', 'relevance_score'):
+            self.assertAlmostEqual(score, chunked[pk])
+        self.assertTrue(all(score > 0 for score in chunked.values()))
+
+    def test_ordering_and_top_k(self):
+        scores = [0.2, 0.9, 0.5, 0.7, 0.1]
+        listings = [make_listing(self.host, relevance_score=score) for score in scores]
+        by_relevance = [str(l.pk) for _, l in sorted(zip(scores, listings), key=lambda x: -x[0])]
+
+        response = self.client.get('/api/listings/', {'ordering': 'relevance'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['listing_id'] for r in response.data], by_relevance)
+
+        response = self.client.get('/api/listings/', {'top': 2})
+        self.assertEqual([r['listing_id'] for r in response.data], by_relevance[:2])
+        self.assertEqual(self.client.get('/api/listings/', {'top': 'many'}).status_code, 400)
+
+
+class ArchivalTests(APITestCase):
+    '''user-035: hot/cold archival of finished bookings and archive fallback reads'''
+
+    def setUp(self):
+        cache.clear()
+        self.host = make_user('host', role=USER_ROLE.HOST)
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host)
+        old = timezone.now().date() - timedelta(days=400)
+        self.done = make_booking(self.listing, self.guest, old, 3, status=BOOKING_STATUS.COMPLETED)
+        self.cancelled = make_booking(self.listing, self.guest, old + timedelta(days=10), 2, status=BOOKING_STATUS.CANCELLED)
+        self.old_confirmed = make_booking(self.listing, self.guest, old + timedelta(days=20), 2, status=BOOKING_STATUS.CONFIRMED)
+        self.recent = make_booking(self.listing, self.guest, timezone.now().date() - timedelta(days=10), 2,
+                                   status=BOOKING_STATUS.COMPLETED)
+        self.payment = Payment.objects.create(
+            booking_reference=self.done, transaction_id='tx-old', amount=300, payment_status=STATUS_CHOICES.SUCCESS,
+        )
+
+    def test_only_old_finished_bookings_move_with_their_payments(self):
+        self.assertEqual(archive_bookings(chunk_size=1), 2)
+        self.assertEqual(set(ArchivedBooking.objects.values_list('pk', flat=True)), {self.done.pk, self.cancelled.pk})
+        self.assertEqual(set(Booking.objects.values_list('pk', flat=True)), {self.old_confirmed.pk, self.recent.pk})
+        archived = ArchivedPayment.objects.get()
+        self.assertEqual((archived.pk, archived.booking_reference_id), (self.payment.pk, self.done.pk))
+        self.assertFalse(Payment.objects.exists())
+        self.assertEqual(archive_bookings(), 0)
+
+    def test_max_chunks_bounds_one_run(self):
+        self.assertEqual(archive_bookings(chunk_size=1, max_chunks=1), 1)
+        self.assertEqual(archive_bookings(chunk_size=1, max_chunks=1), 1)
+        self.assertEqual(archive_bookings(chunk_size=1, max_chunks=1), 0)
+
+    def test_archived_rows_are_still_readable_by_their_owner(self):
+        archive_bookings()
+        self.client.force_authenticate(self.guest)
+        response = self.client.get(f'/api/bookings/{self.done.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['booking_id'], str(self.done.pk))
+        self.assertIn('archived_at', response.data)
+        response = self.client.get(f'/api/payments/{self.payment.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['transaction_id'], 'tx-old')
+        mine = [b['booking_id'] for b in self.client.get('/api/bookings/my_bookings/').data]
+        self.assertCountEqual(mine, [str(b.pk) for b in (self.done, self.cancelled, self.old_confirmed, self.recent)])
+
+        self.client.force_authenticate(make_user('stranger'))
+        self.assertEqual(self.client.get(f'/api/bookings/{self.done.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/payments/{self.payment.pk}/').status_code, 404)
+
+    def test_malformed_ids_are_not_found(self):
+        self.client.force_authenticate(self.guest)
+        self.assertEqual(self.client.get('/api/bookings/not-a-uuid/').status_code, 404)
+        self.assertEqual(self.client.get('/api/payments/abc/').status_code, 404)
+
+
+class FlexibleAvailabilityTests(APITestCase):
+    '''user-036: flexible-date search with the sweep-line occupancy bitmap'''
+
+    def setUp(self):
+        cache.clear()
+        self.host = make_user('host', role=USER_ROLE.HOST)
+        self.guest = make_user('guest')
+        self.start = date(2030, 3, 1)
+        self.end = self.start + timedelta(days=14)
+
+    def brute_force(self, listing, nights):
+        '''Check every candidate stay night by night against every booking and block'''
+        taken = [
+            (b.check_in, b.check_out)
+            for b in listing.bookings.exclude(status=BOOKING_STATUS.CANCELLED)
+        ] + [(b.start_date, b.end_date) for b in listing.calendar_blocks.all()]
+        result = []
+        for offset in range((self.end - self.start).days - nights + 1):
+            check_in = self.start + timedelta(days=offset)
+            stay = [check_in + timedelta(days=n) for n in range(nights)]
+            if not any(start <= night < end for night in stay for start, end in taken):
+                result.append(check_in)
+        return result
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(36)
+        listings = []
+        for i in range(8):
+            listing = make_listing(self.host)
+            listings.append(listing)
+            for _ in range(int(rng.integers(0, 4))):
+                check_in = self.start + timedelta(days=int(rng.integers(-5, 16)))
+                status = BOOKING_STATUS.CANCELLED if rng.random() < 0.2 else BOOKING_STATUS.CONFIRMED
+                make_booking(listing, self.guest, check_in, int(rng.integers(1, 6)), status=status)
+            if i % 3 == 0:
+                feed = CalendarFeed.objects.create(listing=listing, url=f'https://example.com/{i}.ics')
+                blocked = self.start + timedelta(days=int(rng.integers(0, 14)))
+                CalendarBlock.objects.create(feed=feed, listing=listing, uid=f'u{i}', start_date=blocked,
+                                             end_date=blocked + timedelta(days=2))
+
+        for nights in (1, 3, 7):
+            result = feasible_check_ins(Listing.objects.all(), self.start, self.end, nights)
+            for listing in listings:
+                expected = self.brute_force(listing, nights)
+                if listing.pk in result:
+                    self.assertEqual(result[listing.pk], expected, (listing.pk, nights))
+                else:
+                    self.assertEqual(len(expected), (self.end - self.start).days - nights + 1)
+
+    def test_check_out_day_is_free_for_the_next_check_in(self):
+        listing = make_listing(self.host)
+        make_booking(listing, self.guest, self.start + timedelta(days=2), 3)
+        result = feasible_check_ins(Listing.objects.all(), self.start, self.start + timedelta(days=8), 2)
+        self.assertEqual(result[listing.pk], [self.start, self.start + timedelta(days=5), self.start + timedelta(days=6)])
+
+    def test_window_search_endpoint(self):
+        make_listing(self.host, title='Free')
+        full = make_listing(self.host, title='Full')
+        partly = make_listing(self.host, title='Partly')
+        make_booking(full, self.guest, self.start, 14, status=BOOKING_STATUS.CONFIRMED)
+        make_booking(partly, self.guest, self.start, 12, status=BOOKING_STATUS.CONFIRMED)
+
+        response = self.client.get('/api/listings/', {
+            'window_start': str(self.start), 'window_end': str(self.end), 'nights': 2,
+        })
+        self.assertEqual(response.status_code, 200)
+        found = {r['title']: r['available_check_ins'] for r in response.data}
+        self.assertNotIn('Full', found)
+        self.assertEqual(found['Partly'], [str(self.start + timedelta(days=12))])
+        self.assertEqual(len(found['Free']), 13)
+
+        for params in ({'window_start': str(self.start), 'window_end': str(self.end)},
+                       {'window_start': str(self.start), 'window_end': str(self.end), 'nights': 20},
+                       {'window_start': str(self.start), 'window_end': '2031-01-01', 'nights': 2}):
+            self.assertEqual(self.client.get('/api/listings/', params).status_code, 400, params)
+
+    def test_window_search_does_not_bind_every_infeasible_listing(self):
+        full = [make_listing(self.host, title=f'Full {i}') for i in range(30)]
+        for listing in full:
+            make_booking(listing, self.guest, self.start, 14, status=BOOKING_STATUS.CONFIRMED)
+        free = [make_listing(self.host, title=f'Free {i}', relevance_score=i) for i in range(3)]
+        params = {'window_start': str(self.start), 'window_end': str(self.end), 'nights': 2}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/listings/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({r['title'] for r in response.data}, {l.title for l in free})
+        for query in queries.captured_queries:
+            self.assertNotIn(full[0].pk.hex, query['sql'])
+
+        response = self.client.get('/api/listings/', {**params, 'top': 2})
+        self.assertEqual([r['title'] for r in response.data], ['Free 2', 'Free 1'])
+
+
+class EventStreamTests(APITestCase):
+    '''user-037: booking and payment event broker and its long-poll stream'''
+
+    def setUp(self):
+        cache.clear()
+        self.broker = EventBroker(history=3, max_users=2)
+        patcher = mock.patch('listings.events._broker', self.broker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.host = make_user('host', role=USER_ROLE.HOST)
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host)
+
+    def poll(self, user, **params):
+        self.client.force_login(user)
+        response = self.client.get('/api/events/', {'wait': 0, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_history_and_eviction(self):
+        first = self.broker.publish(['a'], 'one', {})
+        for kind in ('two', 'three', 'four'):
+            self.broker.publish(['a'], kind, {})
+        events, complete = self.broker.since('a', first.seq)
+        self.assertEqual([e.kind for e in events], ['two', 'three', 'four'])
+        self.assertTrue(complete)
+        # "two" fell out of the three-event history as well
+        self.broker.publish(['a'], 'five', {})
+        self.assertFalse(self.broker.since('a', first.seq)[1])
+
+    def test_least_recently_active_users_are_forgotten(self):
+        self.broker.publish(['a'], 'x', {})
+        self.broker.publish(['b'], 'x', {})
+        self.broker.publish(['c'], 'x', {})
+        self.assertEqual(self.broker.since('a', 0), ([], True))
+        self.assertEqual(len(self.broker.since('c', 0)[0]), 1)
+
+    def test_guest_and_host_receive_booking_events_after_commit(self):
+        booking = make_booking(self.listing, self.guest, date(2030, 5, 1), 2)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            publish_booking_event('booking.created', booking)
+        self.assertEqual(self.broker.last_seq, 0)
+        for callback in callbacks:
+            callback()
+
+        for user in (self.guest, self.host):
+            body = self.poll(user, last_event_id=event_id(0))
+            self.assertFalse(body['reset'])
+            self.assertEqual([e['event'] for e in body['events']], ['booking.created'])
+            self.assertEqual(body['events'][0]['data']['booking_id'], str(booking.pk))
+        self.assertEqual(self.poll(make_user('other'), last_event_id=event_id(0))['events'], [])
+
+    def test_resume_from_last_event_id(self):
+        for kind in ('one', 'two'):
+            self.broker.publish([self.guest.pk], kind, {})
+        body = self.poll(self.guest, last_event_id=event_id(1))
+        self.assertEqual([e['event'] for e in body['events']], ['two'])
+        self.assertEqual(body['last_event_id'], event_id(2))
+        # Without a resume point only newer events are returned
+        self.assertEqual(self.poll(self.guest)['events'], [])
+
+    def test_stale_or_evicted_resume_point_resets(self):
+        for _ in range(5):
+            self.broker.publish([self.guest.pk], 'change', {})
+        self.assertTrue(self.poll(self.guest, last_event_id=event_id(1))['reset'])
+        self.assertTrue(self.poll(self.guest, last_event_id='0-1')['reset'])
+
+    def test_closed_stream_loop_does_not_fail_the_publisher(self):
+        loop = asyncio.new_event_loop()
+        loop.close()
+        self.broker._subscribers[str(self.guest.pk)] = {(loop, asyncio.Event())}
+        self.broker.publish([str(self.guest.pk)], 'booking.created', {})
+        self.assertEqual(self.broker.last_seq, 1)
+
+    @override_settings(EVENT_STREAM_REDIS_URL='redis://relay:6379/0')
+    def test_events_are_relayed_through_redis(self):
+        booking = make_booking(self.listing, self.guest, date(2030, 5, 1), 2)
+        with mock.patch('listings.events._redis') as redis:
+            with self.captureOnCommitCallbacks(execute=True):
+                publish_booking_event('booking.created', booking)
+        redis.assert_called_once_with('redis://relay:6379/0')
+        channel, message = redis.return_value.publish.call_args.args
+        self.assertEqual(channel, events.RELAY_CHANNEL)
+        # Only the listener feeds the local broker, so the event is not delivered twice
+        self.assertEqual(self.broker.last_seq, 0)
+
+        events.receive(self.broker, message)
+        body = self.poll(self.host, last_event_id=event_id(0))
+        self.assertEqual([e['event'] for e in body['events']], ['booking.created'])
+
+        with mock.patch('listings.events._redis', side_effect=ConnectionError), \
+                self.assertLogs('listings.events', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                publish_booking_event('booking.cancelled', booking)
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/events/', {'wait': 0}).status_code, 401)
+        self.client.force_login(self.guest)
+        self.assertEqual(self.client.get('/api/events/', {'wait': 'soon'}).status_code, 400)
+
+
+class BookingTransitionTests(APITestCase):
+    '''user-038: single and batch booking status transitions'''
+
+    def setUp(self):
+        cache.clear()
+        self.host = make_user('host', role=USER_ROLE.HOST)
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host)
+        self.booking = make_booking(self.listing, self.guest, date(2030, 4, 1), 3)
+
+    def post(self, user, action, booking_id=None):
+        self.client.force_authenticate(user)
+        return self.client.post(f'/api/bookings/{booking_id or self.booking.pk}/{action}/')
+
+    def status(self):
+        return Booking.objects.values_list('status', flat=True).get(pk=self.booking.pk)
+
+    def test_host_confirms_and_cancels_bookings_of_their_listing(self):
+        self.assertEqual(self.post(self.host, 'confirm').status_code, 200)
+        self.assertEqual(self.status(), BOOKING_STATUS.CONFIRMED)
+        self.assertEqual(self.post(self.host, 'cancel').status_code, 200)
+        self.assertEqual(self.status(), BOOKING_STATUS.CANCELLED)
+
+    def test_permissions(self):
+        self.assertEqual(self.post(self.guest, 'confirm').status_code, 403)
+        self.assertEqual(self.post(make_user('stranger'), 'cancel').status_code, 403)
+        self.assertEqual(self.status(), BOOKING_STATUS.PENDING)
+        self.assertEqual(self.post(self.guest, 'cancel').status_code, 200)
+        self.assertEqual(self.status(), BOOKING_STATUS.CANCELLED)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.post(f'/api/bookings/{self.booking.pk}/cancel/').status_code, 401)
+
+    def test_unknown_or_malformed_booking_is_not_found(self):
+        self.assertEqual(self.post(self.host, 'confirm', '00000000-0000-0000-0000-000000000000').status_code, 404)
+        self.assertEqual(self.post(self.host, 'cancel', 'not-a-uuid').status_code, 404)
+
+    def test_invalid_transition(self):
+        self.post(self.guest, 'cancel')
+        response = self.post(self.host, 'confirm')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], 'A cancelled booking cannot be confirmed')
+
+    def test_batch_reports_each_booking_and_notifies_once(self):
+        second = make_booking(self.listing, self.guest, date(2030, 5, 1), 2)
+        done = make_booking(self.listing, self.guest, date(2030, 6, 1), 2, status=BOOKING_STATUS.CANCELLED)
+        other = make_booking(make_listing(make_user('other', role=USER_ROLE.HOST)), self.guest, date(2030, 7, 1), 2)
+        missing = '00000000-0000-0000-0000-000000000000'
+        self.client.force_authenticate(self.host)
+        with mock.patch('listings.transitions.send_booking_status_notifications.delay') as notify:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/bookings/batch-status/', {
+                    'ids': [str(self.booking.pk), str(second.pk), str(done.pk), str(other.pk), missing],
+                    'status': BOOKING_STATUS.CONFIRMED,
+                }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual({r['id']: r['result'] for r in response.data['results']}, {
+            str(self.booking.pk): 'updated', str(second.pk): 'updated', str(done.pk): 'invalid_transition',
+            str(other.pk): 'forbidden', missing: 'not_found',
+        })
+        notify.assert_called_once()
+        self.assertEqual(notify.call_args.args[0], BOOKING_STATUS.CONFIRMED)
+        self.assertEqual(len(notify.call_args.args[1]), 2)
+        self.assertEqual(Booking.objects.get(pk=other.pk).status, BOOKING_STATUS.PENDING)
+
+
+class ChapaSimulatorTests(APITestCase):
+    '''user-039: the local Chapa stub, driven through the real payment views'''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.simulator = ChapaSimulator(('127.0.0.1', 0))
+        threading.Thread(target=cls.simulator.serve_forever, daemon=True).start()
+        host, port = cls.simulator.server_address
+        cls.settings = override_settings(CHAPA_SECRET_KEY='test-key', CHAPA_BASE_URL=f'http://{host}:{port}/v1')
+        cls.settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings.disable()
+        cls.simulator.shutdown()
+        cls.simulator.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.simulator.decline_rate = 0.0
+        self.guest = make_user('guest')
+        self.booking = make_booking(make_listing(make_user('host', USER_ROLE.HOST)), self.guest, date(2030, 1, 1), 2)
+        self.client.force_authenticate(self.guest)
+
+    def pay(self):
+        response = self.client.post('/api/payments/initialize_payment/', {
+            'booking_reference': str(self.booking.pk), 'amount': '200.00',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Payment.objects.get(transaction_id=response.data['tx_ref'])
+
+    def test_initialize_then_verify(self):
+        payment = self.pay()
+        self.assertIn(payment.transaction_id, self.simulator.transactions)
+        response = self.client.get('/api/payments/verify_payment/', {'tx_ref': payment.transaction_id})
+        self.assertEqual(response.status_code, 200, response.data)
+        payment.refresh_from_db()
+        self.assertEqual(payment.payment_status, STATUS_CHOICES.SUCCESS)
+
+    def test_declined_payment_is_not_marked_successful(self):
+        self.simulator.decline_rate = 1.0
+        payment = self.pay()
+        response = self.client.get('/api/payments/verify_payment/', {'tx_ref': payment.transaction_id})
+        self.assertEqual(response.status_code, 400)
+        payment.refresh_from_db()
+        self.assertEqual(payment.payment_status, STATUS_CHOICES.PENDING)
+
+    def test_unknown_transaction(self):
+        response = self.client.get('/api/payments/verify_payment/', {'tx_ref': 'CHAPA-unknown'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/payments/verify_payment/').status_code, 400)
+
+    def test_rate_limiter_refills_over_time(self):
+        with mock.patch('listings.chapa_simulator.time.monotonic', return_value=100.0) as clock:
+            limiter = RateLimiter(2, burst=3)
+            self.assertEqual([limiter.allow() for _ in range(4)], [True, True, True, False])
+            clock.return_value = 100.5
+            self.assertEqual([limiter.allow() for _ in range(2)], [True, False])
+            clock.return_value = 110.0
+            self.assertEqual([limiter.allow() for _ in range(4)], [True, True, True, False])
+
+
+@override_settings(TRACING_SAMPLE_RATE=1.0)
+class TracingTests(TestCase):
+    '''user-040: request spans, child spans and traceparent propagation'''
+
+    def setUp(self):
+        self.exporter = tracing.MemoryExporter(100)
+        patcher = mock.patch.object(tracing, '_exporter', self.exporter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_child_spans_form_a_tree(self):
+        started = tracing.start_trace('root')
+        with tracing.span('outer') as outer:
+            with tracing.span('inner', kind='client', size=3):
+                pass
+        with self.assertRaises(ValueError):
+            with tracing.span('failing'):
+                raise ValueError('boom')
+        tracing.end_trace(started)
+        self.assertIsNone(tracing.current_span())
+
+        spans = {s['name']: s for s in self.exporter.spans(started[0].trace_id)}
+        self.assertEqual(set(spans), {'root', 'outer', 'inner', 'failing'})
+        self.assertIsNone(spans['root']['parent_id'])
+        self.assertEqual(spans['outer']['parent_id'], spans['root']['span_id'])
+        self.assertEqual(spans['inner']['parent_id'], outer.span_id)
+        self.assertEqual(spans['inner']['attributes'], {'size': 3})
+        self.assertIn('boom', spans['failing']['error'])
+        self.assertTrue(all(s['duration_ms'] >= 0 for s in spans.values()))
+
+    def test_spans_are_no_ops_outside_a_trace(self):
+        with tracing.span('orphan') as orphan:
+            self.assertIsNone(orphan)
+        self.assertEqual(self.exporter.spans(), [])
+
+    def test_traceparent(self):
+        trace_id, parent_id = 'a' * 32, 'b' * 16
+        self.assertEqual(tracing.parse_traceparent(f'00-{trace_id}-{parent_id}-01'), (trace_id, parent_id))
+        for value in (None, '', f'00-{trace_id}-{parent_id}-00', f'00-{trace_id[:-1]}-{parent_id}-01'):
+            self.assertIsNone(tracing.parse_traceparent(value))
+
+        with override_settings(TRACING_SAMPLE_RATE=0.0):
+            self.assertIsNone(tracing.start_trace('unsampled'))
+            # A sampled caller is always continued
+            started = tracing.start_trace('continued', f'00-{trace_id}-{parent_id}-01')
+        tracing.end_trace(started)
+        self.assertEqual((started[0].trace_id, started[0].parent_id), (trace_id, parent_id))
+        self.assertEqual(tracing.parse_traceparent(started[0].traceparent), (trace_id, started[0].span_id))
+
+    def test_client_traceparent_does_not_force_sampling(self):
+        header = f'00-{"a" * 32}-{"b" * 16}-01'
+        view = tracing.TracingMiddleware(lambda request: HttpResponse('ok'))
+        with override_settings(TRACING_SAMPLE_RATE=0.001), mock.patch('listings.tracing.random.random', return_value=0.5):
+            response = view(RequestFactory().get('/api/listings/', HTTP_TRACEPARENT=header))
+        self.assertNotIn('traceresponse', response)
+        self.assertEqual(self.exporter.spans(), [])
+
+    def test_async_middleware(self):
+        async def view(request):
+            self.assertIsNotNone(tracing.current_span())
+            return HttpResponse('ok')
+
+        middleware = tracing.TracingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(RequestFactory().get('/api/events/')))
+        trace_id, root_id = tracing.parse_traceparent(response['traceresponse'])
+        self.assertEqual([s['span_id'] for s in self.exporter.spans(trace_id)], [root_id])
+        self.assertIsNone(tracing.current_span())
+
+    def test_sql_spans_within_a_request(self):
+        def view(request):
+            with connection.execute_wrapper(tracing._sql_wrapper):
+                User.objects.count()
+            return HttpResponse('ok')
+
+        middleware = tracing.TracingMiddleware(view)
+        response = middleware(RequestFactory().get('/api/listings/', HTTP_TRACEPARENT=f'00-{"c" * 32}-{"d" * 16}-01'))
+        root_id = tracing.parse_traceparent(response['traceresponse'])[1]
+        spans = self.exporter.spans('c' * 32)
+        root = next(s for s in spans if s['span_id'] == root_id)
+        self.assertEqual((root['parent_id'], root['attributes']['http.status_code']), ('d' * 16, 200))
+        sql = [s for s in spans if s['name'] == 'sql']
+        self.assertEqual(len(sql), 1)
+        self.assertEqual(sql[0]['parent_id'], root_id)
+        self.assertIn('SELECT COUNT', sql[0]['attributes']['db.statement'].upper())
+
+    def test_middleware_removes_itself_when_disabled(self):
+        with override_settings(TRACING_SAMPLE_RATE=0.0):
+            with self.assertRaises(MiddlewareNotUsed):
+                tracing.TracingMiddleware(lambda request: HttpResponse())
+
+    def test_file_exporter_writes_json_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            exporter = tracing.FileExporter(str(Path(tmp) / 'traces.jsonl'))
+            with mock.patch.object(tracing, '_exporter', exporter):
+                tracing.end_trace(tracing.start_trace('root', route='/x'))
+            lines = (Path(tmp) / 'traces.jsonl').read_text().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['attributes'], {'route': '/x'})
+
+
+class ThrottlingTests(APITestCase):
+    '''user-041: GCRA token buckets and the 429 responses they produce'''
+
+    def setUp(self):
+        cache.clear()
+        caches['metrics'].clear()
+        clock = mock.patch('listings.throttling.time.time', return_value=1000.0)
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+
+    def test_burst_per_window_without_redis(self):
+        # 60 per minute with a burst of 3 is 3 requests per 3-second window, here [999 s, 1002 s)
+        self.assertEqual([throttling.take('b', 60, 3) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(throttling.take('b', 60, 3), 2.0)
+        self.clock.return_value = 1001.5
+        self.assertAlmostEqual(throttling.take('b', 60, 3), 0.5)
+        self.clock.return_value = 1002.0
+        self.assertEqual([throttling.take('b', 60, 3) for _ in range(3)], [0, 0, 0])
+        self.assertGreater(throttling.take('b', 60, 3), 0)
+        self.assertEqual(throttling.take('other', 60, 3), 0)
+
+    def test_redis_buckets_use_the_gcra_script(self):
+        client = mock.Mock()
+        client.eval.return_value = 1500
+        with mock.patch('listings.throttling._redis_client', return_value=client):
+            self.assertEqual(throttling.take('b', 60, 3), 1.5)
+        script, keys, key, now, interval, tolerance = client.eval.call_args.args
+        self.assertEqual((script, keys, now, interval, tolerance), (throttling.GCRA_SCRIPT, 1, 1000000.0, 1000.0, 3000.0))
+        self.assertTrue(key.endswith('throttle:b'))
+
+    @override_settings(THROTTLE_BUCKETS={'search': (60, 2), 'booking_write': (30, 10), 'payment': (10, 5)})
+    def test_spoofed_forwarded_for_does_not_reset_the_bucket(self):
+        statuses = [
+            self.client.get('/api/listings/', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}').status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    @override_settings(THROTTLE_BUCKETS={'search': (60, 2), 'booking_write': (30, 10), 'payment': (10, 5)})
+    def test_throttled_actions_answer_429_with_retry_after(self):
+        statuses = [self.client.get('/api/listings/').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+        response = self.client.get('/api/listings/')
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(metrics.snapshot('throttle')['search.rejected']['count'], 2)
+
+        # Buckets are per user, and unscoped actions are never throttled
+        self.client.force_authenticate(make_user('guest'))
+        self.assertEqual(self.client.get('/api/listings/').status_code, 200)
+        for _ in range(5):
+            self.assertEqual(self.client.get('/api/bookings/my_bookings/').status_code, 200)
+
+    def test_auth_benchmark_is_not_throttled(self):
+        out = io.StringIO()
+        call_command('benchmark_auth', requests=40, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines], ['basic', 'token'])
+        self.assertFalse(User.objects.filter(username='bench-auth').exists())
+
+
+class AdminTests(TestCase):
+    '''user-042: changelists for large tables and set-based bulk actions'''
+
+    def setUp(self):
+        cache.clear()
+        self.admin = make_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_login(self.admin)
+        self.host = make_user('host', role=USER_ROLE.HOST)
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host)
+        self.bookings = [
+            make_booking(self.listing, self.guest, date(2030, 1, 1) + timedelta(days=10 * i), 2, status=status)
+            for i, status in enumerate([BOOKING_STATUS.PENDING, BOOKING_STATUS.PENDING, BOOKING_STATUS.CANCELLED])
+        ]
+
+    def test_count_is_capped(self):
+        with mock.patch.object(listings_admin, 'COUNT_CAP', 2):
+            bookings = Booking.objects.order_by('-created_at')
+            self.assertEqual(listings_admin.CappedCountPaginator(bookings, 10).count, 2)
+            self.assertEqual(listings_admin.CappedCountPaginator(
+                bookings.filter(status=BOOKING_STATUS.CANCELLED), 10).count, 1)
+
+    def test_changelists_render_with_a_fixed_number_of_queries(self):
+        for model in ('user', 'listing', 'booking', 'review', 'payment', 'raterule', 'calendarfeed',
+                      'calendarblock', 'archivedbooking', 'archivedpayment'):
+            self.assertEqual(self.client.get(f'/admin/listings/{model}/').status_code, 200, model)
+
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/admin/listings/booking/')
+        for i in range(10):
+            make_booking(self.listing, make_user(f'guest{i}'), date(2031, 1, 1) + timedelta(days=5 * i), 2)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get('/admin/listings/booking/')
+        self.assertEqual(len(many), len(few))
+
+    def test_transition_actions_only_touch_eligible_bookings(self):
+        response = self.client.post('/admin/listings/booking/', {
+            'action': 'confirm_bookings', '_selected_action': [str(b.pk) for b in self.bookings],
+        }, follow=True)
+        self.assertContains(response, '2 booking(s) marked confirmed.')
+        self.assertEqual(
+            [Booking.objects.get(pk=b.pk).status for b in self.bookings],
+            [BOOKING_STATUS.CONFIRMED, BOOKING_STATUS.CONFIRMED, BOOKING_STATUS.CANCELLED],
+        )
+
+    def test_mark_failed_only_touches_pending_payments(self):
+        pending = Payment.objects.create(booking_reference=self.bookings[0], transaction_id='tx-1', amount=200)
+        paid = Payment.objects.create(booking_reference=self.bookings[1], transaction_id='tx-2', amount=200,
+                                      payment_status=STATUS_CHOICES.SUCCESS)
+        response = self.client.post('/admin/listings/payment/', {
+            'action': 'mark_failed', '_selected_action': [pending.pk, paid.pk],
+        }, follow=True)
+        self.assertContains(response, '1 payment(s) marked failed.')
+        self.assertEqual(Payment.objects.get(pk=pending.pk).payment_status, STATUS_CHOICES.FAILED)
+        self.assertEqual(Payment.objects.get(pk=paid.pk).payment_status, STATUS_CHOICES.SUCCESS)
+
+
+ICAL_FEED = (
+    'BEGIN:VCALENDAR\r\n'
+    'BEGIN:VEVENT\r\n'
+    'UID:a@other\r\n'
+    'DTSTART;VALUE=DATE:20300601\r\n'
+    'DTEND;VALUE=DATE:20300604\r\n'
+    'SUMMARY:Booked\\, via\r\n'
+    '  the other site\r\n'
+    'BEGIN:VALARM\r\n'
+    'TRIGGER:-PT15M\r\n'
+    'SUMMARY:Not the event summary\r\n'
+    'END:VALARM\r\n'
+    'END:VEVENT\r\n'
+    'BEGIN:VEVENT\r\n'
+    'UID:b@other\r\n'
+    'DTSTART:20300610T140000Z\r\n'
+    'DURATION:P1W\r\n'
+    'END:VEVENT\r\n'
+    'BEGIN:VEVENT\r\n'
+    'UID:c@other\r\n'
+    'DTSTART;VALUE=DATE:20300701\r\n'
+    'STATUS:CANCELLED\r\n'
+    'END:VEVENT\r\n'
+    'END:VCALENDAR\r\n'
+)
+
+
+def resolve_to(*addresses):
+    '''A getaddrinfo stand-in that resolves every host to ``addresses``'''
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [
+            (socket.AF_INET6 if ':' in a else socket.AF_INET, socket.SOCK_STREAM, 6, '',
+             (a, port, 0, 0) if ':' in a else (a, port))
+            for a in addresses
+        ]
+    return mock.patch('listings.calendars.socket.getaddrinfo', side_effect=getaddrinfo)
+
+
+def feed_reply(status_code=200, body='', headers=None):
+    response = mock.MagicMock(status_code=status_code, headers=headers or {})
+    response.__enter__.return_value = response
+    response.is_redirect = status_code in (301, 302, 303, 307, 308)
+    response.iter_content.return_value = [body.encode()[i:i + 50] for i in range(0, len(body.encode()), 50)]
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    return response
+
+
+class CalendarSyncTests(APITestCase):
+    '''user-043: iCal export with ETags, and safe conditional import of external feeds'''
+
+    def setUp(self):
+        cache.clear()
+        self.host = make_user('host', role=USER_ROLE.HOST)
+        self.guest = make_user('guest')
+        self.listing = make_listing(self.host)
+        self.feed = CalendarFeed.objects.create(listing=self.listing, url='https://calendar.example.com/a.ics')
+
+    def test_folded_lines_unfold_to_the_original(self):
+        summary = 'SUMMARY:' + 'Nyumba ya ufukweni – ' * 10
+        event = render_event(uuid.uuid4(), BOOKING_STATUS.CONFIRMED, date(2030, 1, 1), date(2030, 1, 3), timezone.now())
+        self.assertTrue(all(len(line.encode()) <= 75 for line in event.split('\r\n')))
+        folded = _fold(summary)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in folded.split('\r\n')))
+        self.assertEqual(list(unfold(folded.rstrip('\r\n').split('\r\n'))), [summary])
+
+    def test_events_are_parsed(self):
+        self.assertEqual(list(iter_events(ICAL_FEED.split('\r\n'))), [
+            ('a@other', date(2030, 6, 1), date(2030, 6, 4), 'Booked, via the other site'),
+            ('b@other', date(2030, 6, 10), date(2030, 6, 17), ''),
+        ])
+
+    def test_import_writes_only_the_differences(self):
+        events = [('a', date(2030, 6, 1), date(2030, 6, 4), 'x'), ('b', date(2030, 6, 10), date(2030, 6, 12), 'y'),
+                  ('old', date(2020, 1, 1), date(2020, 1, 2), 'past')]
+        self.assertEqual(apply_events(self.feed, events), {'events': 2, 'created': 2, 'updated': 0, 'removed': 0})
+        events = [('a', date(2030, 6, 1), date(2030, 6, 4), 'x'), ('b', date(2030, 6, 11), date(2030, 6, 12), 'y'),
+                  ('c', date(2030, 7, 1), date(2030, 7, 2), 'z')]
+        with CaptureQueriesContext(connection) as queries:
+            stats = apply_events(self.feed, events)
+        self.assertEqual(stats, {'events': 3, 'created': 1, 'updated': 1, 'removed': 0})
+        self.assertLess(len(queries), 10)
+        self.assertEqual(apply_events(self.feed, events[:1])['removed'], 2)
+        self.assertEqual(list(CalendarBlock.objects.values_list('uid', flat=True)), ['a'])
+
+    def test_export_feed_with_etag_and_invalidation(self):
+        booking = make_booking(self.listing, self.guest, date(2030, 5, 1), 3)
+        self.client.force_authenticate(self.host)
+        url = self.client.get(f'/api/listings/{self.listing.pk}/calendar_url/').data['url']
+        self.client.force_authenticate(None)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn(f'UID:{booking.pk}@alx-travel-app', body)
+        self.assertIn('DTSTART;VALUE=DATE:20300501', body)
+        self.assertNotIn(self.guest.email, body)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(f'/api/listings/{self.listing.pk}/calendar/?token=wrong').status_code, 403)
+
+        self.client.force_authenticate(self.guest)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/bookings/{booking.pk}/cancel/')
+        self.client.force_authenticate(None)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(str(booking.pk), response.content.decode())
+
+    def test_feed_urls_must_be_public_http(self):
+        for address in ('127.0.0.1', '10.1.2.3', '192.168.0.10', '169.254.169.254', '100.64.0.1',
+                        '0.0.0.0', '240.0.0.1', '224.0.0.1', '::1', 'fe80::1', 'fd00::1', '::ffff:127.0.0.1'):
+            with resolve_to('93.184.216.34', address), self.assertRaises(CalendarImportError, msg=address):
+                check_feed_url('https://calendar.example.com/a.ics')
+        for url in ('ftp://calendar.example.com/a.ics', 'file:///etc/passwd', 'https:///a.ics', 'http://x:port/'):
+            with resolve_to('93.184.216.34'), self.assertRaises(CalendarImportError, msg=url):
+                check_feed_url(url)
+        with resolve_to('93.184.216.34', '2606:2800:220:1::248'):
+            check_feed_url('https://calendar.example.com/a.ics')
+        with mock.patch('listings.calendars.socket.getaddrinfo', side_effect=socket.gaierror):
+            with self.assertRaises(CalendarImportError):
+                check_feed_url('https://nowhere.invalid/a.ics')
+
+    def test_feed_api_rejects_internal_urls(self):
+        self.client.force_authenticate(self.host)
+        with resolve_to('127.0.0.1'):
+            response = self.client.post('/api/calendar-feeds/', {
+                'listing': self.listing.pk, 'url': 'http://localhost:6379/',
+            })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('url', response.data)
+
+        with resolve_to('93.184.216.34'), mock.patch('listings.views.sync_calendar_feed.delay') as sync:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/calendar-feeds/', {
+                    'listing': self.listing.pk, 'url': 'https://calendar.example.com/b.ics',
+                })
+        self.assertEqual(response.status_code, 201, response.data)
+        sync.assert_called_once_with(response.data['feed_id'])
+
+    def test_feed_cannot_move_to_another_listing(self):
+        apply_events(self.feed, [('a', date(2030, 6, 1), date(2030, 6, 4), 'x')])
+        other = make_listing(self.host)
+        self.client.force_authenticate(self.host)
+        response = self.client.patch(f'/api/calendar-feeds/{self.feed.pk}/', {'listing': other.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('listing', response.data)
+        self.feed.refresh_from_db()
+        self.assertEqual(self.feed.listing_id, self.listing.pk)
+        self.assertEqual(list(CalendarBlock.objects.values_list('listing_id', flat=True)), [self.listing.pk])
+
+        response = self.client.patch(f'/api/calendar-feeds/{self.feed.pk}/', {'listing': self.listing.pk, 'name': 'Airbnb'})
+        self.assertEqual(response.status_code, 200, response.data)
+
+    def test_sync_is_conditional(self):
+        with resolve_to('93.184.216.34'), mock.patch('listings.calendars.requests.Session.get') as get:
+            get.return_value = feed_reply(body=ICAL_FEED, headers={'ETag': '"v1"'})
+            self.assertEqual(sync_feed(self.feed)['created'], 2)
+            get.return_value = feed_reply(304)
+            self.assertTrue(sync_feed(self.feed)['not_modified'])
+        self.assertEqual(get.call_args.kwargs['headers'], {'If-None-Match': '"v1"'})
+        self.assertFalse(get.call_args.kwargs['allow_redirects'])
+        self.assertEqual(CalendarBlock.objects.filter(feed=self.feed).count(), 2)
+
+    def test_redirects_are_checked_hop_by_hop(self):
+        with resolve_to('93.184.216.34'), mock.patch('listings.calendars.requests.Session.get') as get:
+            get.side_effect = [feed_reply(302, headers={'Location': '/moved.ics'}), feed_reply(body=ICAL_FEED)]
+            self.assertEqual(sync_feed(self.feed)['created'], 2)
+        self.assertEqual(get.call_args.args[0], 'https://calendar.example.com/moved.ics')
+
+        redirect = feed_reply(302, headers={'Location': 'http://169.254.169.254/latest/meta-data/'})
+        with mock.patch('listings.calendars.socket.getaddrinfo', side_effect=lambda host, port, **kw: [
+            (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('169.254.169.254' if host[0].isdigit() else '93.184.216.34', port)),
+        ]), mock.patch('listings.calendars.requests.Session.get', return_value=redirect) as get:
+            result = sync_feed(self.feed)
+        get.assert_called_once()
+        self.assertEqual(result['error'], 'Feed URL must point to a public address.')
+
+        with resolve_to('93.184.216.34'), mock.patch('listings.calendars.requests.Session.get', return_value=feed_reply(
+                301, headers={'Location': 'https://calendar.example.com/loop.ics'})):
+            self.assertEqual(sync_feed(self.feed)['error'], 'Feed redirected too many times.')
+
+    def test_fetch_connects_to_the_checked_address(self):
+        received = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                received['host'] = self.headers['Host']
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(ICAL_FEED.encode())
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        # The host never resolves, so the feed is only reachable through the checked address
+        self.feed.url = f'http://calendar.invalid:{server.server_port}/a.ics'
+        with mock.patch('listings.calendars.check_feed_url', return_value='127.0.0.1') as check:
+            self.assertEqual(sync_feed(self.feed)['created'], 2)
+        check.assert_called_once_with(self.feed.url)
+        self.assertEqual(received['host'], f'calendar.invalid:{server.server_port}')
+
+    def test_concurrent_sync_does_not_insert_a_block_twice(self):
+        def events():
+            # Another sync stores the same event while this one is still reading its feed
+            apply_events(self.feed, [('a', date(2030, 6, 1), date(2030, 6, 4), 'x')])
+            yield 'a', date(2030, 6, 1), date(2030, 6, 5), 'x'
+
+        self.assertEqual(apply_events(self.feed, events()), {'events': 1, 'created': 0, 'updated': 1, 'removed': 0})
+        self.assertEqual(CalendarBlock.objects.get(uid='a').end_date, date(2030, 6, 5))
+
+    def test_fetch_errors_do_not_leak_network_details(self):
+        errors = {
+            requests.ConnectionError('[Errno 111] Connection refused to 10.0.0.5:6379'): 'Feed could not be fetched.',
+            requests.Timeout('read timed out'): 'Feed did not respond in time.',
+        }
+        for error, message in errors.items():
+            with resolve_to('93.184.216.34'), mock.patch('listings.calendars.requests.Session.get', side_effect=error):
+                self.assertEqual(sync_feed(self.feed)['error'], message)
+            self.feed.refresh_from_db()
+            self.assertEqual(self.feed.last_error, message)
+        with resolve_to('93.184.216.34'), mock.patch('listings.calendars.requests.Session.get', return_value=feed_reply(404)):
+            self.assertEqual(sync_feed(self.feed)['error'], 'Feed returned HTTP 404.')
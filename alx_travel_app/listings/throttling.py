@@ -0,0 +1,100 @@
+"""
+Token-bucket rate limiting shared across processes.
+Each (scope, endpoint, user or IP) bucket is a single cache key holding its
+"theoretical arrival time" (GCRA, equivalent to a token bucket with
+``burst`` tokens refilled at ``per_minute``). A check is one atomic script
+call on Redis, so it costs O(1) regardless of traffic. Other cache backends
+get an add()/incr() counter per fixed window of ``burst`` requests instead,
+which is atomic on any cache but only limits across processes when the
+cache itself is shared; with the per-process LocMemCache every process has
+its own buckets. Rejections are counted in the "throttle" metrics.
+"""
+
+import time
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+from . import metrics
+
+# KEYS[1]: bucket; ARGV: now (ms), ms per request, burst tolerance (ms).
+# Returns 0 when allowed, otherwise the milliseconds to wait.
+GCRA_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + tonumber(ARGV[2])
+local allow_at = new_tat - tonumber(ARGV[3])
+if allow_at > now then return math.ceil(allow_at - now) end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now))
+return 0
+'''
+
+
+def _redis_client(key):
+    '''The redis-py client behind Django's RedisCache, or None for other backends'''
+    backend = getattr(cache, '_cache', None)
+    get_client = getattr(backend, 'get_client', None)
+    if get_client is None or 'redis' not in type(cache).__module__:
+        return None
+    return get_client(key, write=True)
+
+
+def take(bucket, per_minute, burst):
+    '''Take one token from ``bucket``; return 0 if allowed, else seconds to wait'''
+    now = time.time() * 1000.0
+    interval = 60000.0 / per_minute
+    # Up to ``burst`` requests may arrive at once
+    tolerance = interval * burst
+
+    key = f'throttle:{bucket}'
+    redis_key = cache.make_and_validate_key(key)
+    client = _redis_client(redis_key)
+    if client is not None:
+        return client.eval(GCRA_SCRIPT, 1, redis_key, now, interval, tolerance) / 1000.0
+
+    # ``burst`` requests per window of ``burst`` intervals: the same average rate
+    window = int(now // tolerance)
+    window_key = f'{key}:{window}'
+    timeout = int(tolerance // 1000) + 1
+    if not cache.add(window_key, 1, timeout):
+        try:
+            count = cache.incr(window_key)
+        except ValueError:
+            # The window expired between add() and incr()
+            cache.set(window_key, 1, timeout)
+            count = 1
+        if count > burst:
+            return ((window + 1) * tolerance - now) / 1000.0
+    return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    '''
+    Throttles the actions a view lists in ``throttle_scopes`` (action ->
+    scope); each scope's per-minute rate and burst come from THROTTLE_BUCKETS.
+    Buckets are per endpoint and per user, or per client IP when anonymous.
+    '''
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        scope = getattr(view, 'throttle_scopes', {}).get(getattr(view, 'action', None))
+        if scope is None:
+            return True
+        per_minute, burst = settings.THROTTLE_BUCKETS[scope]
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            ident = f'user:{user.pk}'
+        else:
+            ident = f'ip:{self.get_ident(request)}'
+        endpoint = f'{getattr(view, "basename", type(view).__name__)}.{view.action}'
+
+        wait = take(f'{scope}:{endpoint}:{ident}', per_minute, burst)
+        if wait:
+            self.retry_after = wait
+            metrics.incr('throttle', f'{scope}.rejected')
+            return False
+        return True
+
+    def wait(self):
+        return self.retry_after
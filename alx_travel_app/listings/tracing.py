@@ -0,0 +1,377 @@
+"""
+Built-in request tracing.
+A sampled request gets a root span (the view) with child spans for SQL,
+serializer validation/rendering, Celery enqueue, email sends and outbound
+`requests` calls. The trace context travels to workers in a W3C
+``traceparent`` Celery header, so task execution spans join the request's
+trace. Finished spans go to a JSON-lines file or an in-process buffer.
+
+Tracing is off when TRACING_SAMPLE_RATE is 0: the middleware removes itself
+and nothing is instrumented. When it is on, unsampled requests only pay for
+a context-variable lookup per instrumented call.
+"""
+
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+_current = contextvars.ContextVar('tracing_span', default=None)
+
+
+def enabled():
+    return settings.TRACING_SAMPLE_RATE > 0
+
+
+def _new_id(bits):
+    return format(random.getrandbits(bits), f'0{bits // 4}x')
+
+
+class Span:
+    '''A timed operation inside a trace'''
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'attributes',
+                 'start', '_started', 'duration_ms', 'error')
+
+    def __init__(self, name, trace_id=None, parent_id=None, kind='internal', attributes=None):
+        self.trace_id = trace_id or _new_id(128)
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000.0, 3)
+        get_exporter().export(self)
+
+    def as_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start': self.start,
+            'duration_ms': self.duration_ms,
+            'attributes': self.attributes,
+            'error': self.error,
+            'pid': os.getpid(),
+        }
+
+
+def parse_traceparent(value):
+    '''(trace_id, parent span id) from a sampled W3C traceparent, else None'''
+    parts = (value or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[3] != '01':
+        return None
+    return parts[1], parts[2]
+
+
+def current_span():
+    return _current.get()
+
+
+def start_trace(name, traceparent=None, kind='server', trusted=True, **attributes):
+    '''
+    Start a root span (continuing ``traceparent`` when given) and make it
+    current. Returns (span, token), or None when the trace is not sampled.
+    A ``trusted`` sampled traceparent (our own, e.g. a Celery header) is
+    always continued; an untrusted one, sent by a client, is continued only
+    when the local sample rate picks the request.
+    '''
+    parent = parse_traceparent(traceparent)
+    if (parent is None or not trusted) and random.random() >= settings.TRACING_SAMPLE_RATE:
+        return None
+    trace_id, parent_id = parent or (None, None)
+    root = Span(name, trace_id, parent_id, kind, attributes)
+    return root, _current.set(root)
+
+
+def end_trace(started, error=None):
+    root, token = started
+    if error is not None:
+        root.error = repr(error)
+    _current.reset(token)
+    root.finish()
+
+
+@contextmanager
+def span(name, kind='internal', **attributes):
+    '''Child span of the current span; a no-op outside a sampled trace'''
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent.span_id, kind, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        _current.reset(token)
+        child.finish()
+
+
+# ---------------------------------------------------------------------------
+# Exporters
+# ---------------------------------------------------------------------------
+
+class FileExporter:
+    '''Appends one JSON line per finished span to TRACING_FILE'''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, finished):
+        line = json.dumps(finished.as_dict(), default=str) + '\n'
+        with self.lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+class MemoryExporter:
+    '''Keeps the last TRACING_MEMORY_SPANS finished spans in process'''
+
+    def __init__(self, size):
+        self.finished = deque(maxlen=size)
+
+    def export(self, finished):
+        self.finished.append(finished.as_dict())
+
+    def spans(self, trace_id=None):
+        return [s for s in list(self.finished) if trace_id is None or s['trace_id'] == trace_id]
+
+    def clear(self):
+        self.finished.clear()
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    '''The exporter chosen by TRACING_EXPORTER ("file" or "memory")'''
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                if settings.TRACING_EXPORTER == 'memory':
+                    _exporter = MemoryExporter(settings.TRACING_MEMORY_SPANS)
+                else:
+                    _exporter = FileExporter(settings.TRACING_FILE)
+    return _exporter
+
+
+# ---------------------------------------------------------------------------
+# Instrumentation
+# ---------------------------------------------------------------------------
+
+class TracingMiddleware:
+    '''
+    Root span per sampled request, named after the view that served it.
+    Runs natively under both WSGI and ASGI, so async views such as the
+    event stream are not pushed through a thread.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = self._start(request)
+        if started is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        except BaseException as e:
+            end_trace(started, e)
+            raise
+        return self._finish(request, started, response)
+
+    async def __acall__(self, request):
+        started = self._start(request)
+        if started is None:
+            return await self.get_response(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException as e:
+            end_trace(started, e)
+            raise
+        return self._finish(request, started, response)
+
+    def _start(self, request):
+        return start_trace(
+            f'{request.method} {request.path}', request.headers.get('traceparent'), trusted=False,
+            **{'http.method': request.method, 'http.path': request.path},
+        )
+
+    def _finish(self, request, started, response):
+        root = started[0]
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            root.name = f'{request.method} {match.view_name}'
+            root.attributes['http.route'] = match.route
+        root.attributes['http.status_code'] = response.status_code
+        response['traceresponse'] = root.traceparent
+        end_trace(started)
+        return response
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    with span('sql', kind='client', **{'db.statement': sql[:500], 'db.alias': context['connection'].alias}):
+        return execute(sql, params, many, context)
+
+
+def _install_sql(connection):
+    if _sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql_wrapper)
+
+
+def _traced(name, method, kind='internal', describe=None):
+    '''Wrap ``method`` in a span when a trace is active'''
+    def wrapper(self, *args, **kwargs):
+        if _current.get() is None:
+            return method(self, *args, **kwargs)
+        attributes = describe(self, *args, **kwargs) if describe else {}
+        with span(name, kind, **attributes):
+            return method(self, *args, **kwargs)
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+def _traced_property(name, prop, describe=None):
+    return property(_traced(name, prop.fget, describe=describe), prop.fset, prop.fdel, prop.__doc__)
+
+
+def _instrument_serializers():
+    from rest_framework import serializers
+
+    def describe(self, *args, **kwargs):
+        return {'serializer': type(self).__name__}
+
+    serializers.BaseSerializer.is_valid = _traced('serializer.validate', serializers.BaseSerializer.is_valid,
+                                                  describe=describe)
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        cls.data = _traced_property('serializer.render', cls.data, describe=describe)
+
+
+def _instrument_requests():
+    import requests
+
+    send = requests.Session.send
+
+    def traced_send(self, request, **kwargs):
+        if _current.get() is None:
+            return send(self, request, **kwargs)
+        with span('http.request', 'client', **{'http.method': request.method,
+                                               'http.url': request.url.split('?')[0]}) as outbound:
+            response = send(self, request, **kwargs)
+            outbound.attributes['http.status_code'] = response.status_code
+            return response
+
+    traced_send.__wrapped__ = send
+    requests.Session.send = traced_send
+
+
+def _instrument_mail():
+    from django.core.mail import get_connection
+
+    backend = type(get_connection())
+    if not getattr(backend.send_messages, '__wrapped__', None):
+        backend.send_messages = _traced(
+            'email.send', backend.send_messages, kind='client',
+            describe=lambda self, messages: {'email.messages': len(messages), 'email.backend': type(self).__name__},
+        )
+
+
+_task_spans = {}
+_publish_spans = {}
+
+
+def _instrument_celery():
+    from celery.signals import before_task_publish, after_task_publish, task_prerun, task_postrun
+
+    @before_task_publish.connect(weak=False)
+    def start_enqueue(sender=None, headers=None, **kwargs):
+        parent = _current.get()
+        if parent is None or headers is None:
+            return
+        enqueue = Span(f'enqueue {sender}', parent.trace_id, parent.span_id, 'producer', {'celery.task': sender})
+        headers['traceparent'] = enqueue.traceparent
+        _publish_spans[headers.get('id')] = enqueue
+
+    @after_task_publish.connect(weak=False)
+    def end_enqueue(sender=None, headers=None, **kwargs):
+        enqueue = _publish_spans.pop((headers or {}).get('id'), None)
+        if enqueue is not None:
+            enqueue.finish()
+
+    @task_prerun.connect(weak=False)
+    def start_task(task_id=None, task=None, **kwargs):
+        request = task.request
+        traceparent = getattr(request, 'traceparent', None) or (request.headers or {}).get('traceparent')
+        parent = _current.get()
+        if traceparent is None and parent is not None:
+            # Eager execution: the task runs inside the caller's trace
+            traceparent = parent.traceparent
+        started = start_trace(f'task {task.name}', traceparent, kind='consumer', **{'celery.task': task.name})
+        if started is not None:
+            _task_spans[task_id] = started
+
+    @task_postrun.connect(weak=False)
+    def end_task(task_id=None, state=None, **kwargs):
+        started = _task_spans.pop(task_id, None)
+        if started is not None:
+            started[0].attributes['celery.state'] = state
+            end_trace(started)
+
+
+_installed = False
+
+
+def install():
+    '''Instrument SQL, serializers, requests, email and Celery when tracing is enabled'''
+    global _installed
+    if _installed or not enabled():
+        return
+    _installed = True
+
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(lambda sender, connection, **kwargs: _install_sql(connection), weak=False)
+    for connection in connections.all(initialized_only=True):
+        _install_sql(connection)
+
+    _instrument_serializers()
+    _instrument_requests()
+    _instrument_mail()
+    _instrument_celery()
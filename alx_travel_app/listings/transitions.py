@@ -0,0 +1,89 @@
+"""
+Booking status transitions (confirm, cancel, complete) for one or many bookings.
+A batch is checked against one locked read of the affected rows, applied
+with a single set-based UPDATE per request and announced with one grouped
+notification task, instead of saving and emailing booking by booking.
+"""
+
+import uuid
+from django.db import transaction
+from .calendars import invalidate_feeds
+from .events import publish_booking_rows
+from .models import Booking, BOOKING_STATUS
+from .tasks import send_booking_status_notifications
+
+# Target status -> (statuses it can be reached from, who may apply it)
+TRANSITIONS = {
+    BOOKING_STATUS.CONFIRMED: ((BOOKING_STATUS.PENDING,), ('host',)),
+    BOOKING_STATUS.CANCELLED: ((BOOKING_STATUS.PENDING, BOOKING_STATUS.CONFIRMED), ('host', 'guest')),
+    BOOKING_STATUS.COMPLETED: ((BOOKING_STATUS.CONFIRMED,), ('host',)),
+}
+
+MAX_BATCH_SIZE = 500
+
+# Row fields read for permission checks, events and notifications
+ROW_FIELDS = (
+    'booking_id', 'status', 'guest_id', 'listing_id', 'check_in', 'check_out',
+    'guest__email', 'listing__title', 'listing__host_id',
+)
+
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+INVALID_TRANSITION = 'invalid_transition'
+
+
+def _allowed(user, row, actors):
+    if user.is_staff:
+        return True
+    return ('host' in actors and row['listing__host_id'] == user.pk) or \
+        ('guest' in actors and row['guest_id'] == user.pk)
+
+
+def transition_bookings(user, booking_ids, target):
+    '''
+    Move the given bookings to ``target`` and return {booking_id: result}.
+    Bookings the user may not change, or that cannot reach ``target`` from
+    their current status, are reported and left untouched.
+    '''
+    target = BOOKING_STATUS(target)
+    sources, actors = TRANSITIONS[target]
+    ids = list(dict.fromkeys(str(uuid.UUID(str(i))) for i in booking_ids))
+    results = dict.fromkeys(ids, NOT_FOUND)
+
+    with transaction.atomic():
+        rows = list(
+            Booking.objects.select_for_update(of=('self',))
+            .filter(pk__in=ids).values(*ROW_FIELDS)
+        )
+        changed = []
+        for row in rows:
+            booking_id = str(row['booking_id'])
+            if not _allowed(user, row, actors):
+                results[booking_id] = FORBIDDEN
+            elif row['status'] == target:
+                results[booking_id] = UNCHANGED
+            elif row['status'] not in sources:
+                results[booking_id] = INVALID_TRANSITION
+            else:
+                results[booking_id] = UPDATED
+                changed.append(row)
+
+        if changed:
+            Booking.objects.filter(pk__in=[r['booking_id'] for r in changed]).update(status=target)
+            for row in changed:
+                row['status'] = target.value
+            publish_booking_rows(f'booking.{target.value}', changed)
+            invalidate_feeds(row['listing_id'] for row in changed)
+            notifications = [
+                {
+                    'email': row['guest__email'],
+                    'listing': row['listing__title'],
+                    'check_in': str(row['check_in']),
+                    'check_out': str(row['check_out']),
+                }
+                for row in changed
+            ]
+            transaction.on_commit(lambda: send_booking_status_notifications.delay(target.value, notifications))
+    return results
@@ -1,5 +1,9 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import ListingViewSet, BookingViewSet, PaymentViewSet
+from .views import (
+    ListingViewSet, BookingViewSet, PaymentViewSet, RateRuleViewSet, CalendarFeedViewSet, AuthTokenView,
+)
+from .streams import event_stream
 
 # Initialize DRF router
 router = DefaultRouter()
@@ -8,6 +12,11 @@ router = DefaultRouter()
 router.register(r'listings', ListingViewSet, basename='listing')
 router.register(r'bookings', BookingViewSet, basename='booking')
 router.register(r'payments', PaymentViewSet, basename='payment')
+router.register(r'rate-rules', RateRuleViewSet, basename='rate-rule')
+router.register(r'calendar-feeds', CalendarFeedViewSet, basename='calendar-feed')
 
 # Export router URLs
-urlpatterns = router.urls
+urlpatterns = [
+    path('auth/token/', AuthTokenView.as_view(), name='auth-token'),
+    path('events/', event_stream, name='event-stream'),
+] + router.urls
@@ -6,9 +6,20 @@ and ensure RESTful API conventions for both models.
 """
 
 from django.shortcuts import render
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from rest_framework import viewsets, status
-from .models import Listing, Booking, Payment
-from .serializers import ListingSerializer, BookingSerializer, PaymentSerializer
+from rest_framework.generics import get_object_or_404
+from .models import (
+    Listing, Booking, Payment, RateRule, ArchivedBooking, ArchivedPayment, CalendarFeed,
+    BOOKING_STATUS, STATUS_CHOICES,
+)
+from .serializers import (
+    ListingSerializer, BookingSerializer, PaymentSerializer, RateRuleSerializer,
+    ArchivedBookingSerializer, ArchivedPaymentSerializer, BookingStatusBatchSerializer,
+    CalendarFeedSerializer,
+)
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.db.models import Avg
@@ -18,19 +29,49 @@ from django.db.models import Q
 from django.conf import settings
 import requests
 import uuid
-from django.db import transaction
-from .tasks import send_booking_confirmation_email
+from django.db import transaction, IntegrityError
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.exceptions import PermissionDenied
+from .tasks import send_booking_confirmation_email, sync_calendar_feed
+from .exports import (
+    BOOKING_EXPORT_FIELDS, PAYMENT_EXPORT_FIELDS, ExportError,
+    filter_export_queryset, stream_export,
+)
+from .imports import ListingImporter, RejectSample, iter_records, open_text
+from .idempotency import idempotent
+from .pricing import parse_stay, quote, quote_many
+from .similarity import MAX_SIMILAR, similar_listings
+from .ranking import MAX_TOP_K, top_by_relevance
+from .filters import RelevanceOrderingFilter
+from .availability import every_check_in, feasible_check_ins, parse_window
+from .events import publish_booking_event, publish_payment_event
+from .transitions import FORBIDDEN, INVALID_TRANSITION, NOT_FOUND, UPDATED, transition_bookings
+from .calendars import check_feed_token, feed_token, get_feed
 
 
 # Create your views here.
 
+class AuthTokenView(ObtainAuthToken):
+    '''POST email and password to obtain an API token; DELETE revokes the token in use'''
+
+    def delete(self, request):
+        '''Revoke the token used to authenticate this request'''
+        if request.auth is None or not hasattr(request.auth, 'key'):
+            return Response({'error': 'Token authentication required'}, status=401)
+        request.auth.delete()
+        return Response(status=204)
+
+
 class ListingViewSet(viewsets.ModelViewSet):
     '''Provide CRUD operations, filtering, search, and ordering for listings.'''
     queryset = Listing.objects.all()
     serializer_class = ListingSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, SearchFilter, RelevanceOrderingFilter]
     search_fields = ['description', 'address', 'amenities', 'title']
-    ordering_fields = ['price_per_night', 'created_at']
+    ordering_fields = ['price_per_night', 'created_at', 'relevance_score']
+    throttle_scopes = {'list': 'search', 'similar': 'search', 'create_booking': 'booking_write'}
 
     def get_queryset(self):
         '''
@@ -56,10 +97,73 @@ class ListingViewSet(viewsets.ModelViewSet):
         if min_price and max_price:
             queryset = queryset.filter(price_per_night__gte=min_price, price_per_night__lte=max_price)
             queryset = queryset.annotate(average_rating=Avg('reviews__rating'))
-            queryset = queryset.order_by('_average_rating')
+            queryset = queryset.order_by('-average_rating')
 
         return queryset.distinct()
     
+    def list(self, request, *args, **kwargs):
+        '''
+        List listings; when start_date and end_date are given, every result on
+        the page also carries its quote_total for that stay, priced in one batch.
+        ?ordering=relevance sorts by the precomputed relevance score and
+        ?top=N returns only the N most relevant matches (bounded top-K).
+        ?window_start=&window_end=&nights= is a flexible-date search: only
+        listings that can fit the stay somewhere in the window are returned,
+        each with its available_check_ins.
+        '''
+        queryset = self.filter_queryset(self.get_queryset())
+        window = None
+        if any(request.query_params.get(p) for p in ('window_start', 'window_end', 'nights')):
+            try:
+                window = parse_window(
+                    request.query_params.get('window_start'), request.query_params.get('window_end'),
+                    request.query_params.get('nights'),
+                )
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            feasible = feasible_check_ins(queryset, *window)
+        top = request.query_params.get('top')
+        if top:
+            try:
+                top = max(1, min(int(top), MAX_TOP_K))
+            except ValueError:
+                return Response({'error': 'top must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        if window is None:
+            if top:
+                queryset = top_by_relevance(queryset, top)
+            page = self.paginate_queryset(queryset)
+            listings = list(page if page is not None else queryset)
+        else:
+            # Infeasible listings are dropped from the ordered ids rather than with
+            # a NOT IN over every one of them, which grows with the search and can
+            # pass the database's bound-parameter limit; only the page is loaded.
+            if top:
+                queryset = queryset.order_by('-relevance_score', 'listing_id')
+            ids = [pk for pk in queryset.values_list('pk', flat=True) if feasible.get(pk) != []]
+            if top:
+                ids = ids[:top]
+            page = self.paginate_queryset(ids)
+            ids = page if page is not None else ids
+            found = queryset.in_bulk(ids)
+            listings = [found[pk] for pk in ids]
+
+        context = self.get_serializer_context()
+        try:
+            check_in, check_out = parse_stay(
+                request.query_params.get('start_date'), request.query_params.get('end_date'),
+            )
+            context['quotes'] = quote_many(listings, check_in, check_out)
+        except ValueError:
+            pass
+        if window is not None:
+            every = every_check_in(*window)
+            context['check_ins'] = {l.pk: feasible.get(l.pk, every) for l in listings}
+
+        serializer = self.get_serializer_class()(listings, many=True, context=context)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
     def perform_create(self, serializer):
         '''Attach the currently authenticated user as the listing host.'''
         serializer.save(host=self.request.user)
@@ -72,6 +176,43 @@ class ListingViewSet(viewsets.ModelViewSet):
         serializer = BookingSerializer(bookings, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def quote(self, request, pk=None):
+        '''Nightly price breakdown and total for ?check_in=YYYY-MM-DD&check_out=YYYY-MM-DD'''
+        listing = self.get_object()
+        try:
+            check_in, check_out = parse_stay(
+                request.query_params.get('check_in'), request.query_params.get('check_out'),
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(quote(listing, check_in, check_out))
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        '''Top-K listings most similar to this one (?k=10, at most 50)'''
+        listing = self.get_object()
+        try:
+            k = max(1, min(int(request.query_params.get('k', 10)), MAX_SIMILAR))
+        except ValueError:
+            return Response({'error': 'k must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        matches = similar_listings(listing.pk, k)
+        if matches is None:
+            return Response(
+                {'error': 'Recommendations are being prepared, try again shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '30'},
+            )
+        found = Listing.objects.select_related('host').in_bulk([listing_id for listing_id, _ in matches])
+        results = []
+        for listing_id, distance in matches:
+            match = found.get(uuid.UUID(listing_id))
+            if match is not None:
+                data = self.get_serializer(match).data
+                data['distance'] = round(distance, 4)
+                results.append(data)
+        return Response(results)
+
     @action(detail=False, methods=['get'])
     def my_listings(self, request):
         '''Retrieve listings for the currently authenticated user.'''
@@ -80,17 +221,144 @@ class ListingViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(listing, many=True)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def bulk_import(self, request):
+        '''
+        Admin only: stream a CSV or NDJSON upload ("file") of listings into the database.
+        Hosts are given by a host_email column; rows with a listing_id are upserted.
+        '''
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'A "file" upload is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('import_format') or (
+            'ndjson' if upload.name.endswith(('.ndjson', '.jsonl')) else 'csv'
+        )
+        if fmt not in ('csv', 'ndjson'):
+            return Response({'error': 'import_format must be csv or ndjson.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rejects = RejectSample()
+        importer = ListingImporter(reject_file=rejects)
+        stats = importer.run(iter_records(open_text(upload.file), fmt))
+        return Response({**stats, 'rejected_rows': rejects.rows}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], permission_classes=[AllowAny], authentication_classes=[])
+    def calendar(self, request, pk=None):
+        '''
+        iCal feed of the listing's bookings for other platforms to poll
+        (?token= from calendar_url). Served from cache; honours If-None-Match.
+        '''
+        if not check_feed_token(pk, request.query_params.get('token')):
+            return Response({'error': 'Invalid calendar token'}, status=status.HTTP_403_FORBIDDEN)
+        feed = get_feed(pk)
+        if feed is None:
+            raise Http404
+        etag = f'"{feed["etag"]}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(feed['body'], content_type='text/calendar; charset=utf-8')
+            response['Content-Disposition'] = f'inline; filename="{pk}.ics"'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    @action(detail=True, methods=['get'])
+    def calendar_url(self, request, pk=None):
+        '''Host only: the secret iCal feed URL to give to other platforms'''
+        listing = self.get_object()
+        if listing.host_id != request.user.pk and not request.user.is_staff:
+            return Response({'error': 'Only the host can see the calendar URL'}, status=status.HTTP_403_FORBIDDEN)
+        url = reverse('listing-calendar', args=[listing.pk])
+        return Response({'url': request.build_absolute_uri(f'{url}?token={feed_token(listing.pk)}')})
+
     @action(detail=True, methods=['post'])
     def create_booking(self, request, pk=None):
         '''Create a new booking for specific listing'''
         listing = self.get_object()
         serializer = BookingSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(listing=listing, user=request.user)
+            booking = serializer.save(listing=listing, user=request.user)
+            publish_booking_event('booking.created', booking)
             return Response(serializer.data, status=201)
         return Response(serializer.errors, status=400)
     
 
+class RateRuleViewSet(viewsets.ModelViewSet):
+    '''Manage dynamic pricing rules; hosts only see and edit rules of their own listings'''
+    serializer_class = RateRuleSerializer
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['listing', 'kind']
+    ordering_fields = ['created_at']
+
+    def get_queryset(self):
+        '''Staff see every rule, hosts the rules of their listings'''
+        user = self.request.user
+        if getattr(self, 'swagger_fake_view', False) or not user.is_authenticated:
+            return RateRule.objects.none()
+        queryset = RateRule.objects.all()
+        if not user.is_staff:
+            queryset = queryset.filter(listing__host=user)
+        return queryset
+
+    def perform_create(self, serializer):
+        '''Only the listing's host (or staff) may add rules to it'''
+        self._check_host(serializer.validated_data['listing'])
+        serializer.save()
+
+    def perform_update(self, serializer):
+        '''Rules cannot be moved to another host's listing'''
+        self._check_host(serializer.instance.listing)
+        serializer.save()
+
+    def _check_host(self, listing):
+        if listing.host_id != self.request.user.pk and not self.request.user.is_staff:
+            raise PermissionDenied('You can only add pricing rules to your own listings.')
+
+
+class CalendarFeedViewSet(viewsets.ModelViewSet):
+    '''Manage external iCal feeds that block dates; hosts only see feeds of their own listings'''
+    serializer_class = CalendarFeedSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['listing']
+
+    def get_queryset(self):
+        '''Staff see every feed, hosts the feeds of their listings'''
+        user = self.request.user
+        if getattr(self, 'swagger_fake_view', False) or not user.is_authenticated:
+            return CalendarFeed.objects.none()
+        queryset = CalendarFeed.objects.all()
+        if not user.is_staff:
+            queryset = queryset.filter(listing__host=user)
+        return queryset
+
+    def perform_create(self, serializer):
+        '''Only the listing's host (or staff) may add feeds; the first import starts right away'''
+        self._check_host(serializer.validated_data['listing'])
+        self._queue_sync(serializer.save())
+
+    def perform_update(self, serializer):
+        '''A new URL is fetched from scratch'''
+        self._check_host(serializer.instance.listing)
+        if serializer.validated_data.get('url', serializer.instance.url) != serializer.instance.url:
+            feed = serializer.save(etag='', last_modified='')
+            self._queue_sync(feed)
+        else:
+            serializer.save()
+
+    @action(detail=True, methods=['post'])
+    def sync(self, request, pk=None):
+        '''Import the feed now instead of waiting for the periodic sync'''
+        self._queue_sync(self.get_object())
+        return Response({'status': 'Calendar sync queued'}, status=status.HTTP_202_ACCEPTED)
+
+    def _queue_sync(self, feed):
+        feed_id = str(feed.pk)
+        transaction.on_commit(lambda: sync_calendar_feed.delay(feed_id))
+
+    def _check_host(self, listing):
+        if listing.host_id != self.request.user.pk and not self.request.user.is_staff:
+            raise PermissionDenied('You can only import calendars into your own listings.')
+
+
 class BookingViewSet(viewsets.ModelViewSet):
     '''Provide CRUD operation, filtering, search and ordering for bookings'''
     queryset = Booking.objects.all()
@@ -99,20 +367,34 @@ class BookingViewSet(viewsets.ModelViewSet):
     filterset_fields = ['start_date', 'end_date', 'total_price']
     search_fields = ['listing__title', 'guest__username']
     ordering_fields = ['start_date', 'end_date', 'total_price']
+    throttle_scopes = {
+        action: 'booking_write'
+        for action in ('create', 'update', 'partial_update', 'cancel', 'reschedule', 'confirm', 'batch_status')
+    }
 
     def get_queryset(self):
         '''Users can only view their own bookings unless they are staff'''
+        return self._scoped_bookings(Booking)
+
+    def get_archived_queryset(self):
+        '''Archived bookings, with the same access rules and filters as get_queryset'''
+        return self._scoped_bookings(ArchivedBooking)
+
+    def _owned_bookings(self, model):
+        '''Only the ownership filter: no joins, search filters or DISTINCT, so exports can stream'''
         user = self.request.user
 
         #  Fix: prevent errors for Swagger or anonymous access
         if getattr(self, 'swagger_fake_view', False) or not user.is_authenticated:
-            return Booking.objects.none()
-
-        queryset = Booking.objects.select_related('guest', 'listing').all()
+            return model.objects.none()
 
         # Non-staff users only see their own bookings
         if not user.is_staff:
-            queryset = queryset.filter(guest=user)
+            return model.objects.filter(guest=user)
+        return model.objects.all()
+
+    def _scoped_bookings(self, model):
+        queryset = self._owned_bookings(model).select_related('guest', 'listing')
 
         # Filter by date range
         start_date = self.request.query_params.get('start_date')
@@ -130,6 +412,7 @@ class BookingViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         '''Attach the currently authenticated user as the guest'''
         booking = serializer.save(guest=self.request.user)
+        publish_booking_event('booking.created', booking)
         
         # Trigger Celery task to send booking confirmation email
         send_booking_confirmation_email.delay(
@@ -146,8 +429,9 @@ class BookingViewSet(viewsets.ModelViewSet):
         if not user.is_authenticated:
             return Response({'error': 'Authentication required'}, status=401)
         bookings = Booking.objects.filter(guest=user)
+        archived = ArchivedBooking.objects.filter(guest=user)
         serializer = self.get_serializer(bookings, many=True)
-        return Response(serializer.data)
+        return Response(serializer.data + ArchivedBookingSerializer(archived, many=True).data)
     
     @action(detail=False, methods=['get'])
     def host_bookings(self, request):
@@ -157,17 +441,66 @@ class BookingViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Authentication required'}, status=401)
         listings = Listing.objects.filter(host=user)
         bookings = Booking.objects.filter(listing__in=listings)
+        archived = ArchivedBooking.objects.filter(listing__in=listings)
         serializer = self.get_serializer(bookings, many=True)
-        return Response(serializer.data)
+        return Response(serializer.data + ArchivedBookingSerializer(archived, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        '''Fall back to the archive for bookings moved out of the hot table'''
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            archived = get_object_or_404(self.get_archived_queryset(), pk=kwargs.get(self.lookup_field))
+            return Response(ArchivedBookingSerializer(archived).data)
     
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        '''
+        Stream bookings as CSV or NDJSON.
+        Query params: export_format=csv|ndjson, date_from, date_to (created_at), status.
+        '''
+        if not request.user.is_authenticated:
+            return Response({'error': 'Authentication required'}, status=401)
+        try:
+            querysets = [
+                filter_export_queryset(qs, request.query_params, 'created_at', 'status')
+                for qs in (self._owned_bookings(Booking), self._owned_bookings(ArchivedBooking))
+            ]
+            return stream_export(
+                querysets, BOOKING_EXPORT_FIELDS,
+                request.query_params.get('export_format', 'csv'), 'bookings',
+            )
+        except ExportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def _transition(self, request, pk, target, verb):
+        '''
+        Apply one status transition by primary key. Not scoped through
+        get_object(), so hosts can act on bookings of their listings.
+        '''
+        if not request.user.is_authenticated:
+            return Response({'error': 'Authentication required'}, status=401)
+        try:
+            booking_id = str(uuid.UUID(str(pk)))
+        except ValueError:
+            return Response({'errors': 'Booking not found'}, status=404)
+        result = transition_bookings(request.user, [booking_id], target)[booking_id]
+        if result == NOT_FOUND:
+            return Response({'errors': 'Booking not found'}, status=404)
+        if result == FORBIDDEN:
+            return Response({'errors': f'You do not have permission to {verb} this booking'}, status=403)
+        if result == INVALID_TRANSITION:
+            current = Booking.objects.filter(pk=booking_id).values_list('status', flat=True).first()
+            return Response({'errors': f'A {current} booking cannot be {target.value}'}, status=400)
+        return None
+
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
-        '''Cancel a specific booking'''
-        booking = self.get_object()
-        if booking.guest != request.user and not request.user.is_staff:
-            return Response({'errors': 'You do not have permission to cancel this booking'}, status=403)
-        booking.delete()
-        return Response({'status': 'Your booking has been cancelled successfully'}, status=204)
+        '''Cancel a specific booking; it is kept, with its payments, as cancelled'''
+        error = self._transition(request, pk, BOOKING_STATUS.CANCELLED, 'cancel')
+        if error is not None:
+            return error
+        return Response({'status': 'Your booking has been cancelled successfully'}, status=200)
     
     @action(detail=True, methods=['post'])
     def reschedule(self, request, pk=None):
@@ -177,18 +510,41 @@ class BookingViewSet(viewsets.ModelViewSet):
             return Response({'errors': 'You are not permitted to reschedule this booking'}, status=403)
         serializer = BookingSerializer(booking, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            booking = serializer.save()
+            publish_booking_event('booking.rescheduled', booking)
             return Response(serializer.data)
         return Response(serializer.errors, status=400)
     
-    @action(detail=True, methods=['get'])
+    @action(detail=True, methods=['post'])
     def confirm(self, request, pk=None):
         '''Confirm a specific booking for the host'''
-        booking = self.get_object()
-        if booking.listing.host != request.user and not request.user.is_staff:
-            return Response({'errors': 'You do not have permission to confirm this booking'}, status=403)
+        error = self._transition(request, pk, BOOKING_STATUS.CONFIRMED, 'confirm')
+        if error is not None:
+            return error
         return Response({'status': 'Your booking has been confirmed'}, status=200)
 
+    @action(detail=False, methods=['post'], url_path='batch-status')
+    def batch_status(self, request):
+        '''
+        Confirm, cancel or complete many bookings at once:
+        {"ids": [...], "status": "confirmed" | "cancelled" | "completed"}.
+        Returns one result per id (updated, unchanged, not_found, forbidden
+        or invalid_transition); the other bookings are still applied.
+        '''
+        if not request.user.is_authenticated:
+            return Response({'error': 'Authentication required'}, status=401)
+        serializer = BookingStatusBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        results = transition_bookings(
+            request.user, serializer.validated_data['ids'], serializer.validated_data['status'],
+        )
+        return Response({
+            'status': serializer.validated_data['status'],
+            'updated': sum(1 for r in results.values() if r == UPDATED),
+            'results': [{'id': booking_id, 'result': result} for booking_id, result in results.items()],
+        })
+
 class PaymentViewSet(viewsets.ModelViewSet):
     '''Initialise payment by making POST request to the chapa api with booking details'''
     queryset = Payment.objects.all()
@@ -197,6 +553,8 @@ class PaymentViewSet(viewsets.ModelViewSet):
     filterset_fields = ['booking_reference', 'transaction_id', 'payment_status']
     search_fields = ['booking_reference__guest', 'booking_reference__listing']
     ordering_fields = ['payment_date', 'amount']
+    # verify_payment is Chapa's callback target, so it is not limited per client IP
+    throttle_scopes = {'initialize_payment': 'payment'}
 
 
     def get_queryset(self):
@@ -206,30 +564,42 @@ class PaymentViewSet(viewsets.ModelViewSet):
         - Search by transaction_id or payment_status.
         - Filter by query params for flexible API querying.
         '''''
+        return self._scoped_payments(Payment)
+
+    def get_archived_queryset(self):
+        '''Archived payments, with the same access rules and filters as get_queryset'''
+        return self._scoped_payments(ArchivedPayment)
+
+    def _owned_payments(self, model):
+        '''Only the role-based access filter: no joins, search filters or DISTINCT, so exports can stream'''
         user = self.request.user
 
         # Handle unauthenticated or Swagger arequest safely
-        if getattr(self, 'swagger_fake-view', False) or not user.is_authenticated:
-            return Payment.objects.none()
-        
-        # Base queryset with related objects for efficiency
-        queryset = Payment.objects.select_related(
-            'booking_reference__guest', 'booking_reference__listing'
-        )
+        if getattr(self, 'swagger_fake_view', False) or not user.is_authenticated:
+            return model.objects.none()
+
+        queryset = model.objects.all()
 
         # Role-based access control
         if hasattr(user, 'role'):
             if user.role == 'guest':
                 queryset = queryset.filter(booking_reference__guest=user) # Guests see their own payments
             elif user.role == 'host':
-                queryset = queryset.filter(booking_reference_listing__host=user) # Hosts see payments for their listings
+                queryset = queryset.filter(booking_reference__listing__host=user) # Hosts see payments for their listings
             elif user.role == 'admin':
                 pass  # Admins see all payments
             else:
-                return Payment.objects.none() # Unknown roles see no payments
+                return model.objects.none() # Unknown roles see no payments
         elif not user.is_staff:
-            return Payment.objects.none() # Non-staff users see no payments
-    
+            return model.objects.none() # Non-staff users see no payments
+        return queryset
+
+    def _scoped_payments(self, model):
+        # Base queryset with related objects for efficiency
+        queryset = self._owned_payments(model).select_related(
+            'booking_reference__guest', 'booking_reference__listing'
+        )
+
 
         # Manuel search behavior
         search_query = self.request.query_params.get('search')
@@ -251,9 +621,43 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return queryset.distinct()
 
 
+    def retrieve(self, request, *args, **kwargs):
+        '''Fall back to the archive for payments moved out of the hot table'''
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            archived = get_object_or_404(self.get_archived_queryset(), pk=kwargs.get(self.lookup_field))
+            return Response(ArchivedPaymentSerializer(archived).data)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        '''
+        Stream payments as CSV or NDJSON.
+        Query params: export_format=csv|ndjson, date_from, date_to (payment_date), status.
+        '''
+        if not request.user.is_authenticated:
+            return Response({'error': 'Authentication required'}, status=401)
+        try:
+            querysets = [
+                filter_export_queryset(qs, request.query_params, 'payment_date', 'payment_status')
+                for qs in (self._owned_payments(Payment), self._owned_payments(ArchivedPayment))
+            ]
+            return stream_export(
+                querysets, PAYMENT_EXPORT_FIELDS,
+                request.query_params.get('export_format', 'csv'), 'payments',
+            )
+        except ExportError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
     @action(detail=False, methods=['post'])
+    @idempotent('initialize_payment')
     def initialize_payment(self, request):
-        '''Send booking booking details to chapa to initialize payment process'''
+        '''
+        Send booking booking details to chapa to initialize payment process.
+        Send an Idempotency-Key header to make client retries safe.
+        '''
+        if not request.user.is_authenticated:
+            return Response({'error': 'Authentication required'}, status=401)
         chapa_secret_key = settings.CHAPA_SECRET_KEY
         if not chapa_secret_key:
             return Response({'error': 'Chapa secret key is not configured.'}, status=500)
@@ -264,71 +668,67 @@ class PaymentViewSet(viewsets.ModelViewSet):
             amount = serializer.validated_data.get('amount')
             user = request.user
 
-            # check if there is already pending payment for this booking
-            existing_payment = Payment.objects.filter(
-                booking_reference=booking,
-                payment_status='pending'
-            ).first()
-            if existing_payment:
-                return Response({'error': 'There is already a pending payment for this booking.'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Generate a unique transaction reference
+            # A single constrained insert: the partial unique index on pending
+            # payments rejects a second pending payment for the same booking
             tx_ref = f"CHAPA-{uuid.uuid4()}"
-            while Payment.objects.filter(transaction_id=tx_ref).exists():
-                tx_ref = f"CHAPA-{uuid.uuid4()}"
-
             try:
-                # USing atomic transaction to ensure data integrity
                 with transaction.atomic():
-                    # save payment details to database with pending status
                     payment = Payment.objects.create(
                         booking_reference=booking,
                         transaction_id=tx_ref,
                         amount=amount,
                         payment_status='pending'
                     )
+                    publish_payment_event(payment)
+            except IntegrityError:
+                return Response({'error': 'There is already a pending payment for this booking.'}, status=status.HTTP_400_BAD_REQUEST)
 
-                    # Prepare data for Chapa API
-                    chapa_data = {
-                        "amount": str(amount),
-                        "currency": "ETB",  # or your preferred currency
-                        "email": user.email,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "tx_ref": tx_ref,
-                        "callback_url": "https://yourdomain.com/api/payments/verify/",
-                        "return_url": "https://yourdomain.com/payment-success",
-                        "customization": {
-                            "title": "Booking Payment",
-                            "description": f"Payment for booking {booking.booking_id}"
-                        }
-                    }
-                    headers = {
-                        "Authorization": f"Bearer {chapa_secret_key}",
-                        "Content-Type": "application/json",
+            try:
+                # Prepare data for Chapa API
+                chapa_data = {
+                    "amount": str(amount),
+                    "currency": "ETB",  # or your preferred currency
+                    "email": user.email,
+                    "first_name": user.first_name,
+                    "last_name": user.last_name,
+                    "tx_ref": tx_ref,
+                    "callback_url": settings.CHAPA_CALLBACK_URL,
+                    "return_url": "https://yourdomain.com/payment-success",
+                    "customization": {
+                        "title": "Booking Payment",
+                        "description": f"Payment for booking {booking.booking_id}"
                     }
-
-                    # Call Chapa API to initialize payment
-                    response = requests.post("https://api.chapa.co/v1/transaction/initialize", json=chapa_data, headers=headers)
-                    chapa_response = response.json()
-
-                    if response.status_code == 200 and chapa_response.get('status') == 'success':
-                        return Response(chapa_response, status=status.HTTP_200_CREATED)
-                    else:
-                        payment.payment_status = 'failed'
-                        payment.save()
-                        return Response({'error': 'Failed to initialize payment with Chapa.', 'details': chapa_response}, status=status.HTTP_400_BAD_REQUEST)
+                }
+                headers = {
+                    "Authorization": f"Bearer {chapa_secret_key}",
+                    "Content-Type": "application/json",
+                }
+
+                # Call Chapa API to initialize payment (outside the insert's transaction,
+                # so the row lock is not held while waiting on the network)
+                response = requests.post(
+                    f"{settings.CHAPA_BASE_URL}/transaction/initialize",
+                    json=chapa_data, headers=headers, timeout=settings.CHAPA_TIMEOUT,
+                )
+                chapa_response = response.json()
+
+                if response.status_code == 200 and chapa_response.get('status') == 'success':
+                    # tx_ref is what the client passes to verify_payment
+                    return Response({**chapa_response, 'tx_ref': tx_ref}, status=status.HTTP_201_CREATED)
+                self._mark_failed(payment)
+                return Response({'error': 'Failed to initialize payment with Chapa.', 'details': chapa_response}, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
-                # Attempt to mark payment as failed if it was created, then return error
-                try:
-                    if 'payment' in locals():
-                        payment.payment_status = 'failed'
-                        payment.save()
-                except Exception:
-                    pass
+                # Mark the payment as failed so the booking can be paid again
+                self._mark_failed(payment)
                 return Response({'error': 'An error occurred while initializing payment.', 'details': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def _mark_failed(self, payment):
+        '''Fail a pending payment so the booking can be paid again'''
+        Payment.objects.filter(pk=payment.pk).update(payment_status='failed')
+        payment.payment_status = 'failed'
+        publish_payment_event(payment)
+
     @action(detail=False, methods=['get'])
     def verify_payment(self, request):
         '''Verify a payment using transaction ID'''
@@ -341,18 +741,25 @@ class PaymentViewSet(viewsets.ModelViewSet):
         }
 
         # Verify transaction
-        response = requests.get(f"https://api.chapa.co/v1/transaction/verify/{tx_ref}", headers=headers)
-        chapa_response = response.json()
+        try:
+            response = requests.get(
+                f"{settings.CHAPA_BASE_URL}/transaction/verify/{tx_ref}",
+                headers=headers, timeout=settings.CHAPA_TIMEOUT,
+            )
+            chapa_response = response.json()
+        except (requests.RequestException, ValueError) as e:
+            return Response({'error': 'Could not reach Chapa to verify the payment.', 'details': str(e)}, status=status.HTTP_502_BAD_GATEWAY)
 
         if response.status_code == 200 and chapa_response.get('status') == 'success':
             # Update payment status in the database
             try:
                 payment = Payment.objects.get(transaction_id=tx_ref)
-                payment.payment_status = 'successful'
+                payment.payment_status = STATUS_CHOICES.SUCCESS
                 payment.save()
+                publish_payment_event(payment)
                 return Response({'status': 'Payment verified successfully.', 'details': chapa_response}, status=status.HTTP_200_OK)
             except Payment.DoesNotExist:
-                return response({'error': 'Payment record not found.'}, status=status.HTTP_404_NOT_FOUND)
+                return Response({'error': 'Payment record not found.'}, status=status.HTTP_404_NOT_FOUND)
         return Response({'error': 'Payment verification failed.', 'details': chapa_response}, status=status.HTTP_400_BAD_REQUEST)
 
         